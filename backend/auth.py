@@ -0,0 +1,149 @@
+"""
+Ключи API ресторанов (заголовок X-Foody-Key).
+
+В merchants.api_key_hash лежит sha256 ключа: ключ — случайные 24 байта, перебор
+по хэшу бессмысленен, а детерминированный хэш можно искать по индексу (bcrypt
+на каждый запрос стоил бы десятки мс CPU).
+
+Проверка идёт через ApiKeyCache в памяти процесса: sha256 -> id мерчанта с TTL
+и LRU-вытеснением. Неизвестные ключи тоже кэшируются (на negative_ttl), так что
+перебор или старый ключ в localStorage не долбят базу. Промахи по одному ключу
+схлопываются в один запрос. В установившемся режиме запись мерчанта не делает
+лишнего похода в базу.
+
+Смена ключа (триггер на merchants, миграции 7 и 11) шлёт NOTIFY foody_api_keys с id
+мерчанта — каждая реплика выкидывает его записи и все отрицательные (новый ключ мог
+быть закэширован как неизвестный). Уведомления приходят с общего LISTEN-соединения
+(listener.Listener); пока его не было, они могли потеряться — после переподключения
+кэш очищается целиком.
+"""
+import time
+import asyncio
+import hashlib
+import secrets
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+HEADER = "X-Foody-Key"
+CHANNEL = "foody_api_keys"
+KEY_PREFIX = "KEY_"
+
+
+def hash_key(key: str) -> bytes:
+    return hashlib.sha256(key.encode("utf-8")).digest()
+
+
+def new_key() -> str:
+    return KEY_PREFIX + secrets.token_urlsafe(24)
+
+
+class ApiKeyCache:
+    def __init__(self, size: int = 10000, ttl: float = 300.0, negative_ttl: float = 30.0):
+        self.size = size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # sha256 -> (id мерчанта или None, когда протухает)
+        self._entries: "OrderedDict[bytes, Tuple[Optional[int], float]]" = OrderedDict()
+        self._by_merchant: Dict[int, Set[bytes]] = {}
+        self._inflight: Dict[bytes, asyncio.Future] = {}
+        self.generation = 0
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.reconnects = 0
+
+    def _put(self, digest: bytes, merchant_id: Optional[int]):
+        self._drop(digest)
+        ttl = self.ttl if merchant_id is not None else self.negative_ttl
+        self._entries[digest] = (merchant_id, time.monotonic() + ttl)
+        if merchant_id is not None:
+            self._by_merchant.setdefault(merchant_id, set()).add(digest)
+        while len(self._entries) > self.size:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _drop(self, digest: bytes):
+        entry = self._entries.pop(digest, None)
+        if entry is not None and entry[0] is not None:
+            keys = self._by_merchant.get(entry[0])
+            if keys is not None:
+                keys.discard(digest)
+                if not keys:
+                    del self._by_merchant[entry[0]]
+
+    async def verify(self, key: str, lookup: Callable[[bytes], Awaitable[Optional[int]]]) -> Optional[int]:
+        """
+        id мерчанта по ключу или None. lookup(sha256) ходит в базу только на промахе.
+        """
+        digest = hash_key(key)
+        entry = self._entries.get(digest)
+        if entry is not None and time.monotonic() < entry[1]:
+            self._entries.move_to_end(digest)
+            if entry[0] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return entry[0]
+
+        # single-flight: одновременные промахи по одному ключу ждут один запрос
+        pending = self._inflight.get(digest)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        self.misses += 1
+        generation = self.generation
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[digest] = fut
+        try:
+            merchant_id = await lookup(digest)
+        except BaseException as e:
+            fut.set_exception(e)
+            # ждущим отдаём ту же ошибку; без них — не шумим "exception was never retrieved"
+            fut.exception()
+            raise
+        finally:
+            self._inflight.pop(digest, None)
+        fut.set_result(merchant_id)
+        # пока шёл запрос, ключ могли сменить — тогда ответ не кэшируем
+        if generation == self.generation:
+            self._put(digest, merchant_id)
+        return merchant_id
+
+    def invalidate_merchant(self, merchant_id: int):
+        self.generation += 1
+        self.invalidations += 1
+        for digest in list(self._by_merchant.get(merchant_id, ())):
+            self._drop(digest)
+        # ключ мог появиться впервые (INSERT, перенос из foody_*) — «неизвестные» больше не верны
+        for digest in [d for d, (mid, _) in self._entries.items() if mid is None]:
+            self._drop(digest)
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+        self._by_merchant.clear()
+        self.invalidations += 1
+
+    def on_notify(self, conn, pid, channel, payload: str):
+        try:
+            self.invalidate_merchant(int(payload))
+        except ValueError:
+            print("API_KEYS_BAD_PAYLOAD:", payload[:200])
+
+    def on_reconnect(self):
+        self.reconnects += 1
+        self.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.negative_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.negative_hits) / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "reconnects": self.reconnects,
+        }
@@ -0,0 +1,93 @@
+"""
+Пространственный индекс ресторанов в памяти процесса.
+
+Равномерная сетка по широте/долготе: точка попадает в ячейку размером
+cell_deg x cell_deg, поиск в радиусе обходит только ячейки, покрывающие
+bounding box круга, и уже по ним считает точное расстояние (haversine).
+Стоимость запроса зависит от плотности точек рядом, а не от их общего числа.
+"""
+import math
+from typing import Dict, List, Tuple
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG_LAT = math.pi * EARTH_RADIUS_KM / 180.0
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GeoGrid:
+    def __init__(self, cell_deg: float = 0.02):
+        self.cell_deg = cell_deg
+        self._cols = int(round(360.0 / cell_deg))
+        self._cells: Dict[Tuple[int, int], Dict[int, Tuple[float, float]]] = {}
+        self._points: Dict[int, Tuple[float, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def _row(self, lat: float) -> int:
+        return math.floor((lat + 90.0) / self.cell_deg)
+
+    def _col(self, lng: float) -> int:
+        return math.floor((lng + 180.0) / self.cell_deg) % self._cols
+
+    def upsert(self, key: int, lat: float, lng: float):
+        self.remove(key)
+        cell = (self._row(lat), self._col(lng))
+        self._cells.setdefault(cell, {})[key] = (lat, lng)
+        self._points[key] = (lat, lng)
+
+    def remove(self, key: int):
+        old = self._points.pop(key, None)
+        if old is None:
+            return
+        cell = (self._row(old[0]), self._col(old[1]))
+        bucket = self._cells.get(cell)
+        if bucket is not None:
+            bucket.pop(key, None)
+            if not bucket:
+                del self._cells[cell]
+
+    def nearby(self, lat: float, lng: float, radius_km: float) -> List[Tuple[int, float]]:
+        """
+        [(key, distance_km), ...] в радиусе radius_km, отсортировано по расстоянию.
+        """
+        dlat = radius_km / KM_PER_DEG_LAT
+        cos_lat = math.cos(math.radians(lat))
+        if cos_lat * KM_PER_DEG_LAT * 180.0 <= radius_km:
+            dlng = 180.0  # у полюса круг накрывает все долготы
+        else:
+            dlng = min(180.0, radius_km / (KM_PER_DEG_LAT * cos_lat))
+
+        r0, r1 = self._row(max(-90.0, lat - dlat)), self._row(min(90.0, lat + dlat))
+        c0 = math.floor((lng - dlng + 180.0) / self.cell_deg)
+        c1 = math.floor((lng + dlng + 180.0) / self.cell_deg)
+        if c1 - c0 + 1 >= self._cols:
+            cols = range(self._cols)
+        else:
+            cols = [c % self._cols for c in range(c0, c1 + 1)]
+
+        found: List[Tuple[int, float]] = []
+        if (r1 - r0 + 1) * len(cols) > len(self._points):
+            # ячеек больше, чем точек: дешевле пройти по всем точкам
+            candidates = [self._points.items()]
+        else:
+            candidates = [
+                self._cells[(r, c)].items()
+                for r in range(r0, r1 + 1)
+                for c in cols
+                if (r, c) in self._cells
+            ]
+        for items in candidates:
+            for key, (plat, plng) in items:
+                d = haversine_km(lat, lng, plat, plng)
+                if d <= radius_km:
+                    found.append((key, d))
+        found.sort(key=lambda x: x[1])
+        return found
@@ -0,0 +1,108 @@
+"""
+Производные изображения офферов: ресайз, AVIF/WebP/JPEG, без EXIF.
+
+Кодирование — CPU-bound, поэтому render_variants выполняется в пуле процессов
+(см. render), а не в потоке event loop. Раскладка ключей фиксирована:
+
+  offers/<hex>/<width>.<ext>   для каждой ширины из WIDTHS и формата из FORMATS
+
+image_url оффера указывает на самый большой JPEG, и по нему srcset_for()
+восстанавливает карту всех вариантов без обращения к базе.
+"""
+import io
+import os
+import re
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+WIDTHS = (320, 640, 1280)
+# (формат в srcset, расширение, формат PIL, content-type, параметры сохранения)
+FORMATS = (
+    ("avif", "avif", "AVIF", "image/avif", {"quality": 55, "speed": 8}),
+    ("webp", "webp", "WEBP", "image/webp", {"quality": 80, "method": 4}),
+    ("jpeg", "jpg", "JPEG", "image/jpeg", {"quality": 82, "progressive": True, "optimize": True}),
+)
+
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", "2"))
+# Защита от «пиксельных бомб»: 40 Мп хватает любому телефону
+Image.MAX_IMAGE_PIXELS = int(os.environ.get("IMAGE_MAX_PIXELS", str(40_000_000)))
+
+_KEY_RE = re.compile(r"^(?P<base>.*/offers/[0-9a-f]{32})/%d\.jpg$" % WIDTHS[-1])
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+class BadImage(Exception):
+    pass
+
+
+def variant_key(base_key: str, width: int, ext: str) -> str:
+    return f"{base_key}/{width}.{ext}"
+
+
+def main_key(base_key: str) -> str:
+    return variant_key(base_key, WIDTHS[-1], "jpg")
+
+
+def render_variants(data: bytes) -> List[Tuple[int, str, str, bytes]]:
+    """
+    [(width, ext, content_type, body), ...]. Выполняется в дочернем процессе.
+    """
+    try:
+        src = Image.open(io.BytesIO(data))
+        src.load()
+    except Exception as e:
+        raise BadImage(f"Cannot decode image: {e}")
+    # поворот по EXIF применяем к пикселям — сами EXIF-данные (GPS и пр.) не сохраняем
+    src = ImageOps.exif_transpose(src)
+    if src.mode not in ("RGB", "RGBA"):
+        src = src.convert("RGBA" if "A" in src.getbands() or "transparency" in src.info else "RGB")
+
+    out = []
+    for width in WIDTHS:
+        img = src.copy()
+        img.thumbnail((width, width * 4), Image.LANCZOS)  # по ширине, без увеличения
+        for _, ext, pil_format, content_type, params in FORMATS:
+            frame = img.convert("RGB") if pil_format == "JPEG" and img.mode != "RGB" else img
+            buf = io.BytesIO()
+            frame.save(buf, pil_format, **params)
+            out.append((width, ext, content_type, buf.getvalue()))
+    return out
+
+
+def _executor() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: форк процесса с работающим event loop и потоками boto3 небезопасен
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+async def render(data: bytes) -> List[Tuple[int, str, str, bytes]]:
+    return await asyncio.get_running_loop().run_in_executor(_executor(), render_variants, data)
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def srcset_for(image_url: Optional[str]) -> Optional[Dict[str, Dict[str, str]]]:
+    """
+    {"avif": {"320": url, ...}, "webp": {...}, "jpeg": {...}} для картинок,
+    загруженных с производными; None — для старых/внешних URL.
+    """
+    m = _KEY_RE.match(image_url or "")
+    if not m:
+        return None
+    base = m.group("base")
+    return {
+        name: {str(w): f"{base}/{w}.{ext}" for w in WIDTHS}
+        for name, ext, _, _, _ in FORMATS
+    }
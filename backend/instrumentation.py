@@ -0,0 +1,132 @@
+"""
+Метрики Prometheus (GET /metrics) и лог медленных запросов.
+
+  foody_http_*        — ASGI-middleware: задержка и число ответов по шаблону маршрута
+                        (/public/offers/page, а не конкретный URL — кардинальность ограничена);
+  foody_db_*          — ожидание соединения из пула и время каждого запроса asyncpg
+                        (query logger на соединении), запросы дольше DB_SLOW_QUERY_MS
+                        пишутся в лог как SLOW_QUERY с текстом SQL (без аргументов — там телефоны);
+  foody_serialize_*   — сборка JSON витрины;
+  foody_r2_*          — вызовы boto3 к R2 по операциям и ожидание свободного потока;
+  foody_<раздел>_*    — текущие счётчики из JSON-статистики (pool, feed, reservations, ...).
+
+Так по одной витрине видно, ушло время в пул, в Postgres или в сериализацию.
+"""
+import os
+import time
+from functools import lru_cache
+from typing import Any, Callable, Dict
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+DB_SLOW_QUERY_MS = float(os.environ.get("DB_SLOW_QUERY_MS", "200"))
+SLOW_SQL_MAX_CHARS = 1000
+
+# от быстрых ответов из кэша (доли мс) до выгрузок и загрузок фото
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HTTP_REQUESTS = Counter("foody_http_requests_total", "HTTP responses", ["method", "route", "status"])
+HTTP_LATENCY = Histogram("foody_http_request_duration_seconds", "HTTP request duration until the last body chunk",
+                         ["method", "route"], buckets=LATENCY_BUCKETS)
+HTTP_IN_FLIGHT = Gauge("foody_http_requests_in_flight", "HTTP requests being handled")
+
+DB_ACQUIRE = Histogram("foody_db_pool_acquire_seconds", "Wait for a pooled connection", buckets=LATENCY_BUCKETS)
+DB_QUERY = Histogram("foody_db_query_duration_seconds", "asyncpg query duration", ["op"], buckets=LATENCY_BUCKETS)
+DB_QUERY_ERRORS = Counter("foody_db_query_errors_total", "asyncpg queries that raised", ["op"])
+DB_SLOW_QUERIES = Counter("foody_db_slow_queries_total", "Queries slower than DB_SLOW_QUERY_MS", ["op"])
+
+SERIALIZE = Histogram("foody_serialize_seconds", "Response JSON serialization", ["what"], buckets=LATENCY_BUCKETS)
+
+R2_CALL = Histogram("foody_r2_call_seconds", "boto3 call to R2", ["op"], buckets=LATENCY_BUCKETS)
+R2_WAIT = Histogram("foody_r2_executor_wait_seconds", "Wait for a free R2 worker thread", buckets=LATENCY_BUCKETS)
+R2_ERRORS = Counter("foody_r2_errors_total", "Failed boto3 calls to R2", ["op"])
+R2_BYTES = Counter("foody_r2_uploaded_bytes_total", "Bytes sent to R2")
+
+_OPS = {"select", "insert", "update", "delete", "with", "copy", "begin", "commit", "rollback", "listen"}
+
+
+@lru_cache(maxsize=1024)
+def _op(query: str) -> str:
+    word = query.lstrip().split(None, 1)[0].lower() if query.strip() else ""
+    return word if word in _OPS else "other"
+
+
+def query_logger(record):
+    op = _op(record.query)
+    DB_QUERY.labels(op).observe(record.elapsed)
+    if record.exception is not None:
+        DB_QUERY_ERRORS.labels(op).inc()
+    if record.elapsed * 1000 >= DB_SLOW_QUERY_MS:
+        DB_SLOW_QUERIES.labels(op).inc()
+        print("SLOW_QUERY:", f"{record.elapsed * 1000:.1f}ms", " ".join(record.query.split())[:SLOW_SQL_MAX_CHARS])
+
+
+async def init_connection(conn):
+    """
+    init= для asyncpg.create_pool: вешает query_logger на каждое новое соединение.
+    """
+    conn.add_query_logger(query_logger)
+
+
+class MetricsMiddleware:
+    """
+    Чистый ASGI (не BaseHTTPMiddleware): не буферизует стримы выгрузок и SSE.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        t0 = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            # роутер FastAPI кладёт сработавший маршрут в тот же scope
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope["method"]
+            HTTP_LATENCY.labels(method, route).observe(time.perf_counter() - t0)
+            HTTP_REQUESTS.labels(method, route, str(status)).inc()
+
+
+class _StatsCollector:
+    def __init__(self, sources: Dict[str, Callable[[], Dict[str, Any]]]):
+        self.sources = sources
+
+    def describe(self):
+        # не дёргаем источники при регистрации — они могут быть ещё не готовы
+        return []
+
+    def collect(self):
+        for section, fn in self.sources.items():
+            try:
+                stats = fn()
+            except Exception as e:
+                print("METRICS_COLLECT_ERROR:", section, repr(e))
+                continue
+            for key, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                g = GaugeMetricFamily(f"foody_{section}_{key}", f"{section} {key}")
+                g.add_metric([], value)
+                yield g
+
+
+def register_stats(sources: Dict[str, Callable[[], Dict[str, Any]]]):
+    REGISTRY.register(_StatsCollector(sources))
+
+
+def render() -> tuple:
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,53 @@
+"""
+Сериализация ответов с офферами в байты.
+
+  std  — как FastAPI по умолчанию: jsonable_encoder обходит каждое значение,
+         затем json.dumps (то, что делает JSONResponse);
+  fast — orjson сразу из dict'ов строк asyncpg: datetime и str кодируются в C,
+         в Python уходит только Decimal (через default).
+
+На данных офферов оба режима дают одинаковые байты (Decimal — как в jsonable_encoder:
+int без дробной части, иначе float), поэтому ETag витрины не меняется при переключении.
+Расходятся только float с экспонентой (1e+16 против 1e16) — у цен numeric(10,2) их не бывает.
+Режим задаётся на эндпоинт: JSON_ENCODER — общий, JSON_ENCODER_<ИМЯ> — для одного
+(FEED, PAGE, NEARBY).
+"""
+import os
+import json
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+MODES = ("std", "fast")
+DEFAULT_MODE = os.environ.get("JSON_ENCODER", "fast")
+
+
+def mode_for(endpoint: str) -> str:
+    mode = os.environ.get(f"JSON_ENCODER_{endpoint.upper()}", DEFAULT_MODE)
+    if mode not in MODES:
+        raise ValueError(f"JSON_ENCODER_{endpoint.upper()} must be one of {', '.join(MODES)}, got {mode!r}")
+    return mode
+
+
+def _default(value: Any):
+    if isinstance(value, Decimal):
+        # как fastapi.encoders.decimal_encoder
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps_std(data: Any) -> bytes:
+    # Те же параметры, что у JSONResponse в FastAPI
+    return json.dumps(
+        jsonable_encoder(data), ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def dumps_fast(data: Any) -> bytes:
+    return orjson.dumps(data, default=_default)
+
+
+def encoder(endpoint: str):
+    return dumps_fast if mode_for(endpoint) == "fast" else dumps_std
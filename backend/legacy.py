@@ -0,0 +1,296 @@
+"""
+Перенос старой схемы foody_* (TEXT restaurant_id, price_cents, qty_left) в каноническую (store.py).
+
+Онлайн и пачками: keyset по id legacy-таблицы, прогресс пишется в legacy_backfill в той же
+транзакции, что и пачка, — после рестарта перенос продолжается с места. Каждая legacy-строка
+переносится не больше одного раза (уникальные legacy_* колонки + ON CONFLICT DO NOTHING).
+
+Шаги по порядку:
+  restaurants -> merchants   restaurant_id из цифр — это id мерчанта (как в миграции 7):
+                             существующему проставляется legacy_restaurant_id, иначе мерчант
+                             создаётся с этим id; остальные — новые мерчанты, ключ API из api_key;
+  offers      -> offers      через merchants.legacy_restaurant_id, деньги уже в копейках;
+  redeems     -> reservations (status='redeemed') через offers.legacy_id, сумма погашения
+                             сохраняется в legacy_amount_cents (её читают выгрузки).
+Офферы без перенесённого ресторана, погашения без перенесённого оффера и строки, упёршиеся
+в конфликт (код погашения уже занят), пропускаются: их число за пачку пишется в лог
+(LEGACY_BACKFILL_SKIPPED) и копится в legacy_backfill.skipped. id legacy-таблицы бывает TEXT
+(миграция 2 это допускает) — keyset тогда идёт по id из цифр, остальные строки не переносятся
+и считаются в legacy_backfill.non_integer_ids.
+
+Проход идёт под замком sweeper: пока переносится история, sweeper не уносит в архив
+офферы, погашения которых ещё не перенесены.
+
+Пока все шаги хоть раз не догнали свои таблицы (caught_up), чтение двойное (main.py включает
+его явно: LEGACY_DUAL_READ, перенос включён, foody_* на месте и не пусты): перед чтением
+витрины sync_live() переносит живые legacy-офферы, resolve_restaurant() — ресторан по
+restaurant_id. Дальше горячие запросы идут только в каноническую схему. Проходы
+продолжаются и подбирают строки, которые ещё вставляет старый сервис; изменения уже
+перенесённых строк не переносятся — старый сервис на запись нужно остановить. Исключение — координаты:
+их правки в foody_restaurants доезжают до merchants триггером (миграция 9).
+"""
+from typing import Any, Dict, List, Optional
+
+import asyncpg
+
+import sweeper
+
+STEPS = ("restaurants", "offers", "redeems")
+
+# живой legacy-оффер: то, что попало бы в витрину
+_LIVE_LEGACY_OFFER = "fo.status = 'active' AND fo.expires_at > NOW() AND fo.qty_left > 0"
+
+_RESTAURANT_SRC = r"""
+    SELECT fr.id, fr.restaurant_id, COALESCE(NULLIF(fr.name, ''), fr.restaurant_id) AS name,
+           fr.phone, fr.address, fr.lat, fr.lng, COALESCE(fr.created_at, NOW()) AS created_at,
+           CASE WHEN fr.restaurant_id ~ '^\d{{1,9}}$' THEN fr.restaurant_id::int END AS numeric_id,
+           CASE WHEN COALESCE(fr.api_key, '') <> '' THEN sha256(convert_to(fr.api_key, 'UTF8')) END AS key_hash
+    FROM foody_restaurants fr
+    WHERE fr.restaurant_id IS NOT NULL AND ({where})
+"""
+
+# ключ берём, только если он ещё ни у кого не занят (и один раз на пачку)
+_KEY_OR_NULL = """
+    CASE WHEN s.key_hash IS NOT NULL
+          AND row_number() OVER (PARTITION BY s.key_hash ORDER BY s.id) = 1
+          AND NOT EXISTS (SELECT 1 FROM merchants k WHERE k.api_key_hash = s.key_hash)
+         THEN s.key_hash END
+"""
+
+_RESTAURANTS_NUMERIC_SQL = """
+    WITH src AS ({src}), linked AS (
+      UPDATE merchants m
+      SET legacy_restaurant_id = s.restaurant_id,
+          lat = CASE WHEN m.lat IS NULL AND m.lng IS NULL THEN s.lat ELSE m.lat END,
+          lng = CASE WHEN m.lat IS NULL AND m.lng IS NULL THEN s.lng ELSE m.lng END
+      FROM src s
+      WHERE m.id = s.numeric_id AND m.legacy_restaurant_id IS NULL
+      RETURNING m.id
+    ), created AS (
+      INSERT INTO merchants (id, name, address, phone, lat, lng, created_at, legacy_restaurant_id, api_key_hash)
+      SELECT s.numeric_id, s.name, s.address, s.phone, s.lat, s.lng, s.created_at, s.restaurant_id, {key}
+      FROM src s
+      WHERE s.numeric_id IS NOT NULL
+        AND NOT EXISTS (SELECT 1 FROM merchants m WHERE m.id = s.numeric_id)
+      ON CONFLICT DO NOTHING
+      RETURNING id
+    )
+    SELECT (SELECT COUNT(*) FROM linked) + (SELECT COUNT(*) FROM created)
+"""
+
+_RESTAURANTS_TEXT_SQL = """
+    WITH src AS ({src}), created AS (
+      INSERT INTO merchants (name, address, phone, lat, lng, created_at, legacy_restaurant_id, api_key_hash)
+      SELECT s.name, s.address, s.phone, s.lat, s.lng, s.created_at, s.restaurant_id, {key}
+      FROM src s
+      WHERE s.numeric_id IS NULL
+      ON CONFLICT DO NOTHING
+      RETURNING id
+    )
+    SELECT COUNT(*) FROM created
+"""
+
+# мерчанты с явным id — сдвигаем SERIAL вперёд, иначе следующий INSERT без id упадёт на merchants_pkey
+_BUMP_MERCHANTS_SEQ_SQL = """
+    SELECT setval(pg_get_serial_sequence('merchants', 'id'), MAX(id)) FROM merchants
+    HAVING MAX(id) > (SELECT last_value FROM merchants_id_seq)
+"""
+
+_OFFERS_SQL = """
+    WITH created AS (
+      INSERT INTO offers (merchant_id, title, description, category, price, price_cents, original_price_cents,
+                          stock, image_url, expires_at, status, created_at, legacy_id)
+      SELECT m.id, COALESCE(NULLIF(fo.title, ''), 'Без названия'), fo.description, 'other',
+             (COALESCE(fo.price_cents, 0) / 100.0)::numeric(12, 2), COALESCE(fo.price_cents, 0),
+             fo.original_price_cents, GREATEST(COALESCE(fo.qty_left, 0), 0),
+             COALESCE(NULLIF(fo.image_url, ''), {no_photo}), COALESCE(fo.expires_at, fo.created_at, NOW()),
+             COALESCE(fo.status, 'active'), COALESCE(fo.created_at, NOW()), fo.id
+      FROM foody_offers fo
+      JOIN merchants m ON m.legacy_restaurant_id = fo.restaurant_id
+      WHERE {where}
+      ON CONFLICT DO NOTHING
+      RETURNING id
+    )
+    SELECT COUNT(*) FROM created
+"""
+
+_REDEEMS_SQL = """
+    WITH created AS (
+      INSERT INTO reservations (offer_id, code, qty, status, hold_until, redeemed_at, created_at, legacy_redeem_id,
+                                legacy_amount_cents)
+      SELECT o.id, upper(r.code), 1, 'redeemed', COALESCE(r.redeemed_at, NOW()), r.redeemed_at,
+             COALESCE(r.redeemed_at, NOW()), r.id, r.amount_cents
+      FROM foody_redeems r
+      JOIN offers o ON o.legacy_id = r.offer_id
+      WHERE {where}
+      ON CONFLICT DO NOTHING
+      RETURNING id
+    )
+    SELECT COUNT(*) FROM created
+"""
+
+_TABLES = {"restaurants": "foody_restaurants", "offers": "foody_offers", "redeems": "foody_redeems"}
+
+# ключ keyset для нецелого id: только id из цифр, у остальных строк ключа нет
+_TEXT_ID_KEY = r"CASE WHEN {t}.id::text ~ '^\d{1,18}$' THEN {t}.id::text::bigint END"
+
+# строка x пачки осталась без канонической пары — пропущена
+_MISSING = {
+    "restaurants": "NOT EXISTS (SELECT 1 FROM merchants m WHERE m.legacy_restaurant_id = x.restaurant_id)",
+    "offers": "NOT EXISTS (SELECT 1 FROM offers o WHERE o.legacy_id = x.id) "
+              "AND NOT EXISTS (SELECT 1 FROM offers_archive o WHERE o.legacy_id = x.id)",
+    "redeems": "NOT EXISTS (SELECT 1 FROM reservations r WHERE r.legacy_redeem_id = x.id)",
+}
+
+
+async def _sync_restaurants(conn: asyncpg.Connection, where: str, args: List[Any]) -> int:
+    src = _RESTAURANT_SRC.format(where=where)
+    copied = await conn.fetchval(_RESTAURANTS_NUMERIC_SQL.format(src=src, key=_KEY_OR_NULL), *args)
+    await conn.execute(_BUMP_MERCHANTS_SEQ_SQL)
+    copied += await conn.fetchval(_RESTAURANTS_TEXT_SQL.format(src=src, key=_KEY_OR_NULL), *args)
+    return copied
+
+
+async def _copy(conn: asyncpg.Connection, step: str, where: str, args: List[Any], no_photo_url: str) -> int:
+    if step == "restaurants":
+        return await _sync_restaurants(conn, where.replace("{t}", "fr"), args)
+    if step == "offers":
+        sql = _OFFERS_SQL.format(where=where.replace("{t}", "fo"), no_photo=f"${len(args) + 1}")
+        return await conn.fetchval(sql, *args, no_photo_url)
+    return await conn.fetchval(_REDEEMS_SQL.format(where=where.replace("{t}", "r")), *args)
+
+
+# тип id legacy-таблицы на процесс не меняется — смотрим в information_schema один раз
+_id_keys: Dict[str, str] = {}
+
+
+async def _id_key(conn: asyncpg.Connection, table: str) -> str:
+    if table not in _id_keys:
+        typ = await conn.fetchval(
+            """
+            SELECT data_type FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = $1 AND column_name = 'id'
+            """,
+            table,
+        )
+        _id_keys[table] = "{t}.id" if typ in ("integer", "bigint", "smallint") else _TEXT_ID_KEY
+    return _id_keys[table]
+
+
+async def backfill_batch(conn: asyncpg.Connection, step: str, batch: int, no_photo_url: str) -> tuple[int, int, bool]:
+    """
+    Одна пачка шага в своей транзакции. Возвращает (перенесено, пропущено, догнали ли таблицу).
+    """
+    table = _TABLES[step]
+    async with conn.transaction():
+        state = await conn.fetchrow("SELECT last_id, non_integer_ids FROM legacy_backfill WHERE step = $1", step)
+        last_id = state["last_id"] if state else 0
+        key = await _id_key(conn, table)
+        x = key.replace("{t}", "x")
+        bounds = await conn.fetchrow(
+            f"SELECT MAX(id) AS hi, COUNT(*) AS seen FROM "
+            f"(SELECT {x} AS id FROM {table} x WHERE {x} > $1 ORDER BY {x} LIMIT $2) s",
+            last_id, batch,
+        )
+        copied = skipped = 0
+        if bounds["seen"]:
+            where, args = f"{key} > $1 AND {key} <= $2", [last_id, bounds["hi"]]
+            copied = await _copy(conn, step, where, args, no_photo_url)
+            skipped = await conn.fetchval(
+                f"SELECT COUNT(*) FROM {table} x WHERE {where.replace('{t}', 'x')} AND {_MISSING[step]}", *args
+            )
+            if skipped:
+                print("LEGACY_BACKFILL_SKIPPED:", step, f"id {last_id + 1}..{bounds['hi']}", skipped)
+        caught_up = bounds["seen"] < batch
+        non_integer = state["non_integer_ids"] if state else 0
+        if caught_up and key != "{t}.id":
+            counted = await conn.fetchval(f"SELECT COUNT(*) FROM {table} x WHERE {x} IS NULL")
+            if counted != non_integer:
+                print("LEGACY_BACKFILL_NON_INTEGER_IDS:", step, counted)
+                non_integer = counted
+        await conn.execute(
+            """
+            INSERT INTO legacy_backfill (step, last_id, copied, skipped, non_integer_ids, caught_up_at)
+            VALUES ($1, $2, $3, $4, $5, CASE WHEN $6 THEN NOW() END)
+            ON CONFLICT (step) DO UPDATE
+            SET last_id = EXCLUDED.last_id,
+                copied = legacy_backfill.copied + EXCLUDED.copied,
+                skipped = legacy_backfill.skipped + EXCLUDED.skipped,
+                non_integer_ids = EXCLUDED.non_integer_ids,
+                caught_up_at = COALESCE(legacy_backfill.caught_up_at, EXCLUDED.caught_up_at),
+                updated_at = NOW()
+            """,
+            step, bounds["hi"] or last_id, copied, skipped, non_integer, caught_up,
+        )
+    return copied, skipped, caught_up
+
+
+async def backfill(conn: asyncpg.Connection, batch: int, no_photo_url: str) -> Optional[Dict[str, int]]:
+    """
+    Проход по всем шагам до конца legacy-таблиц: {шаг: перенесено, "<шаг>_skipped": пропущено}.
+    None — замок sweeper занят, проход пропущен.
+    """
+    if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", sweeper.LOCK_KEY):
+        return None
+    try:
+        done: Dict[str, int] = {}
+        for step in STEPS:
+            done[step] = done[f"{step}_skipped"] = 0
+            while True:
+                copied, skipped, caught_up = await backfill_batch(conn, step, batch, no_photo_url)
+                done[step] += copied
+                done[f"{step}_skipped"] += skipped
+                if caught_up:
+                    break
+        return done
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", sweeper.LOCK_KEY)
+
+
+async def tables_present(conn: asyncpg.Connection) -> bool:
+    n = await conn.fetchval("SELECT COUNT(to_regclass(t)) FROM unnest($1::text[]) AS t", list(_TABLES.values()))
+    return n == len(_TABLES)
+
+
+async def has_rows(conn: asyncpg.Connection) -> bool:
+    return await conn.fetchval(
+        "SELECT EXISTS (SELECT 1 FROM foody_restaurants) OR EXISTS (SELECT 1 FROM foody_offers)"
+    )
+
+
+async def caught_up(conn: asyncpg.Connection) -> bool:
+    n = await conn.fetchval("SELECT COUNT(*) FROM legacy_backfill WHERE caught_up_at IS NOT NULL")
+    return n == len(STEPS)
+
+
+async def sync_live(conn: asyncpg.Connection, no_photo_url: str) -> int:
+    """
+    Двойное чтение витрины: переносит живые legacy-офферы (и их рестораны), которых фоновый
+    перенос ещё не коснулся. Возвращает число перенесённых офферов.
+    """
+    pending = f"{_LIVE_LEGACY_OFFER} AND NOT EXISTS (SELECT 1 FROM offers o WHERE o.legacy_id = fo.id)"
+    async with conn.transaction():
+        await _sync_restaurants(
+            conn,
+            f"fr.restaurant_id IN (SELECT fo.restaurant_id FROM foody_offers fo WHERE {pending}) "
+            "AND NOT EXISTS (SELECT 1 FROM merchants m WHERE m.legacy_restaurant_id = fr.restaurant_id)",
+            [],
+        )
+        return await _copy(conn, "offers", pending, [], no_photo_url)
+
+
+async def resolve_restaurant(conn: asyncpg.Connection, restaurant_id: str) -> int:
+    """
+    Двойное чтение мерчанта: переносит ресторан restaurant_id, если фоновый перенос до него не дошёл.
+    """
+    async with conn.transaction():
+        return await _sync_restaurants(conn, "fr.restaurant_id = $1", [restaurant_id])
+
+
+async def progress(conn: asyncpg.Connection) -> Dict[str, Dict[str, Any]]:
+    rows = await conn.fetch(
+        "SELECT step, last_id, copied, skipped, non_integer_ids, caught_up_at FROM legacy_backfill"
+    )
+    return {r["step"]: {"last_id": r["last_id"], "copied": r["copied"], "skipped": r["skipped"],
+                        "non_integer_ids": r["non_integer_ids"], "caught_up": r["caught_up_at"] is not None}
+            for r in rows}
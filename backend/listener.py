@@ -0,0 +1,59 @@
+"""
+Одно LISTEN-соединение на процесс для всех каналов NOTIFY.
+
+Подписчик регистрирует канал (add): колбэк на уведомление и колбэк на
+переподключение. Пока соединения не было, уведомления могли потеряться, и что
+сбросить, решает сам подписчик: live.LiveFeed шлёт клиентам reload,
+auth.ApiKeyCache очищает кэш. При обрыве — переподключение с паузой до 30 с.
+"""
+import asyncio
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import asyncpg
+
+OnNotify = Callable[[Any, int, str, str], None]
+
+
+class Listener:
+    def __init__(self, dsn: str, application_name: str = "foody-listen"):
+        self.dsn = dsn
+        self.application_name = application_name
+        self._channels: Dict[str, Tuple[OnNotify, Optional[Callable[[], None]]]] = {}
+        self.reconnects = 0
+
+    def add(self, channel: str, on_notify: OnNotify, on_reconnect: Optional[Callable[[], None]] = None):
+        """
+        Регистрировать до run(): каналы подписываются при каждом подключении.
+        """
+        self._channels[channel] = (on_notify, on_reconnect)
+
+    async def run(self):
+        delay = 1.0
+        first = True
+        while True:
+            lost = asyncio.Event()
+            conn = None
+            try:
+                conn = await asyncpg.connect(self.dsn, server_settings={"application_name": self.application_name})
+                conn.add_termination_listener(lambda c: lost.set())
+                for channel, (on_notify, _) in self._channels.items():
+                    await conn.add_listener(channel, on_notify)
+                if not first:
+                    self.reconnects += 1
+                    for _, on_reconnect in self._channels.values():
+                        if on_reconnect is not None:
+                            on_reconnect()
+                first = False
+                delay = 1.0
+                await lost.wait()
+            except asyncio.CancelledError:
+                if conn is not None:
+                    await conn.close()
+                raise
+            except Exception as e:
+                print("LISTEN_ERROR:", repr(e))
+                if conn is not None:
+                    conn.terminate()
+            first = False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
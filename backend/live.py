@@ -0,0 +1,89 @@
+"""
+Живая лента офферов: Postgres LISTEN/NOTIFY -> Server-Sent Events.
+
+Уведомления шлют триггеры на offers (миграция 4), так что их порождает любая
+запись — create_offer, bulk COPY, брони, фоновые задачи. В каждом процессе один
+LiveFeed получает их с общего LISTEN-соединения (listener.Listener) и раздаёт всем
+подписчикам через их очереди. Медленный клиент не тормозит остальных:
+при переполнении его очередь сбрасывается и он получает "reload".
+"""
+import json
+import asyncio
+from typing import Any, Callable, Dict, Optional, Set
+
+CHANNEL = "foody_offers"
+RELOAD = json.dumps({"type": "reload"})
+
+
+class LiveFeed:
+    def __init__(self, queue_size: int = 100, on_event: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.queue_size = queue_size
+        self.on_event = on_event
+        self._subscribers: Set[asyncio.Queue] = set()
+        self.published = 0
+        self.overflows = 0
+        self.reconnects = 0
+
+    @property
+    def clients(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self) -> asyncio.Queue:
+        q: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q: asyncio.Queue):
+        self._subscribers.discard(q)
+
+    def publish(self, data: str):
+        self.published += 1
+        for q in self._subscribers:
+            try:
+                q.put_nowait(data)
+            except asyncio.QueueFull:
+                # клиент не успевает: вместо хвоста дельт — одна команда перечитать витрину
+                self.overflows += 1
+                while not q.empty():
+                    q.get_nowait()
+                q.put_nowait(RELOAD)
+
+    def on_notify(self, conn, pid, channel, payload: str):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            print("LIVE_BAD_PAYLOAD:", payload[:200])
+            return
+        if self.on_event:
+            self.on_event(event)
+        self.publish(payload)
+
+    def on_reconnect(self):
+        # пока LISTEN-соединения не было, события могли потеряться — клиенты перечитывают витрину
+        self.reconnects += 1
+        self.publish(RELOAD)
+
+    async def stream(self, q: asyncio.Queue, keepalive: float):
+        """
+        Тело text/event-stream для одного клиента.
+        """
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                try:
+                    data = await asyncio.wait_for(q.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    # комментарий SSE: держит соединение живым через прокси Railway/Telegram
+                    yield b": ping\n\n"
+                    continue
+                yield f"event: offer\ndata: {data}\n\n".encode("utf-8")
+        finally:
+            self.unsubscribe(q)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "clients": self.clients,
+            "published": self.published,
+            "overflows": self.overflows,
+            "reconnects": self.reconnects,
+        }
@@ -1,26 +1,89 @@
 import os
+import json
+import math
+import time
+import asyncio
+import hashlib
+import secrets
+import base64
 import mimetypes
+import contextlib
+import csv
+import io
 from uuid import uuid4
-from typing import Dict, Any
+from decimal import Decimal
+from typing import Dict, Any, List, Optional
 from datetime import datetime, timezone
 
 import asyncpg
-from fastapi import FastAPI, UploadFile, File, HTTPException, Body
+from fastapi import FastAPI, UploadFile, File, HTTPException, Body, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 
-import boto3
-from botocore.config import Config as BotoConfig
 from botocore.exceptions import BotoCoreError, ClientError
 
+import auth
+import images
+import instrumentation
+import jsonenc
+import legacy
+import listener
+import live
+import migrations
+import reservations
+import storage
+import store
+import sweeper
+from geo import GeoGrid
+
 # ====== ENV ======
 DATABASE_URL = os.environ.get("DATABASE_URL")
 CORS_ORIGINS = os.environ.get("CORS_ORIGINS", "")
 RUN_MIGRATIONS = os.environ.get("RUN_MIGRATIONS", "0") == "1"
-
-R2_ENDPOINT = os.environ.get("R2_ENDPOINT")  # https://<account>.r2.cloudflarestorage.com
-R2_BUCKET = os.environ.get("R2_BUCKET")
-R2_ACCESS_KEY_ID = os.environ.get("R2_ACCESS_KEY_ID")
-R2_SECRET_ACCESS_KEY = os.environ.get("R2_SECRET_ACCESS_KEY")
+# Пул соединений с Postgres
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", "5"))
+DB_ACQUIRE_TIMEOUT = float(os.environ.get("DB_ACQUIRE_TIMEOUT", "5"))
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", "100"))
+DB_MAX_LIFETIME = float(os.environ.get("DB_MAX_LIFETIME", "1800"))  # сек, 0 — без ротации
+DB_MAX_INACTIVE_LIFETIME = float(os.environ.get("DB_MAX_INACTIVE_LIFETIME", "300"))
+# JIT на коротких OLTP-запросах только добавляет миллисекунды планирования
+DB_JIT = os.environ.get("DB_JIT", "off")
+# Сколько секунд кэш витрины живёт без инвалидации (страховка для других реплик)
+FEED_CACHE_TTL = float(os.environ.get("FEED_CACHE_TTL", "15"))
+# Гео-индекс ресторанов: размер ячейки сетки (в градусах) и период подгрузки
+GEO_CELL_DEG = float(os.environ.get("GEO_CELL_DEG", "0.02"))
+GEO_REFRESH_SECONDS = float(os.environ.get("GEO_REFRESH_SECONDS", "30"))
+GEO_FULL_REFRESH_SECONDS = float(os.environ.get("GEO_FULL_REFRESH_SECONDS", "600"))
+GEO_MAX_RADIUS_KM = float(os.environ.get("GEO_MAX_RADIUS_KM", "50"))
+# Живая лента (SSE): лимит клиентов на процесс, keepalive и очередь на клиента
+LIVE_MAX_CLIENTS = int(os.environ.get("LIVE_MAX_CLIENTS", "5000"))
+LIVE_KEEPALIVE_SECONDS = float(os.environ.get("LIVE_KEEPALIVE_SECONDS", "15"))
+LIVE_QUEUE_SIZE = int(os.environ.get("LIVE_QUEUE_SIZE", "100"))
+# Ресайз фото в производные (AVIF/WebP/JPEG) при загрузке; 0 — хранить оригинал как есть
+IMAGE_PROCESSING = os.environ.get("IMAGE_PROCESSING", "1") == "1"
+# Брони: сколько держим товар за покупателем и как часто освобождаем просроченные
+RESERVE_HOLD_MINUTES = int(os.environ.get("RESERVE_HOLD_MINUTES", "30"))
+RESERVE_MAX_QTY = int(os.environ.get("RESERVE_MAX_QTY", "10"))
+RESERVE_SWEEP_SECONDS = float(os.environ.get("RESERVE_SWEEP_SECONDS", "30"))
+RESERVE_SWEEP_BATCH = int(os.environ.get("RESERVE_SWEEP_BATCH", "500"))
+# Уборка офферов: истёкшие -> 'expired', неактивные старше N дней -> offers_archive (0 — не архивировать)
+SWEEP_INTERVAL_SECONDS = float(os.environ.get("SWEEP_INTERVAL_SECONDS", "60"))
+SWEEP_BATCH = int(os.environ.get("SWEEP_BATCH", "1000"))
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", "7"))
+# Перенос legacy foody_* в каноническую схему (legacy.py): период проходов и размер пачки
+LEGACY_BACKFILL_SECONDS = float(os.environ.get("LEGACY_BACKFILL_SECONDS", "60"))
+LEGACY_BACKFILL_BATCH = int(os.environ.get("LEGACY_BACKFILL_BATCH", "1000"))
+# двойное чтение foody_* на промахе витрины, пока перенос не догнал; 0 — только каноническая схема
+LEGACY_DUAL_READ = os.environ.get("LEGACY_DUAL_READ", "1") == "1"
+# Ключи API ресторанов: MERCHANT_AUTH=0 — без проверки (локально, бенчмарки)
+MERCHANT_AUTH = os.environ.get("MERCHANT_AUTH", "1") == "1"
+API_KEY_CACHE_SIZE = int(os.environ.get("API_KEY_CACHE_SIZE", "10000"))
+API_KEY_CACHE_TTL = float(os.environ.get("API_KEY_CACHE_TTL", "300"))
+API_KEY_NEGATIVE_TTL = float(os.environ.get("API_KEY_NEGATIVE_TTL", "30"))
+# Выпуск первого ключа мерчанту (X-Foody-Admin-Key); пусто — только ротация своим ключом
+MERCHANT_ADMIN_KEY = os.environ.get("MERCHANT_ADMIN_KEY", "")
 
 # Плейсхолдер, если фото не загрузили
 NO_PHOTO_URL = "https://foodyweb-production.up.railway.app/img/no-photo.png"
@@ -28,6 +91,7 @@ NO_PHOTO_URL = "https://foodyweb-production.up.railway.app/img/no-photo.png"
 # ====== APP / CORS ======
 app = FastAPI()
 _pool: asyncpg.pool.Pool | None = None
+_background: list[asyncio.Task] = []
 
 origins = [o.strip() for o in CORS_ORIGINS.split(",") if o.strip()]
 app.add_middleware(
@@ -37,89 +101,123 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# добавлен последним — внешний слой: меряет и ответы CORS, и 503 из _db()
+app.add_middleware(instrumentation.MetricsMiddleware)
 
 # ====== DB bootstrap ======
-async def _initialize(conn: asyncpg.Connection):
-    await conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS merchants (
-          id SERIAL PRIMARY KEY,
-          name TEXT NOT NULL,
-          address TEXT,
-          phone TEXT,
-          created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-        );
-
-        CREATE TABLE IF NOT EXISTS offers (
-          id SERIAL PRIMARY KEY,
-          merchant_id INT NOT NULL REFERENCES merchants(id) ON DELETE CASCADE,
-          title TEXT NOT NULL,
-          description TEXT,
-          category TEXT,
-          price NUMERIC(12,2) NOT NULL,
-          stock INT NOT NULL DEFAULT 1,
-          image_url TEXT NOT NULL,
-          expires_at TIMESTAMPTZ NOT NULL,
-          status TEXT NOT NULL DEFAULT 'active',
-          created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-        );
-
-        CREATE INDEX IF NOT EXISTS idx_offers_expires ON offers(expires_at);
-        CREATE INDEX IF NOT EXISTS idx_offers_status ON offers(status);
-        """
-    )
-    # Гарантируем базового мерчанта с id=1 (для пилота)
-    await conn.execute(
-        """
-        INSERT INTO merchants (id, name, address, phone)
-        VALUES (1, 'Demo Restaurant', 'Demo address', '+000000000')
-        ON CONFLICT (id) DO NOTHING;
-        """
-    )
-
 async def _ensure(conn: asyncpg.Connection):
     if RUN_MIGRATIONS:
-        await _initialize(conn)
+        # схема актуальна — один SELECT; иначе версии из migrations.py под advisory lock
+        await migrations.migrate(conn)
+
+# ====== DB pool ======
+class _PoolMetrics:
+    def __init__(self):
+        self.waiting = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.rotations = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        size = _pool.get_size() if _pool else 0
+        idle = _pool.get_idle_size() if _pool else 0
+        return {
+            "size": size,
+            "min_size": DB_POOL_MIN,
+            "max_size": DB_POOL_MAX,
+            "in_use": size - idle,
+            "idle": idle,
+            "waiting": self.waiting,
+            "saturation": round((size - idle) / DB_POOL_MAX, 3),
+            "acquired": self.acquired,
+            "acquire_timeouts": self.timeouts,
+            "acquire_wait_avg_ms": round(1000 * self.wait_total / self.acquired, 3) if self.acquired else 0.0,
+            "acquire_wait_max_ms": round(1000 * self.wait_max, 3),
+            "rotations": self.rotations,
+        }
+
+_pool_metrics = _PoolMetrics()
+
+@contextlib.asynccontextmanager
+async def _db():
+    """
+    _pool.acquire() с таймаутом и учётом ожидания: при исчерпанном пуле
+    клиент быстро получает 503, а /metrics показывает, сколько ждали.
+    """
+    _pool_metrics.waiting += 1
+    t0 = time.perf_counter()
+    try:
+        conn = await _pool.acquire(timeout=DB_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        _pool_metrics.timeouts += 1
+        raise HTTPException(status_code=503, detail="Database is busy, retry later")
+    finally:
+        _pool_metrics.waiting -= 1
+    waited = time.perf_counter() - t0
+    instrumentation.DB_ACQUIRE.observe(waited)
+    _pool_metrics.acquired += 1
+    _pool_metrics.wait_total += waited
+    _pool_metrics.wait_max = max(_pool_metrics.wait_max, waited)
+    try:
+        yield conn
+    finally:
+        await _pool.release(conn)
+
+async def _pool_rotator():
+    # у asyncpg нет max lifetime: раз в DB_MAX_LIFETIME помечаем все соединения на замену,
+    # пул закрывает их по мере возврата (после failover/смены ролей в Postgres не висим на старых)
+    while True:
+        await asyncio.sleep(DB_MAX_LIFETIME)
+        await _pool.expire_connections()
+        _pool_metrics.rotations += 1
 
 @app.on_event("startup")
 async def pool():
-    global _pool
+    global _pool, _legacy_caught_up, _legacy_dual_read
     if not DATABASE_URL:
         raise RuntimeError("DATABASE_URL missing")
-    _pool = await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=5)
-    async with _pool.acquire() as conn:
+    # подготовленные запросы кэшируются asyncpg на каждом соединении (по тексту SQL),
+    # поэтому горячие запросы держим константами и парсятся они один раз на соединение
+    _pool = await asyncpg.create_pool(
+        DATABASE_URL,
+        min_size=DB_POOL_MIN,
+        max_size=DB_POOL_MAX,
+        statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+        max_inactive_connection_lifetime=DB_MAX_INACTIVE_LIFETIME,
+        server_settings={"application_name": "foody-backend", "jit": DB_JIT},
+        init=instrumentation.init_connection,
+    )
+    async with _db() as conn:
         await _ensure(conn)
+        legacy_on = LEGACY_BACKFILL_SECONDS > 0 and await legacy.tables_present(conn)
+        _legacy_caught_up = legacy_on and await legacy.caught_up(conn)
+        # запись на пути чтения включаем, только если переносить есть что и перенос идёт
+        _legacy_dual_read = (LEGACY_DUAL_READ and legacy_on and not _legacy_caught_up
+                             and await legacy.has_rows(conn))
+        _legacy_stats["caught_up"] = _legacy_caught_up
+        _legacy_stats["dual_read"] = _legacy_dual_read
+    await _geo_refresh(full=True)
+    _background.append(asyncio.create_task(_geo_refresher()))
+    _background.append(asyncio.create_task(_reservation_sweeper()))
+    _background.append(asyncio.create_task(_offer_sweeper()))
+    if DB_MAX_LIFETIME > 0:
+        _background.append(asyncio.create_task(_pool_rotator()))
+    _background.append(asyncio.create_task(_listener.run()))
+    if legacy_on:
+        _background.append(asyncio.create_task(_legacy_backfiller()))
+
+@app.on_event("shutdown")
+async def shutdown():
+    for task in _background:
+        task.cancel()
+    images.shutdown()
 
 @app.get("/health")
 async def health():
     return {"ok": True}
 
-# ====== R2 client / URL helpers ======
-def _r2_client():
-    if not all([R2_ENDPOINT, R2_BUCKET, R2_ACCESS_KEY_ID, R2_SECRET_ACCESS_KEY]):
-        raise RuntimeError("R2 env not configured")
-    return boto3.client(
-        "s3",
-        endpoint_url=R2_ENDPOINT,
-        aws_access_key_id=R2_ACCESS_KEY_ID,
-        aws_secret_access_key=R2_SECRET_ACCESS_KEY,
-        config=BotoConfig(signature_version="s3v4"),
-        region_name="auto",
-    )
-
-def _public_r2_url(key: str) -> str:
-    """
-    Account endpoint: https://<account>.r2.cloudflarestorage.com
-    Public URL:       https://pub-<account>.r2.dev/<bucket>/<key>
-    Фоллбэк (если pub-домен не настроен): <endpoint>/<bucket>/<key>
-    """
-    try:
-        host = R2_ENDPOINT.split("//", 1)[-1]
-        account = host.split(".", 1)[0]
-        return f"https://pub-{account}.r2.dev/{R2_BUCKET}/{key}"
-    except Exception:
-        return f"{R2_ENDPOINT.rstrip('/')}/{R2_BUCKET}/{key}"
-
 # ====== Upload image to R2 ======
 @app.post("/upload")
 async def upload(file: UploadFile = File(...)):
@@ -128,22 +226,21 @@ async def upload(file: UploadFile = File(...)):
         if ext not in [".jpg", ".jpeg", ".png", ".webp"]:
             raise HTTPException(status_code=400, detail="Unsupported image type")
 
-        content = await file.read()  # читаем в память (ASGI-safe)
-        key = f"offers/{uuid4().hex}{ext}"
+        if IMAGE_PROCESSING:
+            return await _upload_variants(file)
 
-        s3 = _r2_client()
+        key = f"offers/{uuid4().hex}{ext}"
         content_type = file.content_type or mimetypes.guess_type(file.filename or "")[0] or "application/octet-stream"
 
-        # У R2 ACL часто игнорируются — не передаем ACL вовсе.
-        s3.put_object(
-            Bucket=R2_BUCKET,
-            Key=key,
-            Body=content,
-            ContentType=content_type,
-        )
+        # тело читается кусками, boto3 работает в пуле потоков — loop не блокируется
+        await storage.put_upload(file, key, content_type)
 
-        public_url = _public_r2_url(key)
+        public_url = storage.public_url(key)
         return {"url": public_url, "key": key}
+    except images.BadImage as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except storage.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except (BotoCoreError, ClientError) as e:
         print("UPLOAD_ERROR_S3:", repr(e))
         raise HTTPException(status_code=500, detail=f"Upload failed (S3): {e}")
@@ -153,6 +250,79 @@ async def upload(file: UploadFile = File(...)):
         print("UPLOAD_ERROR:", repr(e))
         raise HTTPException(status_code=500, detail=f"Upload failed: {e}")
 
+# одновременно декодируем не больше, чем успевает пул процессов — держит память под контролем
+_image_slots = asyncio.Semaphore(images.IMAGE_WORKERS * 2)
+
+async def _upload_variants(file: UploadFile) -> Dict[str, Any]:
+    """
+    Оригинал не сохраняем (в нём EXIF с геометкой телефона): в R2 уходят
+    только производные, image_url — самый крупный JPEG.
+    """
+    base_key = f"offers/{uuid4().hex}"
+    async with _image_slots:
+        data = await storage.read_upload(file)
+        variants = await images.render(data)
+    await asyncio.gather(*(
+        storage.put_bytes(images.variant_key(base_key, width, ext), body, content_type)
+        for width, ext, content_type, body in variants
+    ))
+    key = images.main_key(base_key)
+    public_url = storage.public_url(key)
+    return {"url": public_url, "key": key, "srcset": images.srcset_for(public_url)}
+
+# ====== Merchant auth (X-Foody-Key) ======
+_api_keys = auth.ApiKeyCache(API_KEY_CACHE_SIZE, API_KEY_CACHE_TTL, API_KEY_NEGATIVE_TTL)
+
+async def _lookup_api_key(digest: bytes) -> Optional[int]:
+    async with _db() as conn:
+        return await store.merchant_by_key_hash(conn, digest)
+
+async def _key_merchant(request: Request) -> int:
+    key = request.headers.get(auth.HEADER, "").strip()
+    if not key:
+        raise HTTPException(status_code=401, detail=f"{auth.HEADER} header is required")
+    merchant_id = await _api_keys.verify(key, _lookup_api_key)
+    if merchant_id is None:
+        raise HTTPException(status_code=401, detail="Invalid API key")
+    return merchant_id
+
+async def _merchant_auth(request: Request) -> Optional[int]:
+    """
+    id мерчанта по ключу из заголовка; None — проверка выключена (MERCHANT_AUTH=0).
+    В установившемся режиме ответ из кэша, без запроса в базу.
+    """
+    if not MERCHANT_AUTH:
+        return None
+    return await _key_merchant(request)
+
+def _check_merchant(authed: Optional[int], merchant_id: int):
+    if authed is not None and merchant_id != authed:
+        raise HTTPException(status_code=403, detail="merchant_id does not match API key")
+
+@app.post("/merchant/keys/rotate")
+async def rotate_api_key(request: Request, payload: Dict[str, Any] = Body(default={})):
+    """
+    Новый ключ мерчанта; старый перестаёт работать сразу на всех репликах (NOTIFY из триггера).
+    Свой ключ — по текущему X-Foody-Key, первый ключ — по X-Foody-Admin-Key.
+    Ключ возвращается один раз: в базе остаётся только его sha256.
+    """
+    admin = request.headers.get("X-Foody-Admin-Key", "")
+    if MERCHANT_ADMIN_KEY and admin and secrets.compare_digest(admin, MERCHANT_ADMIN_KEY):
+        try:
+            merchant_id = int(payload.get("merchant_id"))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="merchant_id must be an integer")
+    else:
+        merchant_id = await _key_merchant(request)
+    key = auth.new_key()
+    async with _db() as conn:
+        found = await store.set_key_hash(conn, merchant_id, auth.hash_key(key))
+    if not found:
+        raise HTTPException(status_code=404, detail="Merchant not found")
+    # своя реплика не ждёт NOTIFY
+    _api_keys.invalidate_merchant(merchant_id)
+    return {"merchant_id": merchant_id, "api_key": key}
+
 # ====== Create offer (image optional) ======
 def _parse_expires_at(value: str) -> datetime:
     """
@@ -172,68 +342,776 @@ def _parse_expires_at(value: str) -> datetime:
             dt = dt.replace(tzinfo=timezone.utc)
         return dt
 
+def _field(payload: Dict[str, Any], *names: str) -> Any:
+    # первое непустое из полей (новое имя, затем имена старого кабинета)
+    for name in names:
+        value = payload.get(name)
+        if value is not None and str(value).strip() != "":
+            return value
+    return None
+
+def _text(payload: Dict[str, Any], name: str) -> Optional[str]:
+    # строковое поле: None/"" -> None; число, список и т.п. — ошибка, а не 500 на .strip()
+    value = payload.get(name)
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"{name} must be a string")
+    return value.strip() or None
+
+def _int4(value: Any, name: str) -> int:
+    # целое для INTEGER-колонки: int или строка из цифр, 0..INT4_MAX
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"{name} must be an integer")
+    try:
+        number = int(value.strip()) if isinstance(value, str) else value
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+    if number < 0 or number > store.INT4_MAX:
+        raise ValueError(f"{name} must be between 0 and {store.INT4_MAX}")
+    return number
+
+def _offer_row(payload: Dict[str, Any], default_merchant_id: Optional[int] = None) -> tuple:
+    """
+    Проверяет и нормализует оффер в кортеж по store.OFFER_COLUMNS. Ошибка — ValueError с понятным текстом.
+    Понимает и поля старого кабинета: price_cents, original_price_cents, qty_left / qty_total
+    вместо stock, restaurant_id из цифр вместо merchant_id.
+    Без merchant_id в payload — мерчант ключа (default_merchant_id), иначе 1.
+    """
+    required = {
+        "title": ("title",),
+        "price": ("price", "price_cents"),
+        "stock": ("stock", "qty_left", "qty_total"),
+        "expires_at": ("expires_at",),
+    }
+    for name, aliases in required.items():
+        if _field(payload, *aliases) is None:
+            raise ValueError(f"Field {name} is required")
+    title = _text(payload, "title")
+    if title is None:
+        raise ValueError("Field title is required")
+    price = _field(payload, "price")
+    if price is not None:
+        if isinstance(price, bool) or not isinstance(price, (int, float, str)):
+            raise ValueError("price must be a number >= 0")
+        try:
+            price_cents = store.to_cents(price)
+        except ValueError:
+            raise ValueError(f"price must be a number between 0 and {store.cents_to_price(store.INT4_MAX)}")
+    else:
+        price_cents = store.Cents(_int4(payload["price_cents"], "price_cents"))
+    original = _field(payload, "original_price_cents")
+    original_price_cents = store.Cents(_int4(original, "original_price_cents")) if original is not None else None
+    stock = _int4(_field(payload, "stock", "qty_left", "qty_total"), "stock")
+    expires_raw = payload["expires_at"]
+    if not isinstance(expires_raw, str):
+        raise ValueError("expires_at must be 'YYYY-MM-DD HH:MM' or ISO 8601")
+    try:
+        expires_at = _parse_expires_at(expires_raw)
+    except ValueError:
+        raise ValueError("expires_at must be 'YYYY-MM-DD HH:MM' or ISO 8601")
+    merchant_ref = _field(payload, "merchant_id", "restaurant_id")
+    merchant_id = store.MerchantId(
+        _int4(merchant_ref, "merchant_id") if merchant_ref is not None else (default_merchant_id or 1)
+    )
+    return (
+        merchant_id,
+        title,
+        _text(payload, "description"),
+        store.cents_to_price(price_cents),
+        price_cents,
+        original_price_cents,
+        stock,
+        _text(payload, "category") or "other",
+        _text(payload, "image_url") or NO_PHOTO_URL,
+        expires_at,
+        "active",
+    )
+
+async def _resolve_merchant(conn: asyncpg.Connection, ref: str) -> Optional[store.MerchantId]:
+    merchant_id = await store.resolve_merchant(conn, ref)
+    if merchant_id is None and _legacy_dual_read:
+        # двойное чтение: ресторан мог ещё не доехать из foody_restaurants
+        if await legacy.resolve_restaurant(conn, ref.strip()):
+            merchant_id = await store.resolve_merchant(conn, ref)
+    return merchant_id
+
+def _legacy_ref(payload: Dict[str, Any]) -> Optional[str]:
+    # строковый restaurant_id старого кабинета (цифры _offer_row разбирает сам)
+    if _field(payload, "merchant_id") is not None:
+        return None
+    ref = _field(payload, "restaurant_id")
+    return ref if isinstance(ref, str) and not ref.strip().isdigit() else None
+
 @app.post("/merchant/offers")
-async def create_offer(payload: Dict[str, Any] = Body(...)):
+async def create_offer(request: Request, payload: Dict[str, Any] = Body(...)):
     try:
-        required = ["title", "price", "stock", "expires_at"]
-        for r in required:
-            if r not in payload or (str(payload[r]).strip() == ""):
-                raise HTTPException(status_code=400, detail=f"Field {r} is required")
-
-        merchant_id = int(payload.get("merchant_id") or 1)
-        image_url = (payload.get("image_url") or "").strip() or NO_PHOTO_URL
-        expires_at_dt = _parse_expires_at(payload.get("expires_at"))
-
-        async with _pool.acquire() as conn:
-            # На случай, если кто-то дропнул merchants — подчиним мерчанта 1 перед вставкой
-            await conn.execute(
-                """
-                INSERT INTO merchants (id, name)
-                VALUES (1, 'Demo Restaurant')
-                ON CONFLICT (id) DO NOTHING;
-                """
-            )
-
-            row = await conn.fetchrow(
-                """
-                INSERT INTO offers
-                  (merchant_id, title, description, price, stock, category, image_url, expires_at, status, created_at)
-                VALUES
-                  ($1, $2, $3, $4, $5, COALESCE($6,'other'), $7, $8, 'active', NOW())
-                RETURNING id
-                """,
-                merchant_id,
-                payload.get("title"),
-                payload.get("description"),
-                payload.get("price"),
-                int(payload.get("stock")),
-                payload.get("category"),
-                image_url,
-                expires_at_dt,
-            )
-            return {"id": row["id"]}
+        authed = await _merchant_auth(request)
+        ref = _legacy_ref(payload)
+        if ref is not None:
+            # с ключом мерчант уже известен — строковый restaurant_id в базе не ищем
+            merchant_id = authed
+            if merchant_id is None:
+                async with _db() as conn:
+                    merchant_id = await _resolve_merchant(conn, ref)
+                if merchant_id is None:
+                    raise HTTPException(status_code=400, detail="Unknown restaurant_id")
+            payload = {**payload, "merchant_id": merchant_id}
+        try:
+            values = _offer_row(payload, authed)
+        except (ValueError, TypeError, AttributeError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        _check_merchant(authed, values[0])
+
+        async with _db() as conn:
+            offer_id = await store.insert_offer(conn, values)
+        _feed.invalidate()
+        return {"id": offer_id}
+    except asyncpg.ForeignKeyViolationError:
+        # мерчанта нет — раньше его молча досоздавали лишним запросом на каждый оффер
+        raise HTTPException(status_code=400, detail="Unknown merchant_id")
     except HTTPException:
         raise
     except Exception as e:
         print("CREATE_OFFER_ERROR:", repr(e))
         raise HTTPException(status_code=500, detail=f"Create offer failed: {e}")
 
+# ====== Bulk import ======
+BULK_MAX_ROWS = int(os.environ.get("BULK_MAX_ROWS", "20000"))
+BULK_MAX_BYTES = int(os.environ.get("BULK_MAX_BYTES", str(16 * 1024 * 1024)))
+
+async def _bulk_payload(request: Request) -> List[Dict[str, Any]]:
+    body = await request.body()
+    if len(body) > BULK_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Body is larger than {BULK_MAX_BYTES} bytes")
+    content_type = request.headers.get("content-type", "")
+    try:
+        if "csv" in content_type:
+            # utf-8-sig: Excel сохраняет CSV с BOM
+            return list(csv.DictReader(io.StringIO(body.decode("utf-8-sig"))))
+        items = json.loads(body)
+    except (UnicodeDecodeError, ValueError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Cannot parse body: {e}")
+    if isinstance(items, dict):
+        items = items.get("offers")
+    if not isinstance(items, list) or not all(isinstance(x, dict) for x in items):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of offers or text/csv")
+    return items
+
+@app.post("/merchant/offers/bulk")
+async def create_offers_bulk(request: Request, all_or_nothing: bool = False):
+    """
+    Массовое создание офферов: JSON-массив или CSV (Content-Type: text/csv, заголовок —
+    имена полей как у POST /merchant/offers). Все строки проверяются одним проходом,
+    валидные вставляются одной транзакцией через COPY. Ответ — число вставленных и
+    ошибки по номерам строк (с 1). all_or_nothing=true — при любой ошибке не вставлять ничего.
+    """
+    authed = await _merchant_auth(request)
+    items = await _bulk_payload(request)
+    if len(items) > BULK_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_ROWS} rows per request")
+
+    records: List[tuple] = []
+    record_rows: List[int] = []
+    errors: List[Dict[str, Any]] = []
+    for i, item in enumerate(items, start=1):
+        try:
+            row = _offer_row(item, authed)
+        except (ValueError, TypeError, AttributeError) as e:
+            # кривое значение в одной строке — ошибка этой строки, а не 500 на весь импорт
+            errors.append({"row": i, "error": str(e)})
+            continue
+        if authed is not None and row[0] != authed:
+            errors.append({"row": i, "error": "merchant_id does not match API key"})
+            continue
+        records.append(row)
+        record_rows.append(i)
+
+    async with _db() as conn:
+        # мерчантов проверяем одним запросом: иначе одна строка с чужим id уронит весь COPY
+        merchant_ids = list({r[0] for r in records})
+        known = set(merchant_ids)
+        if merchant_ids:
+            known = await store.existing_merchants(conn, merchant_ids)
+        if len(known) != len(merchant_ids):
+            errors += [{"row": n, "error": "Unknown merchant_id"} for n, r in zip(record_rows, records) if r[0] not in known]
+            errors.sort(key=lambda e: e["row"])
+            records = [r for r in records if r[0] in known]
+
+        if errors and all_or_nothing:
+            return {"inserted": 0, "errors": errors}
+        if records:
+            async with conn.transaction():
+                await store.copy_offers(conn, records)
+    if records:
+        _feed.invalidate()
+    return {"inserted": len(records), "errors": errors}
+
+# ====== Export (CSV / NDJSON) ======
+EXPORT_CONCURRENCY = int(os.environ.get("EXPORT_CONCURRENCY", "2"))
+EXPORT_PREFETCH = 500
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+# выгрузка держит соединение всё время стрима — ограничиваем, чтобы не съесть пул
+_export_slots = asyncio.Semaphore(EXPORT_CONCURRENCY)
+
+def _json_default(value: Any):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+async def _export_merchant_id(merchant_id: Optional[int], restaurant_id: Optional[str], authed: Optional[int]) -> int:
+    # кабинет мерчанта шлёт restaurant_id: цифры — это id мерчанта, строка — id старого кабинета
+    value = merchant_id if merchant_id is not None else restaurant_id
+    if value is None and authed is not None:
+        return authed
+    if isinstance(value, str) and value.strip() and not value.strip().isdigit():
+        if authed is not None:
+            # с ключом мерчант уже известен — строковый restaurant_id в базе не ищем
+            return authed
+        async with _db() as conn:
+            mid = await _resolve_merchant(conn, value)
+        if mid is None:
+            raise HTTPException(status_code=404, detail="Unknown restaurant_id")
+        return mid
+    try:
+        mid = int(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="merchant_id is required")
+    _check_merchant(authed, mid)
+    return mid
+
+async def _export(sql: str, merchant_id: int, since: Optional[datetime], until: Optional[datetime],
+                  fmt: str, filename: str) -> StreamingResponse:
+    """
+    Стримит результат sql через серверный курсор: в памяти не больше EXPORT_PREFETCH
+    строк и одного чанка ответа, сколько бы истории ни было.
+    """
+    if fmt not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    stack = contextlib.AsyncExitStack()
+    await stack.enter_async_context(_export_slots)
+    try:
+        conn = await stack.enter_async_context(_db())
+    except BaseException:
+        await stack.aclose()
+        raise
+
+    async def rows():
+        try:
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            async with conn.transaction():
+                stmt = await conn.prepare(sql)
+                if fmt == "csv":
+                    writer.writerow([a.name for a in stmt.get_attributes()])
+                async for r in stmt.cursor(merchant_id, since, until, prefetch=EXPORT_PREFETCH):
+                    if fmt == "csv":
+                        writer.writerow(["" if v is None else v.isoformat() if isinstance(v, datetime) else v for v in r.values()])
+                    else:
+                        buf.write(json.dumps(dict(r), default=_json_default, ensure_ascii=False, separators=(",", ":")))
+                        buf.write("\n")
+                    if buf.tell() >= EXPORT_CHUNK_BYTES:
+                        yield buf.getvalue().encode("utf-8")
+                        buf.seek(0)
+                        buf.truncate()
+            if buf.tell():
+                yield buf.getvalue().encode("utf-8")
+        finally:
+            # ошибка посреди стрима (statement_timeout, обрыв базы): Starlette не запускает
+            # background, поэтому соединение и слот отдаём здесь; повторный aclose — no-op
+            await stack.aclose()
+
+    media_type = "text/csv; charset=utf-8" if fmt == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        rows(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'},
+        # запасной путь: генератор так и не запустили (клиент ушёл до первого чанка)
+        background=BackgroundTask(stack.aclose),
+    )
+
+@app.get("/merchant/offers/export")
+@app.get("/api/v1/merchant/offers/csv")
+async def export_offers(
+    request: Request,
+    merchant_id: Optional[int] = None,
+    restaurant_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    format: str = "csv",
+):
+    mid = await _export_merchant_id(merchant_id, restaurant_id, await _merchant_auth(request))
+    return await _export(store.EXPORT_OFFERS_SQL, mid, since, until, format, f"foody_offers_{mid}")
+
+@app.get("/merchant/redeems/export")
+async def export_redeems(
+    request: Request,
+    merchant_id: Optional[int] = None,
+    restaurant_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    format: str = "csv",
+):
+    # в погашениях имена и телефоны покупателей — ключ нужен и при MERCHANT_AUTH=0
+    mid = await _export_merchant_id(merchant_id, restaurant_id, await _key_merchant(request))
+    return await _export(store.EXPORT_REDEEMS_SQL, mid, since, until, format, f"foody_redeems_{mid}")
+
 # ====== Public offers ======
+def _offer_dict(r: asyncpg.Record) -> Dict[str, Any]:
+    d = dict(r)
+    # price — для клиентов, которые ещё не читают price_cents (199.0 — как раньше из NUMERIC)
+    d["price"] = d["price_cents"] / 100
+    d["image_srcset"] = images.srcset_for(d.get("image_url"))
+    return d
+
+# std — через jsonable_encoder, fast — orjson; см. jsonenc.py
+_feed_json = jsonenc.encoder("feed")
+_page_json = jsonenc.encoder("page")
+_nearby_json = jsonenc.encoder("nearby")
+
+class _FeedCache:
+    """
+    Готовый (сериализованный) ответ /public/offers в памяти процесса.
+    Протухает по FEED_CACHE_TTL или в момент истечения самого раннего оффера,
+    сбрасывается явно при записи (create_offer).
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.body: bytes | None = None
+        self.etag: str | None = None
+        self.fresh_until = 0.0
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self.generation += 1
+        self.body = None
+        self.etag = None
+        self.fresh_until = 0.0
+        self.invalidations += 1
+
+    def _valid(self) -> bool:
+        return self.body is not None and time.monotonic() < self.fresh_until
+
+    async def get(self) -> tuple[bytes, str]:
+        if self._valid():
+            self.hits += 1
+            return self.body, self.etag
+        # single-flight: при промахе в базу идёт один запрос, остальные ждут его результат
+        async with self._lock:
+            if self._valid():
+                self.hits += 1
+                return self.body, self.etag
+            self.misses += 1
+            generation = self.generation
+            async with _db() as conn:
+                if _legacy_dual_read:
+                    # двойное чтение, пока фоновый перенос не догнал foody_*
+                    _legacy_stats["live_synced"] += await legacy.sync_live(conn, NO_PHOTO_URL)
+                rows = await store.public_offers(conn)
+            with instrumentation.SERIALIZE.labels("feed").time():
+                body = _feed_json([_offer_dict(r) for r in rows])
+            etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+            now = time.monotonic()
+            fresh_until = now + self.ttl
+            if rows:
+                # rows отсортированы по expires_at — первый оффер истечёт раньше всех
+                left = (rows[0]["expires_at"] - datetime.now(timezone.utc)).total_seconds()
+                fresh_until = min(fresh_until, now + max(left, 0.0))
+            # пока шёл запрос, кэш могли инвалидировать — тогда результат не сохраняем
+            if generation == self.generation:
+                self.body, self.etag, self.fresh_until = body, etag, fresh_until
+            return body, etag
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "cached": self._valid(),
+        }
+
+_feed = _FeedCache(FEED_CACHE_TTL)
+
 @app.get("/public/offers")
-async def public_offers():
-    async with _pool.acquire() as conn:
-        rows = await conn.fetch(
-            """
-            SELECT o.id, o.title, o.description, o.price, o.stock, o.category,
-                   o.image_url, o.expires_at, o.status,
-                   m.id AS merchant_id, m.name AS merchant_name, m.address
-            FROM offers o
-            JOIN merchants m ON m.id = o.merchant_id
-            WHERE o.status = 'active'
-              AND o.expires_at > NOW()
-              AND o.stock > 0
-            ORDER BY o.expires_at ASC
-            LIMIT 200
-            """
+async def public_offers(request: Request):
+    body, etag = await _feed.get()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [t.strip() for t in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# ====== Paginated offers (keyset) ======
+PAGE_DEFAULT_LIMIT = 50
+PAGE_MAX_LIMIT = 200
+
+def _encode_cursor(expires_at: datetime, offer_id: int) -> str:
+    raw = f"{expires_at.isoformat()}|{offer_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, offer_id = raw.rsplit("|", 1)
+        expires_at, offer_id = datetime.fromisoformat(ts), int(offer_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Bad cursor")
+    if not (0 <= offer_id <= store.INT4_MAX):
+        raise HTTPException(status_code=400, detail="Bad cursor")
+    return expires_at, offer_id
+
+@app.get("/public/offers/page")
+async def public_offers_page(
+    cursor: Optional[str] = None,
+    limit: int = PAGE_DEFAULT_LIMIT,
+    category: Optional[str] = None,
+    min_price: Optional[Decimal] = None,
+    max_price: Optional[Decimal] = None,
+):
+    """
+    Страница витрины по ключу (expires_at, id): каждая следующая страница
+    начинается с позиции курсора в индексе, поэтому стоимость не зависит от номера страницы.
+    """
+    if not (1 <= limit <= PAGE_MAX_LIMIT):
+        raise HTTPException(status_code=400, detail=f"limit must be in [1, {PAGE_MAX_LIMIT}]")
+
+    # до умножения: 1e12 не влезает в INTEGER, на 1e1000000 Decimal переполняется,
+    # а math.ceil от 1e100000 стоит заметного CPU
+    price_max = store.cents_to_price(store.INT4_MAX)
+    for name, value in (("min_price", min_price), ("max_price", max_price)):
+        if value is not None and not (value.is_finite() and 0 <= value <= price_max):
+            raise HTTPException(status_code=400, detail=f"{name} must be a number in [0, {price_max}]")
+    # границы в копейках: 199.505 <= x — это x >= 19951, x <= 199.505 — x <= 19950
+    min_cents = store.Cents(math.ceil(min_price * 100)) if min_price is not None else None
+    max_cents = store.Cents(math.floor(max_price * 100)) if max_price is not None else None
+    # кривой курсор — 400 без соединения из пула
+    after = _decode_cursor(cursor) if cursor else None
+
+    async with _db() as conn:
+        rows = await store.offers_page(conn, after, category, min_cents, max_cents, limit + 1)
+    items = [_offer_dict(r) for r in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = _encode_cursor(last["expires_at"], last["id"])
+    with instrumentation.SERIALIZE.labels("page").time():
+        body = _page_json({"items": items, "next_cursor": next_cursor})
+    return Response(content=body, media_type="application/json")
+
+# ====== Nearby offers (geo index) ======
+_geo = GeoGrid(GEO_CELL_DEG)
+_geo_max_id = 0
+_GEO_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_geo_moved_since = _GEO_EPOCH
+
+async def _geo_refresh(full: bool = False):
+    """
+    full=True — перестроить индекс целиком (подхватывает удаления),
+    иначе догрузить новых мерчантов (id > последнего увиденного) и тех, у кого сменились
+    координаты (geo_updated_at позже последнего увиденного). Правку из долгой транзакции,
+    закоммиченную позже, добирает полная перестройка.
+    """
+    global _geo, _geo_max_id, _geo_moved_since
+    try:
+        async with _db() as conn:
+            rows = await store.merchants_after(conn, 0 if full else _geo_max_id)
+            if not full:
+                rows += await store.merchants_moved(conn, _geo_moved_since)
+    except Exception as e:
+        print("GEO_REFRESH_ERROR:", repr(e))
+        return
+    grid = GeoGrid(GEO_CELL_DEG) if full else _geo
+    max_id = 0 if full else _geo_max_id
+    moved_since = _GEO_EPOCH if full else _geo_moved_since
+    for r in rows:
+        if r["lat"] is not None and r["lng"] is not None:
+            grid.upsert(r["id"], r["lat"], r["lng"])
+        else:
+            grid.remove(r["id"])
+        max_id = max(max_id, r["id"])
+        if r["geo_updated_at"] is not None:
+            moved_since = max(moved_since, r["geo_updated_at"])
+    _geo_max_id = max_id
+    _geo_moved_since = moved_since
+    _geo = grid
+
+async def _geo_refresher():
+    last_full = time.monotonic()
+    while True:
+        await asyncio.sleep(GEO_REFRESH_SECONDS)
+        full = time.monotonic() - last_full >= GEO_FULL_REFRESH_SECONDS
+        await _geo_refresh(full=full)
+        if full:
+            last_full = time.monotonic()
+
+@app.get("/public/offers/nearby")
+async def public_offers_nearby(lat: float, lng: float, radius_km: float = 3.0):
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lng <= 180.0):
+        raise HTTPException(status_code=400, detail="lat/lng out of range")
+    if not (0.0 < radius_km <= GEO_MAX_RADIUS_KM):
+        raise HTTPException(status_code=400, detail=f"radius_km must be in (0, {GEO_MAX_RADIUS_KM:g}]")
+
+    near = _geo.nearby(lat, lng, radius_km)
+    if not near:
+        return Response(content=b"[]", media_type="application/json")
+    async with _db() as conn:
+        rows = await store.offers_nearby(conn, [k for k, _ in near], [round(d, 3) for _, d in near])
+    with instrumentation.SERIALIZE.labels("nearby").time():
+        body = _nearby_json([_offer_dict(r) for r in rows])
+    return Response(content=body, media_type="application/json")
+
+@app.post("/merchant/location")
+async def set_merchant_location(request: Request, payload: Dict[str, Any] = Body(...)):
+    """
+    Координаты ресторана для /public/offers/nearby: {"lat": 55.75, "lng": 37.61}; null/null — убрать
+    из поиска рядом. Эта реплика видит их сразу, остальные — на догрузке индекса (GEO_REFRESH_SECONDS).
+    """
+    authed = await _merchant_auth(request)
+    lat, lng = payload.get("lat"), payload.get("lng")
+    if (lat is None) != (lng is None):
+        raise HTTPException(status_code=400, detail="lat and lng go together")
+    if lat is not None:
+        if any(isinstance(v, bool) or not isinstance(v, (int, float)) for v in (lat, lng)):
+            raise HTTPException(status_code=400, detail="lat/lng must be numbers")
+        lat, lng = float(lat), float(lng)
+        if not (-90.0 <= lat <= 90.0 and -180.0 <= lng <= 180.0):
+            raise HTTPException(status_code=400, detail="lat/lng out of range")
+    if payload.get("merchant_id") is not None:
+        try:
+            merchant_id = _int4(payload["merchant_id"], "merchant_id")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        _check_merchant(authed, merchant_id)
+    elif authed is not None:
+        merchant_id = authed
+    else:
+        raise HTTPException(status_code=400, detail="Field merchant_id is required")
+
+    async with _db() as conn:
+        found = await store.set_location(conn, merchant_id, lat, lng)
+    if not found:
+        raise HTTPException(status_code=404, detail="Merchant not found")
+    if lat is not None:
+        _geo.upsert(merchant_id, lat, lng)
+    else:
+        _geo.remove(merchant_id)
+    return {"merchant_id": merchant_id, "lat": lat, "lng": lng}
+
+# ====== Reservations ======
+_reserve_stats = {"reserved": 0, "sold_out": 0, "redeemed": 0, "expired": 0}
+
+@app.post("/public/reserve")
+@app.post("/api/v1/public/reserve")
+async def reserve_offer(payload: Dict[str, Any] = Body(...)):
+    # типы и диапазоны — до базы: 1.9, 2**31 или {"name": 5} иначе дают 500
+    try:
+        if _field(payload, "offer_id") is None:
+            raise ValueError("Field offer_id is required")
+        offer_id = _int4(payload["offer_id"], "offer_id")
+        qty = _int4(payload["qty"], "qty") if _field(payload, "qty") is not None else 1
+        name = _text(payload, "name")
+        phone = _text(payload, "phone")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not (1 <= qty <= RESERVE_MAX_QTY):
+        raise HTTPException(status_code=400, detail=f"qty must be in [1, {RESERVE_MAX_QTY}]")
+
+    async with _db() as conn:
+        row = await reservations.reserve(
+            conn, offer_id, qty, name, phone, RESERVE_HOLD_MINUTES,
         )
-        return [dict(r) for r in rows]
+        if row is None:
+            # отказ — медленный путь: уточняем причину отдельным запросом
+            exists = await store.offer_exists(conn, offer_id)
+    if row is None:
+        if not exists:
+            raise HTTPException(status_code=404, detail="Offer not found")
+        _reserve_stats["sold_out"] += 1
+        raise HTTPException(status_code=409, detail="Offer is sold out or expired")
+
+    _reserve_stats["reserved"] += 1
+    if row["stock_left"] == 0:
+        # оффер пропал с витрины — кэш больше не верен
+        _feed.invalidate()
+    return {
+        "reservation_id": row["id"],
+        "offer_id": row["offer_id"],
+        "code": row["code"],
+        "qty": row["qty"],
+        "status": row["status"],
+        "hold_until": row["hold_until"],
+    }
+
+@app.post("/merchant/redeem")
+async def redeem_reservation(request: Request, payload: Dict[str, Any] = Body(...)):
+    authed = await _merchant_auth(request)
+    try:
+        code = (_text(payload, "code") or "").upper()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not code:
+        raise HTTPException(status_code=400, detail="Field code is required")
+    async with _db() as conn:
+        # с ключом — только брони на офферы этого мерчанта
+        row = await reservations.redeem(conn, code, authed)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Reservation not found, expired or already redeemed")
+    _reserve_stats["redeemed"] += 1
+    return dict(row)
+
+async def _reservation_sweeper():
+    while True:
+        await asyncio.sleep(RESERVE_SWEEP_SECONDS)
+        try:
+            while True:
+                async with _db() as conn:
+                    expired = await reservations.expire_holds(conn, RESERVE_SWEEP_BATCH)
+                if expired:
+                    _reserve_stats["expired"] += expired
+                    _feed.invalidate()
+                if expired < RESERVE_SWEEP_BATCH:
+                    break
+        except Exception as e:
+            print("RESERVATION_SWEEP_ERROR:", repr(e))
+
+# ====== Offer sweeper ======
+_sweep_stats = {
+    "runs": 0, "skipped": 0, "errors": 0, "expired": 0, "archived": 0,
+    "last_seconds": 0.0, "total_seconds": 0.0, "last_run_at": None,
+}
+
+async def _offer_sweeper():
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL_SECONDS)
+        t0 = time.perf_counter()
+        try:
+            async with _db() as conn:
+                done = await sweeper.sweep(conn, SWEEP_BATCH, ARCHIVE_AFTER_DAYS)
+        except Exception as e:
+            _sweep_stats["errors"] += 1
+            print("OFFER_SWEEP_ERROR:", repr(e))
+            continue
+        if done is None:
+            # проход ведёт другая реплика
+            _sweep_stats["skipped"] += 1
+            continue
+        elapsed = time.perf_counter() - t0
+        _sweep_stats["runs"] += 1
+        _sweep_stats["expired"] += done["expired"]
+        _sweep_stats["archived"] += done["archived"]
+        _sweep_stats["last_seconds"] = round(elapsed, 4)
+        _sweep_stats["total_seconds"] = round(_sweep_stats["total_seconds"] + elapsed, 4)
+        _sweep_stats["last_run_at"] = datetime.now(timezone.utc).isoformat()
+
+# ====== Legacy foody_* -> canonical schema ======
+_legacy_caught_up = False
+# True — витрина и restaurant_id читаются двойным чтением (legacy.py); решается на старте,
+# выключается, когда перенос догнал foody_*
+_legacy_dual_read = False
+_legacy_stats = {
+    "runs": 0, "skipped": 0, "errors": 0, "restaurants": 0, "offers": 0, "redeems": 0,
+    # строки foody_*, которые проход не перенёс (конфликт, нет ресторана/оффера) — см. LEGACY_BACKFILL_SKIPPED
+    "restaurants_skipped": 0, "offers_skipped": 0, "redeems_skipped": 0,
+    "live_synced": 0, "caught_up": False, "dual_read": False, "last_seconds": 0.0,
+}
+
+async def _legacy_backfiller():
+    global _legacy_caught_up, _legacy_dual_read
+    while True:
+        t0 = time.perf_counter()
+        try:
+            async with _db() as conn:
+                done = await legacy.backfill(conn, LEGACY_BACKFILL_BATCH, NO_PHOTO_URL)
+                if done is not None and not _legacy_caught_up:
+                    _legacy_caught_up = await legacy.caught_up(conn)
+                    _legacy_dual_read = _legacy_dual_read and not _legacy_caught_up
+        except Exception as e:
+            _legacy_stats["errors"] += 1
+            print("LEGACY_BACKFILL_ERROR:", repr(e))
+            done = None
+        else:
+            if done is None:
+                # замок держит sweeper или перенос на другой реплике
+                _legacy_stats["skipped"] += 1
+            else:
+                _legacy_stats["runs"] += 1
+                for name, n in done.items():
+                    _legacy_stats[name] += n
+                _legacy_stats["last_seconds"] = round(time.perf_counter() - t0, 4)
+        _legacy_stats["caught_up"] = _legacy_caught_up
+        _legacy_stats["dual_read"] = _legacy_dual_read
+        await asyncio.sleep(LEGACY_BACKFILL_SECONDS)
+
+# ====== Live offers feed (SSE) ======
+def _on_live_event(event: Dict[str, Any]):
+    # NOTIFY приходит со всех реплик — заодно сбрасываем локальный кэш витрины,
+    # если оффер появился/пропал (изменение остатка >0 покрывает FEED_CACHE_TTL)
+    if event.get("type") != "stock" or not event.get("stock"):
+        _feed.invalidate()
+
+_live = live.LiveFeed(queue_size=LIVE_QUEUE_SIZE, on_event=_on_live_event)
+
+# одно LISTEN-соединение на процесс: лента офферов и сброс кэша ключей
+_listener = listener.Listener(DATABASE_URL)
+_listener.add(live.CHANNEL, _live.on_notify, _live.on_reconnect)
+_listener.add(auth.CHANNEL, _api_keys.on_notify, _api_keys.on_reconnect)
+
+@app.get("/public/offers/live")
+async def public_offers_live():
+    """
+    text/event-stream: event "offer" с JSON-дельтами
+    {"type": "created", "offer": {...}} | {"type": "stock", "id", "stock"} |
+    {"type": "expired", "id"} | {"type": "reload"} (перечитать /public/offers).
+    """
+    if _live.clients >= LIVE_MAX_CLIENTS:
+        raise HTTPException(status_code=503, detail="Too many live clients")
+    q = _live.subscribe()
+    return StreamingResponse(
+        _live.stream(q, LIVE_KEEPALIVE_SECONDS),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # клиент мог отвалиться до первого чанка — тогда finally в генераторе не выполнится
+        background=BackgroundTask(_live.unsubscribe, q),
+    )
+
+# ====== Metrics ======
+instrumentation.register_stats({
+    "pool": lambda: _pool_metrics.snapshot(),
+    "feed": lambda: _feed.stats(),
+    "reservations": lambda: _reserve_stats,
+    "sweeper": lambda: _sweep_stats,
+    "live": lambda: _live.stats(),
+    "api_keys": lambda: _api_keys.stats(),
+    "legacy": lambda: _legacy_stats,
+})
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus text format; то же в JSON для людей — GET /stats.
+    """
+    body, content_type = instrumentation.render()
+    return Response(body, media_type=content_type)
+
+@app.get("/stats")
+async def stats():
+    return {
+        "pool": _pool_metrics.snapshot(),
+        "feed": _feed.stats(),
+        "reservations": dict(_reserve_stats),
+        "sweeper": dict(_sweep_stats),
+        "live": _live.stats(),
+        "api_keys": _api_keys.stats(),
+        "legacy": dict(_legacy_stats),
+    }
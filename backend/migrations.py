@@ -0,0 +1,529 @@
+"""
+Версионные миграции схемы.
+
+Применённые версии лежат в schema_version. На старте migrate() делает один
+запрос (MAX(version)); если схема актуальна — на этом всё. Иначе берёт
+advisory lock (параллельные реплики ждут, а не гоняют DDL наперегонки),
+перепроверяет версию и применяет недостающие миграции — каждую в своей
+транзакции, одним multi-statement запросом.
+
+Миграции не редактируются после выкладки: изменения схемы — только новой
+версией в конце MIGRATIONS.
+"""
+import os
+from typing import List, Tuple
+
+import asyncpg
+
+# pg_advisory_lock key: b"foody" как число
+LOCK_KEY = 0x666F6F6479
+# ALTER ждёт ACCESS EXCLUSIVE и блокирует всех за собой — лучше упасть и перезапуститься
+LOCK_TIMEOUT = os.environ.get("MIGRATION_LOCK_TIMEOUT", "5s")
+
+MIGRATIONS: List[Tuple[int, str, str]] = [
+    (1, "merchants, offers, reservations", r"""
+        CREATE TABLE IF NOT EXISTS merchants (
+          id SERIAL PRIMARY KEY,
+          name TEXT NOT NULL,
+          address TEXT,
+          phone TEXT,
+          created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        ALTER TABLE merchants ADD COLUMN IF NOT EXISTS lat DOUBLE PRECISION;
+        ALTER TABLE merchants ADD COLUMN IF NOT EXISTS lng DOUBLE PRECISION;
+
+        CREATE TABLE IF NOT EXISTS offers (
+          id SERIAL PRIMARY KEY,
+          merchant_id INT NOT NULL REFERENCES merchants(id) ON DELETE CASCADE,
+          title TEXT NOT NULL,
+          description TEXT,
+          category TEXT,
+          price NUMERIC(12,2) NOT NULL,
+          stock INT NOT NULL DEFAULT 1,
+          image_url TEXT NOT NULL,
+          expires_at TIMESTAMPTZ NOT NULL,
+          status TEXT NOT NULL DEFAULT 'active',
+          created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_offers_expires ON offers(expires_at);
+        CREATE INDEX IF NOT EXISTS idx_offers_status ON offers(status);
+        -- keyset-пагинация витрины (/public/offers/page): (expires_at, id) среди живых офферов
+        CREATE INDEX IF NOT EXISTS idx_offers_feed
+          ON offers(expires_at, id) WHERE status = 'active' AND stock > 0;
+        CREATE INDEX IF NOT EXISTS idx_offers_feed_category
+          ON offers(category, expires_at, id) WHERE status = 'active' AND stock > 0;
+        -- выборка офферов по набору ближайших мерчантов (/public/offers/nearby)
+        CREATE INDEX IF NOT EXISTS idx_offers_merchant_active
+          ON offers(merchant_id, expires_at) WHERE status = 'active' AND stock > 0;
+
+        CREATE TABLE IF NOT EXISTS reservations (
+          id SERIAL PRIMARY KEY,
+          offer_id INT NOT NULL REFERENCES offers(id) ON DELETE CASCADE,
+          code TEXT NOT NULL UNIQUE,
+          qty INT NOT NULL DEFAULT 1,
+          name TEXT,
+          phone TEXT,
+          status TEXT NOT NULL DEFAULT 'held',
+          hold_until TIMESTAMPTZ NOT NULL,
+          redeemed_at TIMESTAMPTZ,
+          created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        CREATE INDEX IF NOT EXISTS idx_reservations_offer ON reservations(offer_id);
+        -- фоновая очистка просроченных броней идёт только по 'held'
+        CREATE INDEX IF NOT EXISTS idx_reservations_held
+          ON reservations(hold_until) WHERE status = 'held';
+
+        -- Гарантируем базового мерчанта с id=1 (для пилота)
+        INSERT INTO merchants (id, name, address, phone)
+        VALUES (1, 'Demo Restaurant', 'Demo address', '+000000000')
+        ON CONFLICT (id) DO NOTHING;
+        -- id=1 вставлен явно — сдвигаем SERIAL, иначе первый же INSERT без id упадёт на merchants_pkey
+        SELECT setval(pg_get_serial_sequence('merchants', 'id'), (SELECT MAX(id) FROM merchants));
+    """),
+    (2, "legacy foody_* tables (bootstrap_sql)", r"""
+        CREATE TABLE IF NOT EXISTS foody_restaurants (
+            restaurant_id TEXT,
+            api_key       TEXT,
+            name          TEXT,
+            phone         TEXT,
+            address       TEXT,
+            lat           DOUBLE PRECISION,
+            lng           DOUBLE PRECISION,
+            close_time    TEXT,
+            created_at    TIMESTAMPTZ DEFAULT now()
+        );
+        ALTER TABLE foody_restaurants
+            ADD COLUMN IF NOT EXISTS restaurant_id TEXT,
+            ADD COLUMN IF NOT EXISTS api_key TEXT,
+            ADD COLUMN IF NOT EXISTS name TEXT,
+            ADD COLUMN IF NOT EXISTS phone TEXT,
+            ADD COLUMN IF NOT EXISTS address TEXT,
+            ADD COLUMN IF NOT EXISTS lat DOUBLE PRECISION,
+            ADD COLUMN IF NOT EXISTS lng DOUBLE PRECISION,
+            ADD COLUMN IF NOT EXISTS close_time TEXT,
+            ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ DEFAULT now(),
+            ADD COLUMN IF NOT EXISTS id BIGINT;
+
+        -- numeric `id` + sequence (works even if existing id is TEXT)
+        CREATE SEQUENCE IF NOT EXISTS foody_restaurants_id_seq OWNED BY foody_restaurants.id;
+        ALTER TABLE foody_restaurants ALTER COLUMN id SET DEFAULT nextval('foody_restaurants_id_seq');
+        DO $$
+        DECLARE
+          v_typ text;
+          v_max bigint;
+        BEGIN
+          SELECT data_type INTO v_typ
+          FROM information_schema.columns
+          WHERE table_name = 'foody_restaurants' AND column_name = 'id' AND table_schema = current_schema();
+
+          IF v_typ IN ('integer', 'bigint', 'smallint') THEN
+            EXECUTE 'SELECT COALESCE(MAX(id), 0) FROM foody_restaurants' INTO v_max;
+          ELSE
+            -- text or other: consider only numeric-looking ids
+            EXECUTE $q$
+              SELECT COALESCE(MAX(CASE WHEN id ~ '^\d+$' THEN id::bigint ELSE NULL END), 0)
+              FROM foody_restaurants
+            $q$ INTO v_max;
+          END IF;
+
+          IF v_max > 0 THEN
+            PERFORM setval('foody_restaurants_id_seq', v_max);
+          END IF;
+        END $$;
+        UPDATE foody_restaurants SET id = nextval('foody_restaurants_id_seq') WHERE id IS NULL;
+        ALTER TABLE foody_restaurants ALTER COLUMN id SET NOT NULL;
+        -- business key on restaurant_id
+        CREATE UNIQUE INDEX IF NOT EXISTS foody_restaurants_rid_uidx ON foody_restaurants(restaurant_id);
+
+        CREATE TABLE IF NOT EXISTS foody_offers (
+            id                   SERIAL PRIMARY KEY,
+            restaurant_id        TEXT NOT NULL,
+            title                TEXT,
+            price_cents          INTEGER NOT NULL DEFAULT 0,
+            original_price_cents INTEGER,
+            qty_total            INTEGER DEFAULT 0,
+            qty_left             INTEGER DEFAULT 0,
+            expires_at           TIMESTAMPTZ,
+            image_url            TEXT,
+            description          TEXT,
+            status               TEXT NOT NULL DEFAULT 'active',
+            created_at           TIMESTAMPTZ DEFAULT now()
+        );
+        ALTER TABLE foody_offers
+            ADD COLUMN IF NOT EXISTS restaurant_id TEXT,
+            ADD COLUMN IF NOT EXISTS title TEXT,
+            ADD COLUMN IF NOT EXISTS price_cents INTEGER DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS original_price_cents INTEGER,
+            ADD COLUMN IF NOT EXISTS qty_total INTEGER DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS qty_left INTEGER DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS expires_at TIMESTAMPTZ,
+            ADD COLUMN IF NOT EXISTS image_url TEXT,
+            ADD COLUMN IF NOT EXISTS description TEXT,
+            ADD COLUMN IF NOT EXISTS status TEXT DEFAULT 'active',
+            ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ DEFAULT now();
+        CREATE INDEX IF NOT EXISTS foody_offers_restaurant_idx ON foody_offers(restaurant_id);
+
+        CREATE TABLE IF NOT EXISTS foody_redeems (
+            id            SERIAL PRIMARY KEY,
+            restaurant_id TEXT NOT NULL,
+            offer_id      INTEGER,
+            code          TEXT NOT NULL UNIQUE,
+            amount_cents  INTEGER DEFAULT 0,
+            redeemed_at   TIMESTAMPTZ DEFAULT now()
+        );
+        ALTER TABLE foody_redeems
+            ADD COLUMN IF NOT EXISTS restaurant_id TEXT,
+            ADD COLUMN IF NOT EXISTS offer_id INTEGER,
+            ADD COLUMN IF NOT EXISTS code TEXT,
+            ADD COLUMN IF NOT EXISTS amount_cents INTEGER DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS redeemed_at TIMESTAMPTZ DEFAULT now();
+        CREATE INDEX IF NOT EXISTS foody_redeems_restaurant_idx ON foody_redeems(restaurant_id);
+    """),
+    (3, "offers by merchant (exports)", r"""
+        CREATE INDEX IF NOT EXISTS idx_offers_merchant ON offers(merchant_id, id);
+    """),
+    (4, "offers NOTIFY triggers (live feed)", r"""
+        -- одна пачка уведомлений на оператор: крупный COPY/UPDATE шлёт один reload, а не тысячи дельт
+        CREATE OR REPLACE FUNCTION foody_offers_notify_insert() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        DECLARE
+          n int;
+          r record;
+        BEGIN
+          SELECT COUNT(*) INTO n FROM new_rows WHERE status = 'active';
+          IF n > 50 THEN
+            PERFORM pg_notify('foody_offers', json_build_object('type', 'reload', 'count', n)::text);
+          ELSE
+            FOR r IN SELECT * FROM new_rows WHERE status = 'active' LOOP
+              PERFORM pg_notify('foody_offers', json_build_object(
+                'type', 'created',
+                'offer', json_build_object(
+                  'id', r.id, 'merchant_id', r.merchant_id, 'title', r.title,
+                  'price', r.price, 'stock', r.stock, 'category', r.category,
+                  'image_url', r.image_url, 'expires_at', r.expires_at
+                )
+              )::text);
+            END LOOP;
+          END IF;
+          RETURN NULL;
+        END $$;
+
+        CREATE OR REPLACE FUNCTION foody_offers_notify_update() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        DECLARE
+          n int;
+          r record;
+        BEGIN
+          SELECT COUNT(*) INTO n
+          FROM new_rows nr JOIN old_rows o ON o.id = nr.id
+          WHERE nr.stock IS DISTINCT FROM o.stock OR nr.status IS DISTINCT FROM o.status;
+          IF n = 0 THEN
+            RETURN NULL;
+          ELSIF n > 50 THEN
+            PERFORM pg_notify('foody_offers', json_build_object('type', 'reload', 'count', n)::text);
+          ELSE
+            FOR r IN
+              SELECT nr.id, nr.stock, nr.status
+              FROM new_rows nr JOIN old_rows o ON o.id = nr.id
+              WHERE nr.stock IS DISTINCT FROM o.stock OR nr.status IS DISTINCT FROM o.status
+            LOOP
+              PERFORM pg_notify('foody_offers', json_build_object(
+                'type', CASE WHEN r.status = 'active' THEN 'stock' ELSE 'expired' END,
+                'id', r.id, 'stock', r.stock, 'status', r.status
+              )::text);
+            END LOOP;
+          END IF;
+          RETURN NULL;
+        END $$;
+
+        DROP TRIGGER IF EXISTS offers_notify_insert ON offers;
+        CREATE TRIGGER offers_notify_insert
+          AFTER INSERT ON offers REFERENCING NEW TABLE AS new_rows
+          FOR EACH STATEMENT EXECUTE FUNCTION foody_offers_notify_insert();
+        DROP TRIGGER IF EXISTS offers_notify_update ON offers;
+        CREATE TRIGGER offers_notify_update
+          AFTER UPDATE ON offers REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+          FOR EACH STATEMENT EXECUTE FUNCTION foody_offers_notify_update();
+    """),
+    (5, "offers/reservations archive (sweeper)", r"""
+        -- сюда sweeper переносит давно неактивные офферы вместе с бронями;
+        -- новые колонки offers/reservations добавлять и в архив
+        CREATE TABLE IF NOT EXISTS offers_archive (
+          id INT PRIMARY KEY,
+          merchant_id INT NOT NULL,
+          title TEXT NOT NULL,
+          description TEXT,
+          category TEXT,
+          price NUMERIC(12,2) NOT NULL,
+          stock INT NOT NULL,
+          image_url TEXT NOT NULL,
+          expires_at TIMESTAMPTZ NOT NULL,
+          status TEXT NOT NULL,
+          created_at TIMESTAMPTZ NOT NULL,
+          archived_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        CREATE INDEX IF NOT EXISTS idx_offers_archive_merchant ON offers_archive(merchant_id, id);
+
+        CREATE TABLE IF NOT EXISTS reservations_archive (
+          id INT PRIMARY KEY,
+          offer_id INT NOT NULL,
+          code TEXT NOT NULL,
+          qty INT NOT NULL,
+          name TEXT,
+          phone TEXT,
+          status TEXT NOT NULL,
+          hold_until TIMESTAMPTZ NOT NULL,
+          redeemed_at TIMESTAMPTZ,
+          created_at TIMESTAMPTZ NOT NULL,
+          archived_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        CREATE INDEX IF NOT EXISTS idx_reservations_archive_offer ON reservations_archive(offer_id);
+
+        -- перевод истёкших в 'expired': только активные, включая распроданные (stock = 0)
+        CREATE INDEX IF NOT EXISTS idx_offers_active_expires
+          ON offers(expires_at) WHERE status = 'active';
+    """),
+    (6, "bot subscriptions (broadcast)", r"""
+        -- подписки бота на «новое предложение рядом» (bot/subscriptions.py)
+        CREATE TABLE IF NOT EXISTS bot_subscriptions (
+          chat_id BIGINT PRIMARY KEY,
+          lat DOUBLE PRECISION NOT NULL,
+          lng DOUBLE PRECISION NOT NULL,
+          radius_km REAL NOT NULL DEFAULT 3,
+          active BOOLEAN NOT NULL DEFAULT TRUE,
+          created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+          updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+        CREATE INDEX IF NOT EXISTS idx_bot_subscriptions_geo
+          ON bot_subscriptions(lat, lng) WHERE active;
+    """),
+    (7, "merchant API keys (hashed)", r"""
+        -- в базе только sha256 ключа (auth.py); сам ключ показывается один раз при выпуске
+        ALTER TABLE merchants ADD COLUMN IF NOT EXISTS api_key_hash BYTEA;
+        ALTER TABLE merchants ADD COLUMN IF NOT EXISTS api_key_rotated_at TIMESTAMPTZ;
+
+        -- ключи кабинета из legacy foody_restaurants, где restaurant_id — числовой id мерчанта
+        UPDATE merchants m
+        SET api_key_hash = k.key_hash, api_key_rotated_at = NOW()
+        FROM (
+          SELECT DISTINCT ON (key_hash) merchant_id, key_hash
+          FROM (
+            SELECT restaurant_id::int AS merchant_id, sha256(convert_to(api_key, 'UTF8')) AS key_hash
+            FROM foody_restaurants
+            WHERE restaurant_id ~ '^\d{1,9}$' AND COALESCE(api_key, '') <> ''
+          ) s
+          ORDER BY key_hash, merchant_id
+        ) k
+        WHERE m.id = k.merchant_id AND m.api_key_hash IS NULL;
+
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_merchants_api_key_hash ON merchants(api_key_hash);
+
+        -- смена/удаление ключа из любого места (API, psql) сбрасывает кэш ключей на всех репликах
+        CREATE OR REPLACE FUNCTION foody_api_keys_notify() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+          PERFORM pg_notify('foody_api_keys', OLD.id::text);
+          RETURN NULL;
+        END $$;
+        DROP TRIGGER IF EXISTS merchants_api_key_notify ON merchants;
+        CREATE TRIGGER merchants_api_key_notify
+          AFTER UPDATE OF api_key_hash OR DELETE ON merchants
+          FOR EACH ROW EXECUTE FUNCTION foody_api_keys_notify();
+    """),
+    (8, "canonical schema: cents, legacy ids (store.py, legacy.py)", r"""
+        -- цены в копейках; price остаётся для старых реплик и выгрузок, пока они его читают
+        ALTER TABLE offers ADD COLUMN IF NOT EXISTS price_cents INTEGER;
+        ALTER TABLE offers ADD COLUMN IF NOT EXISTS original_price_cents INTEGER;
+        ALTER TABLE offers ADD COLUMN IF NOT EXISTS legacy_id INTEGER;
+        ALTER TABLE offers_archive ADD COLUMN IF NOT EXISTS price_cents INTEGER;
+        ALTER TABLE offers_archive ADD COLUMN IF NOT EXISTS original_price_cents INTEGER;
+        ALTER TABLE offers_archive ADD COLUMN IF NOT EXISTS legacy_id INTEGER;
+        ALTER TABLE reservations ADD COLUMN IF NOT EXISTS legacy_redeem_id INTEGER;
+        ALTER TABLE reservations_archive ADD COLUMN IF NOT EXISTS legacy_redeem_id INTEGER;
+        ALTER TABLE merchants ADD COLUMN IF NOT EXISTS legacy_restaurant_id TEXT;
+
+        -- старые реплики во время выкладки пишут только price: копейки досчитывает триггер
+        -- (WHEN — новый код, который пишет оба поля, функцию не вызывает даже на COPY)
+        CREATE OR REPLACE FUNCTION foody_offers_price_cents() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+          NEW.price_cents := round(NEW.price * 100);
+          RETURN NEW;
+        END $$;
+        DROP TRIGGER IF EXISTS offers_price_cents_insert ON offers;
+        CREATE TRIGGER offers_price_cents_insert
+          BEFORE INSERT ON offers
+          FOR EACH ROW WHEN (NEW.price_cents IS NULL)
+          EXECUTE FUNCTION foody_offers_price_cents();
+        DROP TRIGGER IF EXISTS offers_price_cents_update ON offers;
+        CREATE TRIGGER offers_price_cents_update
+          BEFORE UPDATE OF price ON offers
+          FOR EACH ROW WHEN (NEW.price IS DISTINCT FROM OLD.price AND NEW.price_cents IS NOT DISTINCT FROM OLD.price_cents)
+          EXECUTE FUNCTION foody_offers_price_cents();
+
+        -- в offers только живые и недавние офферы (остальное sweeper уносит в архив) — переписываем сразу;
+        -- архив не трогаем, там price_cents у старых строк NULL
+        UPDATE offers SET price_cents = round(price * 100) WHERE price_cents IS NULL;
+        ALTER TABLE offers ALTER COLUMN price_cents SET NOT NULL;
+
+        -- идемпотентный перенос из foody_*: каждая legacy-строка переносится не больше одного раза
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_merchants_legacy ON merchants(legacy_restaurant_id);
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_offers_legacy ON offers(legacy_id) WHERE legacy_id IS NOT NULL;
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_reservations_legacy
+          ON reservations(legacy_redeem_id) WHERE legacy_redeem_id IS NOT NULL;
+
+        -- прогресс фонового переноса (legacy.py): keyset по id legacy-таблицы
+        CREATE TABLE IF NOT EXISTS legacy_backfill (
+          step TEXT PRIMARY KEY,
+          last_id BIGINT NOT NULL DEFAULT 0,
+          copied BIGINT NOT NULL DEFAULT 0,
+          caught_up_at TIMESTAMPTZ,
+          updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+    """),
+    (9, "merchant coordinates: geo_updated_at, sync from foody_restaurants", r"""
+        -- гео-индекс (main._geo_refresh) догружает мерчантов, у которых сменились координаты
+        ALTER TABLE merchants ADD COLUMN IF NOT EXISTS geo_updated_at TIMESTAMPTZ;
+        CREATE INDEX IF NOT EXISTS idx_merchants_geo_updated ON merchants(geo_updated_at)
+          WHERE geo_updated_at IS NOT NULL;
+
+        CREATE OR REPLACE FUNCTION foody_merchants_geo_touch() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+          NEW.geo_updated_at := clock_timestamp();
+          RETURN NEW;
+        END $$;
+        DROP TRIGGER IF EXISTS merchants_geo_touch ON merchants;
+        CREATE TRIGGER merchants_geo_touch
+          BEFORE UPDATE OF lat, lng ON merchants
+          FOR EACH ROW
+          WHEN (OLD.lat IS DISTINCT FROM NEW.lat OR OLD.lng IS DISTINCT FROM NEW.lng)
+          EXECUTE FUNCTION foody_merchants_geo_touch();
+
+        -- координаты, которые старый кабинет меняет в foody_restaurants, доезжают до мерчанта
+        CREATE OR REPLACE FUNCTION foody_restaurants_geo_sync() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+          UPDATE merchants SET lat = NEW.lat, lng = NEW.lng
+          WHERE legacy_restaurant_id = NEW.restaurant_id
+            AND (lat IS DISTINCT FROM NEW.lat OR lng IS DISTINCT FROM NEW.lng);
+          RETURN NULL;
+        END $$;
+        DROP TRIGGER IF EXISTS foody_restaurants_geo_sync ON foody_restaurants;
+        CREATE TRIGGER foody_restaurants_geo_sync
+          AFTER UPDATE OF lat, lng ON foody_restaurants
+          FOR EACH ROW
+          WHEN (OLD.lat IS DISTINCT FROM NEW.lat OR OLD.lng IS DISTINCT FROM NEW.lng)
+          EXECUTE FUNCTION foody_restaurants_geo_sync();
+
+        -- уже перенесённые рестораны без координат
+        UPDATE merchants m SET lat = fr.lat, lng = fr.lng
+        FROM foody_restaurants fr
+        WHERE m.legacy_restaurant_id = fr.restaurant_id
+          AND m.lat IS NULL AND fr.lat IS NOT NULL AND fr.lng IS NOT NULL;
+    """),
+    (10, "bounded offers NOTIFY payload (live feed)", r"""
+        -- payload pg_notify ограничен 8000 байт: длинный title/image_url ронял бы сам INSERT.
+        -- Шлём id и короткие поля, текст обрезаем; цена — в копейках, как в витрине
+        CREATE OR REPLACE FUNCTION foody_offers_notify_insert() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        DECLARE
+          n int;
+          r record;
+        BEGIN
+          SELECT COUNT(*) INTO n FROM new_rows WHERE status = 'active';
+          IF n > 50 THEN
+            PERFORM pg_notify('foody_offers', json_build_object('type', 'reload', 'count', n)::text);
+          ELSE
+            FOR r IN SELECT * FROM new_rows WHERE status = 'active' LOOP
+              PERFORM pg_notify('foody_offers', json_build_object(
+                'type', 'created',
+                'offer', json_build_object(
+                  'id', r.id, 'merchant_id', r.merchant_id, 'title', left(r.title, 200),
+                  'price', r.price, 'price_cents', r.price_cents,
+                  'original_price_cents', r.original_price_cents, 'stock', r.stock,
+                  'category', left(r.category, 50),
+                  'image_url', CASE WHEN length(r.image_url) <= 1000 THEN r.image_url END,
+                  'expires_at', r.expires_at
+                )
+              )::text);
+            END LOOP;
+          END IF;
+          RETURN NULL;
+        END $$;
+    """),
+    (11, "API key NOTIFY on merchant INSERT", r"""
+        -- ключ, появившийся вместе с мерчантом (перенос из foody_*, INSERT вручную), тоже сбрасывает
+        -- кэш ключей: иначе закэшированный как неизвестный он отвечал бы 401 до API_KEY_NEGATIVE_TTL
+        CREATE OR REPLACE FUNCTION foody_api_keys_notify() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+          PERFORM pg_notify('foody_api_keys', (CASE WHEN TG_OP = 'INSERT' THEN NEW.id ELSE OLD.id END)::text);
+          RETURN NULL;
+        END $$;
+        DROP TRIGGER IF EXISTS merchants_api_key_notify_insert ON merchants;
+        CREATE TRIGGER merchants_api_key_notify_insert
+          AFTER INSERT ON merchants
+          FOR EACH ROW WHEN (NEW.api_key_hash IS NOT NULL)
+          EXECUTE FUNCTION foody_api_keys_notify();
+    """),
+    (12, "legacy backfill: redeem amounts, skipped rows", r"""
+        -- сумма погашения из foody_redeems.amount_cents: выгрузка берёт её, а не текущую цену оффера * qty
+        ALTER TABLE reservations ADD COLUMN IF NOT EXISTS legacy_amount_cents INTEGER;
+        ALTER TABLE reservations_archive ADD COLUMN IF NOT EXISTS legacy_amount_cents INTEGER;
+
+        -- строки, которые перенос прошёл, но не перенёс (конфликт кода, нет ресторана/оффера),
+        -- и строки с нечисловым id, которые keyset не видит (legacy.py)
+        ALTER TABLE legacy_backfill ADD COLUMN IF NOT EXISTS skipped BIGINT NOT NULL DEFAULT 0;
+        ALTER TABLE legacy_backfill ADD COLUMN IF NOT EXISTS non_integer_ids BIGINT NOT NULL DEFAULT 0;
+        -- перенесённый двойным чтением оффер мог уехать в архив раньше, чем до него дошёл перенос
+        CREATE INDEX IF NOT EXISTS idx_offers_archive_legacy ON offers_archive(legacy_id) WHERE legacy_id IS NOT NULL;
+    """),
+]
+
+LATEST = MIGRATIONS[-1][0]
+
+
+async def current_version(conn: asyncpg.Connection) -> int:
+    try:
+        return await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    except asyncpg.UndefinedTableError:
+        return 0
+
+
+async def migrate(conn: asyncpg.Connection) -> List[int]:
+    """
+    Доводит схему до LATEST. Возвращает список применённых версий (пустой — схема уже актуальна).
+    """
+    if await current_version(conn) >= LATEST:
+        return []
+
+    applied = []
+    await conn.execute("SELECT pg_advisory_lock($1)", LOCK_KEY)
+    try:
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+              version INT PRIMARY KEY,
+              name TEXT NOT NULL,
+              applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+            """
+        )
+        # пока ждали блокировку, другая реплика могла всё применить
+        current = await current_version(conn)
+        for version, name, sql in MIGRATIONS:
+            if version <= current:
+                continue
+            async with conn.transaction():
+                await conn.execute("SELECT set_config('lock_timeout', $1, true)", LOCK_TIMEOUT)
+                await conn.execute(sql)
+                await conn.execute(
+                    "INSERT INTO schema_version (version, name) VALUES ($1, $2)", version, name
+                )
+            print(f"MIGRATION: applied {version} ({name})")
+            applied.append(version)
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", LOCK_KEY)
+    return applied
@@ -0,0 +1,126 @@
+"""
+Бронирование офферов.
+
+Списание остатка и создание брони — один SQL-оператор: условный UPDATE
+(stock >= qty) и INSERT в reservations через data-modifying CTE. Под нагрузкой
+на один «горячий» оффер конкурирующие транзакции выстраиваются на блокировке
+строки offers, и ни одна не может увести stock в минус.
+Неподтверждённые брони истекают фоном и возвращают остаток в оффер.
+"""
+import secrets
+from typing import Optional
+
+import asyncpg
+
+# Без похожих символов (0/O, 1/I/L) — код диктуют вслух на кассе
+CODE_ALPHABET = "23456789ABCDEFGHJKMNPQRSTUVWXYZ"
+CODE_LENGTH = 8
+CODE_ATTEMPTS = 5
+
+def new_code() -> str:
+    return "".join(secrets.choice(CODE_ALPHABET) for _ in range(CODE_LENGTH))
+
+
+async def reserve(
+    conn: asyncpg.Connection,
+    offer_id: int,
+    qty: int,
+    name: Optional[str],
+    phone: Optional[str],
+    hold_minutes: int,
+) -> Optional[asyncpg.Record]:
+    """
+    Списывает qty и создаёт бронь. None — оффера нет, он неактивен/истёк или остатка не хватает.
+    """
+    for attempt in range(CODE_ATTEMPTS):
+        try:
+            return await conn.fetchrow(
+                """
+                WITH dec AS (
+                  UPDATE offers
+                  SET stock = stock - $2
+                  WHERE id = $1
+                    AND status = 'active'
+                    AND expires_at > NOW()
+                    AND stock >= $2
+                  RETURNING id, stock
+                ), ins AS (
+                  INSERT INTO reservations (offer_id, code, qty, name, phone, hold_until)
+                  SELECT dec.id, $3, $2, $4, $5, NOW() + make_interval(mins => $6)
+                  FROM dec
+                  RETURNING id, offer_id, code, qty, status, hold_until
+                )
+                SELECT ins.*, dec.stock AS stock_left
+                FROM ins JOIN dec ON dec.id = ins.offer_id
+                """,
+                offer_id, qty, new_code(), name, phone, hold_minutes,
+            )
+        except asyncpg.UniqueViolationError:
+            # коллизия кода: оператор откатился целиком (вместе со списанием) — пробуем другой код
+            if attempt == CODE_ATTEMPTS - 1:
+                raise
+    return None
+
+
+async def redeem(conn: asyncpg.Connection, code: str, merchant_id: Optional[int] = None) -> Optional[asyncpg.Record]:
+    """
+    Погашает активную бронь по коду. None — кода нет или бронь уже не 'held'.
+    merchant_id — только бронь на оффер этого мерчанта (чужой код выглядит как несуществующий).
+    """
+    if merchant_id is None:
+        return await conn.fetchrow(
+            """
+            UPDATE reservations
+            SET status = 'redeemed', redeemed_at = NOW()
+            WHERE code = $1 AND status = 'held' AND hold_until > NOW()
+            RETURNING id, offer_id, code, qty, status, redeemed_at
+            """,
+            code,
+        )
+    return await conn.fetchrow(
+        """
+        UPDATE reservations r
+        SET status = 'redeemed', redeemed_at = NOW()
+        FROM offers o
+        WHERE r.code = $1 AND r.status = 'held' AND r.hold_until > NOW()
+          AND o.id = r.offer_id AND o.merchant_id = $2
+        RETURNING r.id, r.offer_id, r.code, r.qty, r.status, r.redeemed_at
+        """,
+        code,
+        merchant_id,
+    )
+
+
+async def expire_holds(conn: asyncpg.Connection, batch: int) -> int:
+    """
+    Переводит до batch просроченных броней в 'expired' и возвращает их qty в офферы.
+    SKIP LOCKED — несколько реплик могут чистить параллельно, не мешая друг другу.
+    Возвращает число истёкших броней.
+    """
+    row = await conn.fetchrow(
+        """
+        WITH exp AS (
+          UPDATE reservations r
+          SET status = 'expired'
+          WHERE r.id IN (
+            SELECT id FROM reservations
+            WHERE status = 'held' AND hold_until <= NOW()
+            ORDER BY hold_until
+            LIMIT $1
+            FOR UPDATE SKIP LOCKED
+          )
+          RETURNING r.offer_id, r.qty
+        ), back AS (
+          SELECT offer_id, SUM(qty) AS qty FROM exp GROUP BY offer_id
+        ), restored AS (
+          UPDATE offers o
+          SET stock = o.stock + back.qty
+          FROM back
+          WHERE o.id = back.offer_id
+          RETURNING o.id
+        )
+        SELECT (SELECT COUNT(*) FROM exp) AS expired, (SELECT COUNT(*) FROM restored) AS offers
+        """,
+        batch,
+    )
+    return row["expired"]
@@ -0,0 +1,178 @@
+"""
+Загрузка файлов в Cloudflare R2 (S3 API).
+
+Один boto3-клиент на процесс с пулом keep-alive соединений; все блокирующие
+вызовы boto3 выполняются в ограниченном пуле потоков, а не на event loop.
+Тело читается из UploadFile кусками: маленькие файлы уходят одним put_object,
+большие — multipart-загрузкой, так что в памяти не больше двух частей.
+"""
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import boto3
+from botocore.config import Config as BotoConfig
+from fastapi import UploadFile
+
+import instrumentation
+
+R2_ENDPOINT = os.environ.get("R2_ENDPOINT")  # https://<account>.r2.cloudflarestorage.com
+R2_BUCKET = os.environ.get("R2_BUCKET")
+R2_ACCESS_KEY_ID = os.environ.get("R2_ACCESS_KEY_ID")
+R2_SECRET_ACCESS_KEY = os.environ.get("R2_SECRET_ACCESS_KEY")
+
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", "4"))
+# S3 требует части multipart не меньше 5 МБ (кроме последней)
+UPLOAD_PART_BYTES = max(5 * 1024 * 1024, int(os.environ.get("UPLOAD_PART_BYTES", str(8 * 1024 * 1024))))
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+_client = None
+_client_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="r2")
+
+
+def client():
+    """
+    Общий S3-клиент (boto3-клиенты потокобезопасны). Создаётся при первом обращении.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if not all([R2_ENDPOINT, R2_BUCKET, R2_ACCESS_KEY_ID, R2_SECRET_ACCESS_KEY]):
+                    raise RuntimeError("R2 env not configured")
+                _client = boto3.client(
+                    "s3",
+                    endpoint_url=R2_ENDPOINT,
+                    aws_access_key_id=R2_ACCESS_KEY_ID,
+                    aws_secret_access_key=R2_SECRET_ACCESS_KEY,
+                    config=BotoConfig(
+                        signature_version="s3v4",
+                        max_pool_connections=UPLOAD_WORKERS,
+                        tcp_keepalive=True,
+                        retries={"max_attempts": 3, "mode": "standard"},
+                    ),
+                    region_name="auto",
+                )
+    return _client
+
+
+def public_url(key: str) -> str:
+    """
+    Account endpoint: https://<account>.r2.cloudflarestorage.com
+    Public URL:       https://pub-<account>.r2.dev/<bucket>/<key>
+    Фоллбэк (если pub-домен не настроен): <endpoint>/<bucket>/<key>
+    """
+    try:
+        host = R2_ENDPOINT.split("//", 1)[-1]
+        account = host.split(".", 1)[0]
+        return f"https://pub-{account}.r2.dev/{R2_BUCKET}/{key}"
+    except Exception:
+        return f"{R2_ENDPOINT.rstrip('/')}/{R2_BUCKET}/{key}"
+
+
+async def _call(fn, **kwargs):
+    op = getattr(fn, "__name__", "call")
+    queued = time.perf_counter()
+
+    def run():
+        started = time.perf_counter()
+        instrumentation.R2_WAIT.observe(started - queued)
+        try:
+            result = fn(**kwargs)
+        except Exception:
+            instrumentation.R2_ERRORS.labels(op).inc()
+            raise
+        finally:
+            instrumentation.R2_CALL.labels(op).observe(time.perf_counter() - started)
+        body = kwargs.get("Body")
+        if isinstance(body, (bytes, bytearray)):
+            instrumentation.R2_BYTES.inc(len(body))
+        return result
+
+    return await asyncio.get_running_loop().run_in_executor(_executor, run)
+
+
+async def _read_part(file: UploadFile, total: int) -> bytes:
+    part = await file.read(UPLOAD_PART_BYTES)
+    if total + len(part) > UPLOAD_MAX_BYTES:
+        raise UploadTooLarge(f"File is larger than {UPLOAD_MAX_BYTES} bytes")
+    return part
+
+
+async def read_upload(file: UploadFile) -> bytes:
+    """
+    Читает UploadFile целиком, но не больше UPLOAD_MAX_BYTES.
+    """
+    chunks = []
+    total = 0
+    while True:
+        part = await _read_part(file, total)
+        if not part:
+            return b"".join(chunks)
+        chunks.append(part)
+        total += len(part)
+
+
+async def put_bytes(key: str, body: bytes, content_type: str):
+    await _call(client().put_object, Bucket=R2_BUCKET, Key=key, Body=body, ContentType=content_type)
+
+
+async def put_upload(file: UploadFile, key: str, content_type: Optional[str]) -> int:
+    """
+    Стримит UploadFile в R2 под ключом key. Возвращает размер в байтах.
+    """
+    s3 = client()
+    extra = {"ContentType": content_type or "application/octet-stream"}
+
+    first = await _read_part(file, 0)
+    second = await _read_part(file, len(first)) if len(first) == UPLOAD_PART_BYTES else b""
+    if not second:
+        # У R2 ACL часто игнорируются — не передаем ACL вовсе.
+        await _call(s3.put_object, Bucket=R2_BUCKET, Key=key, Body=first, **extra)
+        return len(first)
+
+    mpu = await _call(s3.create_multipart_upload, Bucket=R2_BUCKET, Key=key, **extra)
+    upload_id = mpu["UploadId"]
+    parts = []
+    total = 0
+
+    async def send(body: bytes):
+        nonlocal total
+        number = len(parts) + 1
+        resp = await _call(
+            s3.upload_part,
+            Bucket=R2_BUCKET, Key=key, UploadId=upload_id, PartNumber=number, Body=body,
+        )
+        parts.append({"PartNumber": number, "ETag": resp["ETag"]})
+        total += len(body)
+
+    try:
+        await send(first)
+        await send(second)
+        while True:
+            part = await _read_part(file, total)
+            if not part:
+                break
+            await send(part)
+        await _call(
+            s3.complete_multipart_upload,
+            Bucket=R2_BUCKET, Key=key, UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+        return total
+    except BaseException:
+        # незавершённые части в R2 хранятся (и тарифицируются), пока upload не отменён
+        try:
+            await _call(s3.abort_multipart_upload, Bucket=R2_BUCKET, Key=key, UploadId=upload_id)
+        except Exception as e:
+            print("UPLOAD_ABORT_ERROR:", repr(e))
+        raise
@@ -0,0 +1,278 @@
+"""
+Доступ к данным мерчантов и офферов: витрина, страницы, «рядом», создание, импорт,
+выгрузки, ключи и координаты мерчантов.
+
+Не здесь — SQL, который меняет остаток и статус как часть своей логики и живёт рядом с ней:
+брони и погашения (reservations.py), истечение и архив (sweeper.py), перенос foody_* (legacy.py).
+
+Каноническая схема — merchants / offers / reservations (migrations.py):
+  * id целые (MerchantId, OfferId). Строковый restaurant_id старого кабинета лежит
+    в merchants.legacy_restaurant_id, в id его переводит resolve_merchant();
+  * деньги — целые копейки (price_cents, original_price_cents). offers.price (NUMERIC)
+    пишется рядом для старых реплик, запросы этого модуля его не читают (кроме архива
+    до миграции 8).
+
+Таблицы foody_* только переносятся в эту схему (legacy.py), горячие запросы в них не ходят.
+"""
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import Any, Iterable, List, NewType, Optional, Sequence, Set, Tuple
+
+import asyncpg
+
+MerchantId = NewType("MerchantId", int)
+OfferId = NewType("OfferId", int)
+Cents = NewType("Cents", int)
+
+# INTEGER в Postgres: id, stock, *_cents
+INT4_MAX = 2**31 - 1
+
+# Порядок полей кортежа оффера — он же порядок колонок COPY в bulk-импорте
+OFFER_COLUMNS = (
+    "merchant_id", "title", "description", "price", "price_cents", "original_price_cents",
+    "stock", "category", "image_url", "expires_at", "status",
+)
+
+# что отдают витрина, страницы и «рядом»
+_OFFER_FIELDS = """
+    o.id, o.title, o.description, o.price_cents, o.original_price_cents, o.stock, o.category,
+    o.image_url, o.expires_at, o.status,
+    m.id AS merchant_id, m.name AS merchant_name, m.address
+"""
+
+
+def to_cents(value: Any) -> Cents:
+    """
+    199 / "199.9" / "199,90" / Decimal -> копейки. ValueError — не число или меньше нуля.
+    """
+    try:
+        amount = Decimal(str(value).strip().replace(",", "."))
+    except InvalidOperation:
+        raise ValueError("not a number")
+    if not amount.is_finite() or amount < 0:
+        raise ValueError("must be >= 0")
+    # до quantize: на 1e30 он сам падает с InvalidOperation
+    if amount * 100 > INT4_MAX:
+        raise ValueError("too large")
+    # как round() в Postgres для numeric: половина — от нуля
+    return Cents(int((amount * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP)))
+
+
+def cents_to_price(cents: int) -> Decimal:
+    return (Decimal(cents) / 100).quantize(Decimal("0.01"))
+
+
+# ---------- офферы ----------
+
+_PUBLIC_OFFERS_SQL = f"""
+    SELECT {_OFFER_FIELDS}
+    FROM offers o
+    JOIN merchants m ON m.id = o.merchant_id
+    WHERE o.status = 'active'
+      AND o.expires_at > NOW()
+      AND o.stock > 0
+    ORDER BY o.expires_at ASC
+    LIMIT 200
+"""
+
+
+async def public_offers(conn: asyncpg.Connection) -> List[asyncpg.Record]:
+    return await conn.fetch(_PUBLIC_OFFERS_SQL)
+
+
+async def offers_page(
+    conn: asyncpg.Connection,
+    after: Optional[Tuple[datetime, int]],
+    category: Optional[str],
+    min_cents: Optional[Cents],
+    max_cents: Optional[Cents],
+    limit: int,
+) -> List[asyncpg.Record]:
+    """
+    До limit строк по ключу (expires_at, id) после курсора after.
+    """
+    # SQL собираем только из нужных условий: с "$n IS NULL OR ..." generic-план
+    # подготовленного запроса перестаёт использовать частичные индексы
+    where = ["o.status = 'active'", "o.stock > 0", "o.expires_at > NOW()"]
+    args: list[Any] = []
+    if after:
+        args += list(after)
+        where.append(f"(o.expires_at, o.id) > (${len(args) - 1}, ${len(args)})")
+    if category:
+        args.append(category)
+        where.append(f"o.category = ${len(args)}")
+    if min_cents is not None:
+        args.append(min_cents)
+        where.append(f"o.price_cents >= ${len(args)}")
+    if max_cents is not None:
+        args.append(max_cents)
+        where.append(f"o.price_cents <= ${len(args)}")
+    args.append(limit)
+    return await conn.fetch(
+        f"""
+        SELECT {_OFFER_FIELDS}
+        FROM offers o
+        JOIN merchants m ON m.id = o.merchant_id
+        WHERE {" AND ".join(where)}
+        ORDER BY o.expires_at ASC, o.id ASC
+        LIMIT ${len(args)}
+        """,
+        *args,
+    )
+
+
+async def offers_nearby(conn: asyncpg.Connection, merchant_ids: Sequence[int],
+                        distances_km: Sequence[float]) -> List[asyncpg.Record]:
+    return await conn.fetch(
+        f"""
+        SELECT {_OFFER_FIELDS}, n.distance_km
+        FROM unnest($1::int[], $2::float8[]) AS n(merchant_id, distance_km)
+        JOIN offers o ON o.merchant_id = n.merchant_id
+        JOIN merchants m ON m.id = n.merchant_id
+        WHERE o.status = 'active'
+          AND o.expires_at > NOW()
+          AND o.stock > 0
+        ORDER BY n.distance_km ASC, o.expires_at ASC
+        LIMIT 200
+        """,
+        list(merchant_ids),
+        list(distances_km),
+    )
+
+
+async def insert_offer(conn: asyncpg.Connection, row: tuple) -> OfferId:
+    """
+    row — кортеж по OFFER_COLUMNS.
+    """
+    return OfferId(await conn.fetchval(
+        f"""
+        INSERT INTO offers ({", ".join(OFFER_COLUMNS)}, created_at)
+        VALUES ({", ".join(f"${i}" for i in range(1, len(OFFER_COLUMNS) + 1))}, NOW())
+        RETURNING id
+        """,
+        *row,
+    ))
+
+
+async def copy_offers(conn: asyncpg.Connection, rows: Sequence[tuple]):
+    await conn.copy_records_to_table("offers", records=rows, columns=OFFER_COLUMNS)
+
+
+async def offer_exists(conn: asyncpg.Connection, offer_id: int) -> bool:
+    return bool(await conn.fetchval("SELECT 1 FROM offers WHERE id = $1", offer_id))
+
+
+# ---------- выгрузки ----------
+# Текст запроса, а не функция: main._export стримит его серверным курсором
+# ($1 — мерчант, $2/$3 — since/until по created_at). Деньги считаются из копеек,
+# price/amount в рублях остаются на прежних местах для таблиц кабинета, копейки — в конце.
+# В архиве у строк, ушедших туда до миграции 8, price_cents NULL — их копейки из price.
+_ARCHIVE_CENTS = "COALESCE(o.price_cents, round(o.price * 100)::int)"
+
+
+def _export_offers(table: str, cents: str) -> str:
+    return f"""
+    SELECT o.id, o.title, o.description, o.category, ({cents} / 100.0)::numeric(12, 2) AS price,
+           o.stock, o.status, o.image_url, o.expires_at, o.created_at,
+           {cents} AS price_cents, o.original_price_cents
+    FROM {table} o
+    WHERE o.merchant_id = $1
+      AND ($2::timestamptz IS NULL OR o.created_at >= $2)
+      AND ($3::timestamptz IS NULL OR o.created_at < $3)
+    """
+
+
+def _export_redeems(offers: str, reservations: str, cents: str) -> str:
+    # перенесённое из foody_redeems погашение — со своей суммой, а не по текущей цене оффера
+    amount = f"COALESCE(r.legacy_amount_cents::bigint, {cents}::bigint * r.qty)"
+    return f"""
+    SELECT r.id, r.code, r.offer_id, o.title AS offer_title, r.qty,
+           ({amount} / 100.0)::numeric(14, 2) AS amount, r.status, r.name, r.phone,
+           r.created_at, r.hold_until, r.redeemed_at,
+           {amount} AS amount_cents
+    FROM {offers} o
+    JOIN {reservations} r ON r.offer_id = o.id
+    WHERE o.merchant_id = $1
+      AND ($2::timestamptz IS NULL OR r.created_at >= $2)
+      AND ($3::timestamptz IS NULL OR r.created_at < $3)
+    """
+
+
+EXPORT_OFFERS_SQL = (
+    _export_offers("offers", "o.price_cents")
+    + "UNION ALL"
+    + _export_offers("offers_archive", _ARCHIVE_CENTS)
+    + "ORDER BY id"
+)
+
+EXPORT_REDEEMS_SQL = (
+    _export_redeems("offers", "reservations", "o.price_cents")
+    + "UNION ALL"
+    + _export_redeems("offers_archive", "reservations_archive", _ARCHIVE_CENTS)
+    + "ORDER BY id"
+)
+
+
+# ---------- мерчанты ----------
+
+async def existing_merchants(conn: asyncpg.Connection, merchant_ids: Iterable[int]) -> Set[MerchantId]:
+    rows = await conn.fetch("SELECT id FROM merchants WHERE id = ANY($1::int[])", list(merchant_ids))
+    return {MerchantId(r["id"]) for r in rows}
+
+
+async def merchants_after(conn: asyncpg.Connection, after_id: int) -> List[asyncpg.Record]:
+    """
+    id, lat, lng, geo_updated_at мерчантов с id > after_id по возрастанию (гео-индекс).
+    """
+    return await conn.fetch(
+        "SELECT id, lat, lng, geo_updated_at FROM merchants WHERE id > $1 ORDER BY id", after_id
+    )
+
+
+async def merchants_moved(conn: asyncpg.Connection, since: datetime) -> List[asyncpg.Record]:
+    """
+    Мерчанты, у которых координаты менялись позже since (триггер merchants_geo_touch).
+    """
+    return await conn.fetch(
+        "SELECT id, lat, lng, geo_updated_at FROM merchants WHERE geo_updated_at > $1 ORDER BY geo_updated_at",
+        since,
+    )
+
+
+async def set_location(conn: asyncpg.Connection, merchant_id: int,
+                       lat: Optional[float], lng: Optional[float]) -> bool:
+    """
+    False — такого мерчанта нет. None/None убирает мерчанта из поиска рядом.
+    """
+    found = await conn.fetchval(
+        "UPDATE merchants SET lat = $2, lng = $3 WHERE id = $1 RETURNING id", merchant_id, lat, lng
+    )
+    return found is not None
+
+
+async def resolve_merchant(conn: asyncpg.Connection, ref: str) -> Optional[MerchantId]:
+    """
+    restaurant_id кабинета -> id мерчанта: число — это и есть id (без запроса),
+    строка старого кабинета — через merchants.legacy_restaurant_id.
+    """
+    ref = ref.strip()
+    if ref.isdigit():
+        return MerchantId(int(ref))
+    merchant_id = await conn.fetchval("SELECT id FROM merchants WHERE legacy_restaurant_id = $1", ref)
+    return MerchantId(merchant_id) if merchant_id is not None else None
+
+
+async def merchant_by_key_hash(conn: asyncpg.Connection, digest: bytes) -> Optional[MerchantId]:
+    merchant_id = await conn.fetchval("SELECT id FROM merchants WHERE api_key_hash = $1", digest)
+    return MerchantId(merchant_id) if merchant_id is not None else None
+
+
+async def set_key_hash(conn: asyncpg.Connection, merchant_id: int, digest: bytes) -> bool:
+    """
+    False — такого мерчанта нет.
+    """
+    found = await conn.fetchval(
+        "UPDATE merchants SET api_key_hash = $2, api_key_rotated_at = NOW() WHERE id = $1 RETURNING id",
+        merchant_id, digest,
+    )
+    return found is not None
@@ -0,0 +1,112 @@
+"""
+Фоновая уборка офферов.
+
+1. Истёкшие активные офферы (в том числе распроданные) переводятся в status='expired'.
+2. Неактивные офферы, истёкшие больше archive_after_days назад, вместе с их
+   бронями переезжают в offers_archive / reservations_archive — горячая
+   таблица и её индексы не растут вместе с историей.
+
+Всё пачками по batch строк, каждая пачка — своя транзакция, так что ни таблица,
+ни триггеры NOTIFY не получают одну гигантскую запись. Проход целиком выполняет
+одна реплика: он идёт под pg_try_advisory_lock, и если замок держит другой
+процесс, эта реплика проход пропускает.
+"""
+from typing import Dict, Optional
+
+import asyncpg
+
+# pg_advisory_lock key: b"sweep" как число
+LOCK_KEY = 0x7377656570
+
+_OFFER_COLS = (
+    "id, merchant_id, title, description, category, price, price_cents, original_price_cents, "
+    "stock, image_url, expires_at, status, created_at, legacy_id"
+)
+_RESERVATION_COLS = (
+    "id, offer_id, code, qty, name, phone, status, hold_until, redeemed_at, created_at, "
+    "legacy_redeem_id, legacy_amount_cents"
+)
+
+
+async def expire_offers(conn: asyncpg.Connection, batch: int) -> int:
+    """
+    Одна пачка: active -> expired. Возвращает число переведённых офферов.
+    """
+    return await conn.fetchval(
+        """
+        WITH flipped AS (
+          UPDATE offers SET status = 'expired'
+          WHERE id IN (
+            SELECT id FROM offers
+            WHERE status = 'active' AND expires_at <= NOW()
+            ORDER BY expires_at
+            LIMIT $1
+            FOR UPDATE SKIP LOCKED
+          )
+          RETURNING id
+        )
+        SELECT COUNT(*) FROM flipped
+        """,
+        batch,
+    )
+
+
+async def archive_offers(conn: asyncpg.Connection, batch: int, after_days: int) -> int:
+    """
+    Одна пачка переноса в архив. Возвращает число перенесённых офферов.
+    Брони удаляются явно до офферов: ON DELETE CASCADE иначе унёс бы их мимо архива.
+    """
+    return await conn.fetchval(
+        f"""
+        WITH victims AS (
+          SELECT id FROM offers
+          WHERE status <> 'active' AND expires_at < NOW() - make_interval(days => $2)
+          ORDER BY expires_at
+          LIMIT $1
+          FOR UPDATE SKIP LOCKED
+        ), moved_reservations AS (
+          DELETE FROM reservations r USING victims v
+          WHERE r.offer_id = v.id
+          RETURNING r.*
+        ), archived_reservations AS (
+          INSERT INTO reservations_archive ({_RESERVATION_COLS})
+          SELECT {_RESERVATION_COLS} FROM moved_reservations
+        ), moved AS (
+          DELETE FROM offers o USING victims v
+          WHERE o.id = v.id
+          RETURNING o.*
+        ), archived AS (
+          INSERT INTO offers_archive ({_OFFER_COLS})
+          SELECT {_OFFER_COLS} FROM moved
+          RETURNING id
+        )
+        SELECT COUNT(*) FROM archived
+        """,
+        batch,
+        after_days,
+    )
+
+
+async def _drain(step, conn: asyncpg.Connection, batch: int, *args) -> int:
+    total = 0
+    while True:
+        async with conn.transaction():
+            n = await step(conn, batch, *args)
+        total += n
+        if n < batch:
+            return total
+
+
+async def sweep(conn: asyncpg.Connection, batch: int, archive_after_days: int) -> Optional[Dict[str, int]]:
+    """
+    Один проход. None — замок у другой реплики, проход пропущен.
+    archive_after_days <= 0 отключает перенос в архив.
+    """
+    if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", LOCK_KEY):
+        return None
+    try:
+        expired = await _drain(expire_offers, conn, batch)
+        archived = await _drain(archive_offers, conn, batch, archive_after_days) if archive_after_days > 0 else 0
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", LOCK_KEY)
+    return {"expired": expired, "archived": archived}
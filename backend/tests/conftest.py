@@ -0,0 +1,29 @@
+"""
+Общее для тестов: backend/ в sys.path и клиент без базы.
+"""
+import contextlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+@pytest.fixture
+def no_db_client(monkeypatch):
+    """
+    TestClient, у которого любое взятие соединения из пула — ошибка теста:
+    для проверок, что кривой запрос отсекается до базы.
+    """
+    import main
+    from fastapi.testclient import TestClient
+
+    @contextlib.asynccontextmanager
+    async def no_db():
+        raise AssertionError("connection acquired for an invalid request")
+        yield
+
+    monkeypatch.setattr(main, "_db", no_db)
+    # без with: startup (пул, миграции) не нужен
+    return TestClient(main.app)
@@ -0,0 +1,70 @@
+"""
+Кэш ключей API: уведомление о ключе сбрасывает и отрицательные записи — ключ, который
+появился INSERT'ом (перенос из foody_*), не отвечает 401 до конца API_KEY_NEGATIVE_TTL.
+
+    cd backend && python -m pytest -q tests
+    DATABASE_URL=postgresql://... python -m pytest -q tests   # + проверка через NOTIFY на одноразовой БД
+"""
+import asyncio
+import os
+import sys
+import time
+
+import asyncpg
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import auth  # noqa: E402
+import migrations  # noqa: E402
+
+
+def test_key_notification_drops_negative_entries():
+    cache = auth.ApiKeyCache(negative_ttl=3600)
+    known = {}
+    calls = []
+
+    async def lookup(digest):
+        calls.append(digest)
+        return known.get(digest)
+
+    async def scenario():
+        assert await cache.verify("KEY_new", lookup) is None
+        assert await cache.verify("KEY_new", lookup) is None
+        assert len(calls) == 1
+        known[auth.hash_key("KEY_new")] = 42
+        # NOTIFY про любого мерчанта — «неизвестные» ключи перепроверяются
+        cache.on_notify(None, 0, auth.CHANNEL, "7")
+        assert await cache.verify("KEY_new", lookup) == 42
+        assert len(calls) == 2
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.skipif(not os.environ.get("DATABASE_URL"), reason="нужна одноразовая БД в DATABASE_URL")
+def test_inserted_key_is_accepted_without_waiting_negative_ttl():
+    import main
+    from fastapi.testclient import TestClient
+
+    key = auth.new_key()
+    with TestClient(main.app) as client:
+        headers = {auth.HEADER: key}
+        assert client.post("/merchant/location", json={"lat": 1, "lng": 1}, headers=headers).status_code == 401
+
+        async def insert():
+            conn = await asyncpg.connect(os.environ["DATABASE_URL"])
+            try:
+                await migrations.migrate(conn)
+                await conn.execute(
+                    "INSERT INTO merchants (name, api_key_hash) VALUES ('api key test', $1)", auth.hash_key(key)
+                )
+            finally:
+                await conn.close()
+
+        asyncio.run(insert())
+        deadline = time.monotonic() + 5
+        status = 401
+        while status == 401 and time.monotonic() < deadline:
+            time.sleep(0.05)
+            status = client.post("/merchant/location", json={"lat": 1, "lng": 1}, headers=headers).status_code
+        assert status == 200
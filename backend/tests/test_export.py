@@ -0,0 +1,75 @@
+"""
+Выгрузки: ошибка посреди стрима не оставляет занятыми соединение пула и слот EXPORT_CONCURRENCY;
+погашения (имена и телефоны покупателей) без ключа не отдаются.
+
+    DATABASE_URL=postgresql://... python -m pytest -q tests   # только одноразовая БД
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import asyncpg
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+pytestmark = pytest.mark.skipif(not os.environ.get("DATABASE_URL"), reason="нужна одноразовая БД в DATABASE_URL")
+
+import auth  # noqa: E402
+import main  # noqa: E402
+import migrations  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+async def _seed(key: str) -> int:
+    conn = await asyncpg.connect(os.environ["DATABASE_URL"])
+    try:
+        await migrations.migrate(conn)
+        merchant_id = await conn.fetchval(
+            "INSERT INTO merchants (name, api_key_hash) VALUES ('export test', $1) RETURNING id", auth.hash_key(key)
+        )
+        await conn.execute(
+            """
+            INSERT INTO offers (merchant_id, title, price, price_cents, stock, image_url, expires_at)
+            SELECT $1, 'export test ' || g, 1, 100, 1, 'https://example.com/x.jpg', $2
+            FROM generate_series(1, 3) g
+            """,
+            merchant_id, datetime.now(timezone.utc) + timedelta(hours=1),
+        )
+        return merchant_id
+    finally:
+        await conn.close()
+
+
+def test_failed_stream_releases_connection_and_slot(monkeypatch):
+    key = auth.new_key()
+    asyncio.run(_seed(key))
+    headers = {auth.HEADER: key}
+    # фоновый перенос foody_* на старте тоже берёт соединение — считали бы его утечкой
+    monkeypatch.setattr(main, "LEGACY_BACKFILL_SECONDS", 0)
+    with TestClient(main.app, raise_server_exceptions=False) as client:
+        def broken(value):
+            raise RuntimeError("boom")
+
+        monkeypatch.setattr(main, "_json_default", broken)
+        for _ in range(main.EXPORT_CONCURRENCY):
+            # заголовки уже ушли — клиент видит оборванное тело
+            r = client.get("/merchant/offers/export", params={"format": "ndjson"}, headers=headers)
+            assert r.text == ""
+        assert not main._export_slots.locked()
+        assert main._pool.get_size() - main._pool.get_idle_size() == 0
+
+        monkeypatch.undo()
+        r = client.get("/merchant/offers/export", params={"format": "ndjson"}, headers=headers)
+        assert r.status_code == 200 and len(r.text.splitlines()) == 3
+
+        lines = client.get("/merchant/offers/export", headers=headers).text.splitlines()
+        assert lines[0].endswith(",price_cents,original_price_cents")
+        assert lines[1].split(",")[4] == "1.00" and lines[1].split(",")[-2] == "100"
+
+
+def test_redeems_export_requires_key(monkeypatch):
+    monkeypatch.setattr(main, "MERCHANT_AUTH", False)
+    with TestClient(main.app) as client:
+        assert client.get("/merchant/redeems/export", params={"merchant_id": 1}).status_code == 401
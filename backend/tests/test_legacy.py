@@ -0,0 +1,66 @@
+"""
+Перенос foody_*: сумма погашения доезжает до выгрузки, погашения с конфликтом кода считаются
+пропущенными, TEXT id в foody_restaurants не ломает keyset.
+
+    DATABASE_URL=postgresql://... python -m pytest -q tests   # только одноразовая БД
+"""
+import asyncio
+import os
+import sys
+import uuid
+
+import asyncpg
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+pytestmark = pytest.mark.skipif(not os.environ.get("DATABASE_URL"), reason="нужна одноразовая БД в DATABASE_URL")
+
+import legacy  # noqa: E402
+import migrations  # noqa: E402
+import store  # noqa: E402
+
+
+async def _scenario(schema: str):
+    conn = await asyncpg.connect(os.environ["DATABASE_URL"])
+    try:
+        await conn.execute(f"CREATE SCHEMA {schema}")
+        await conn.execute(f"SET search_path TO {schema}")
+        # старая схема, где id ресторана — TEXT
+        await conn.execute("CREATE TABLE foody_restaurants (id TEXT, restaurant_id TEXT, name TEXT)")
+        await conn.execute("INSERT INTO foody_restaurants VALUES ('7', 'r-one', 'One'), ('x-1', 'r-two', 'Two')")
+        await migrations.migrate(conn)
+        offer_id = await conn.fetchval(
+            """
+            INSERT INTO foody_offers (restaurant_id, title, price_cents, qty_left, expires_at)
+            VALUES ('r-one', 'legacy', 500, 1, NOW() + interval '1 hour') RETURNING id
+            """
+        )
+        await conn.execute(
+            "INSERT INTO foody_redeems (restaurant_id, offer_id, code, amount_cents) "
+            "VALUES ('r-one', $1, 'ab12', 350), ('r-one', $1, 'AB12', 500)",
+            offer_id,
+        )
+
+        # пачка по одной строке: 'ab12' переносится первым, 'AB12' упирается в его код
+        done = await legacy.backfill(conn, 1, "https://example.com/x.jpg")
+        progress = await legacy.progress(conn)
+        merchant_id = await conn.fetchval("SELECT id FROM merchants WHERE legacy_restaurant_id = 'r-one'")
+        exported = await conn.fetch(store.EXPORT_REDEEMS_SQL, merchant_id, None, None)
+        return done, progress, exported
+    finally:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        await conn.close()
+
+
+def test_backfill_keeps_amount_and_counts_skipped(monkeypatch):
+    # тип id закэширован по имени таблицы, а у этой схемы он свой
+    monkeypatch.setattr(legacy, "_id_keys", {})
+    done, progress, exported = asyncio.run(_scenario(f"legacy_test_{uuid.uuid4().hex[:8]}"))
+    assert done["restaurants"] == 1 and done["restaurants_skipped"] == 0
+    assert progress["restaurants"]["non_integer_ids"] == 1
+    assert done["offers"] == 1
+    # 'AB12' совпал с 'ab12' после upper() — пропущен и посчитан
+    assert done["redeems"] == 1 and done["redeems_skipped"] == 1
+    assert progress["redeems"]["skipped"] == 1
+    assert [(r["code"], r["amount_cents"], str(r["amount"])) for r in exported] == [("AB12", 350, "3.50")]
@@ -0,0 +1,70 @@
+"""
+/public/offers/nearby на живой базе: мерчант с координатами находится после старта,
+координаты из POST /merchant/location — сразу, без ожидания догрузки индекса.
+
+    DATABASE_URL=postgresql://... python -m pytest -q tests   # только одноразовая БД
+"""
+import asyncio
+import os
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+
+import asyncpg
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+pytestmark = pytest.mark.skipif(not os.environ.get("DATABASE_URL"), reason="нужна одноразовая БД в DATABASE_URL")
+
+import auth  # noqa: E402
+import main  # noqa: E402
+import migrations  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+# точка в океане — рядом с ней других мерчантов нет
+LAT = -48.0 + random.random()
+LNG = -140.0 + random.random()
+
+
+async def _seed(key: str) -> dict:
+    conn = await asyncpg.connect(os.environ["DATABASE_URL"])
+    try:
+        await migrations.migrate(conn)
+        ids = {}
+        for name, lat, lng, digest in (("placed", LAT, LNG, None), ("moved", None, None, auth.hash_key(key))):
+            merchant_id = await conn.fetchval(
+                "INSERT INTO merchants (name, lat, lng, api_key_hash) VALUES ($1, $2, $3, $4) RETURNING id",
+                f"nearby test {name}", lat, lng, digest,
+            )
+            ids[name] = merchant_id
+            ids[f"{name}_offer"] = await conn.fetchval(
+                """
+                INSERT INTO offers (merchant_id, title, price, price_cents, stock, image_url, expires_at)
+                VALUES ($1, $2, 100, 10000, 3, 'https://example.com/x.jpg', $3) RETURNING id
+                """,
+                merchant_id, f"nearby test {name}", datetime.now(timezone.utc) + timedelta(hours=2),
+            )
+        return ids
+    finally:
+        await conn.close()
+
+
+def test_nearby_finds_seeded_and_moved_merchants():
+    key = auth.new_key()
+    ids = asyncio.run(_seed(key))
+    with TestClient(main.app) as client:
+        found = client.get("/public/offers/nearby", params={"lat": LAT, "lng": LNG, "radius_km": 2}).json()
+        assert [o["id"] for o in found] == [ids["placed_offer"]]
+        assert found[0]["merchant_id"] == ids["placed"]
+
+        r = client.post("/merchant/location", json={"lat": LAT + 0.001, "lng": LNG}, headers={auth.HEADER: key})
+        assert r.status_code == 200, r.text
+        found = client.get("/public/offers/nearby", params={"lat": LAT, "lng": LNG, "radius_km": 2}).json()
+        assert {o["id"] for o in found} == {ids["placed_offer"], ids["moved_offer"]}
+
+        r = client.post("/merchant/location", json={"lat": 91, "lng": LNG}, headers={auth.HEADER: key})
+        assert r.status_code == 400
+        r = client.post("/merchant/location", json={"merchant_id": ids["placed"], "lat": None, "lng": None},
+                        headers={auth.HEADER: key})
+        assert r.status_code == 403
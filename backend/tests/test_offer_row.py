@@ -0,0 +1,96 @@
+"""
+Проверка строк оффера (_offer_row): любое кривое значение — ValueError этой строки,
+а не 500 на весь POST /merchant/offers/bulk и не падение COPY.
+
+    cd backend && python -m pytest -q tests
+"""
+import contextlib
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main  # noqa: E402
+import store  # noqa: E402
+
+VALID = {"merchant_id": 1, "title": "Набор", "price": "199,90", "stock": 3, "expires_at": "2030-01-01 10:00"}
+
+
+def row(**changes):
+    payload = {**VALID, **changes}
+    return dict(zip(store.OFFER_COLUMNS, main._offer_row({k: v for k, v in payload.items() if v is not ...})))
+
+
+def test_valid_row():
+    r = row(description="  ", category=None)
+    assert r["price_cents"] == 19990
+    assert str(r["price"]) == "199.90"
+    assert r["description"] is None
+    assert r["category"] == "other"
+    assert r["image_url"] == main.NO_PHOTO_URL
+
+
+def test_legacy_fields():
+    r = row(price=..., stock=..., merchant_id=..., restaurant_id="7", price_cents=19900, qty_left="4",
+            original_price_cents=34900)
+    assert (r["merchant_id"], r["price_cents"], r["original_price_cents"], r["stock"]) == (7, 19900, 34900, 4)
+
+
+@pytest.mark.parametrize("changes", [
+    {"category": 7},
+    {"image_url": ["a"]},
+    {"description": 5},
+    {"title": {"ru": "x"}},
+    {"expires_at": 1700000000},
+    {"price": True},
+    {"price": [1]},
+    {"price": 99999999999},
+    {"price": "1e30"},
+    {"price": float("nan")},
+    {"price": ..., "price_cents": 2**31},
+    {"price": ..., "price_cents": 1.5},
+    {"original_price_cents": -1},
+    {"stock": 2**31},
+    {"stock": "1.5"},
+    {"stock": {"n": 1}},
+    {"merchant_id": 2**31},
+    {"merchant_id": [1]},
+    {"merchant_id": "abc"},
+])
+def test_bad_values_are_row_errors(changes):
+    with pytest.raises(ValueError):
+        row(**changes)
+
+
+def test_bulk_rows_error_per_row(monkeypatch):
+    # одна плохая строка не мешает соседним: POST /merchant/offers/bulk без базы
+    copied = []
+
+    class Conn:
+        def transaction(self):
+            return contextlib.nullcontext()
+
+    @contextlib.asynccontextmanager
+    async def fake_db():
+        yield Conn()
+
+    async def existing_merchants(conn, merchant_ids):
+        return {store.MerchantId(1)} & set(merchant_ids)
+
+    async def copy_offers(conn, records):
+        copied.extend(records)
+
+    monkeypatch.setattr(main, "MERCHANT_AUTH", False)
+    monkeypatch.setattr(main, "_db", fake_db)
+    monkeypatch.setattr(store, "existing_merchants", existing_merchants)
+    monkeypatch.setattr(store, "copy_offers", copy_offers)
+    items = [VALID, {**VALID, "category": 7}, {**VALID, "price": 99999999999}, {**VALID, "merchant_id": 2}, VALID]
+    r = TestClient(main.app).post("/merchant/offers/bulk", json=items)
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert body["inserted"] == 2 and len(copied) == 2
+    assert [e["row"] for e in body["errors"]] == [2, 3, 4]
+    assert body["errors"][2]["error"] == "Unknown merchant_id"
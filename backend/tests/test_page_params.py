@@ -0,0 +1,34 @@
+"""
+/public/offers/page: кривые min_price/max_price и курсор — 400 до похода в базу:
+без соединения из пула, без 500 от asyncpg и без дорогой арифметики Decimal.
+
+    cd backend && python -m pytest -q tests
+"""
+import base64
+import time
+
+import pytest
+
+
+def _cursor(raw: str) -> str:
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+@pytest.mark.parametrize("params", [
+    {"max_price": "1e12"},
+    {"max_price": "1e1000000"},
+    {"max_price": "1e100000"},
+    {"min_price": "-1"},
+    {"min_price": "NaN"},
+    {"max_price": "Infinity"},
+    {"cursor": "!!!"},
+    {"cursor": _cursor("2030-01-01T00:00:00+00:00|99999999999")},
+    {"cursor": _cursor("2030-01-01T00:00:00+00:00|-1")},
+    {"cursor": _cursor("not a date|1")},
+])
+def test_rejected_before_db(no_db_client, params):
+    t0 = time.process_time()
+    r = no_db_client.get("/public/offers/page", params=params)
+    # NaN/Infinity FastAPI отсекает сам (422)
+    assert r.status_code in (400, 422), r.text
+    assert time.process_time() - t0 < 0.1
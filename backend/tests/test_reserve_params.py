@@ -0,0 +1,34 @@
+"""
+/public/reserve и /merchant/redeem: нестроковые name/phone/code, дробные и огромные
+offer_id/qty — 400 до похода в базу, а не 500 от .strip() или Postgres.
+
+    cd backend && python -m pytest -q tests
+"""
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize("payload", [
+    {},
+    {"offer_id": 1.9},
+    {"offer_id": 2**31},
+    {"offer_id": "1e3"},
+    {"offer_id": [1]},
+    {"offer_id": True},
+    {"offer_id": 1, "qty": 2**40},
+    {"offer_id": 1, "qty": 0},
+    {"offer_id": 1, "qty": 1.5},
+    {"offer_id": 1, "name": 5},
+    {"offer_id": 1, "phone": {"n": 1}},
+])
+def test_reserve_rejected_before_db(no_db_client, payload):
+    r = no_db_client.post("/public/reserve", json=payload)
+    assert r.status_code == 400, r.text
+
+
+@pytest.mark.parametrize("payload", [{}, {"code": 5}, {"code": ["A"]}, {"code": "  "}])
+def test_redeem_rejected_before_db(no_db_client, monkeypatch, payload):
+    monkeypatch.setattr(main, "MERCHANT_AUTH", False)
+    r = no_db_client.post("/merchant/redeem", json=payload)
+    assert r.status_code == 400, r.text
@@ -0,0 +1,150 @@
+"""
+Пропускная способность рассылки бота против фейкового Bot API.
+
+Фейковый Bot API (aiohttp, в этом процессе) ведёт себя как Telegram: больше
+--server-rate сообщений в секунду на бота или чаще раза в --server-chat-interval
+в один чат — отвечает 429 с retry_after. Broadcaster из bot/broadcast.py шлёт
+--messages сообщений каждому из --subscribers чатов; меряется устойчивая
+скорость принятых сервером сообщений, число 429 и время до последнего.
+
+Прогоны: --rates через запятую, например 25 (в пределах лимита) и 1000
+(«как получится» — упирается в 429 и паузы retry_after).
+
+  python bench/bot_broadcast.py --subscribers 500 --messages 2 --rates 25,1000
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+from collections import deque
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from upload_latency import free_port
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot"))
+
+import broadcast  # noqa: E402
+
+TOKEN = "123456:BENCH"
+
+
+class FakeBotAPI:
+    def __init__(self, rate: float, chat_interval: float, latency: float):
+        self.rate = rate
+        self.chat_interval = chat_interval
+        self.latency = latency
+        self.reset()
+
+    def reset(self):
+        self.accepted = 0
+        self.rejected = 0
+        self.window: deque = deque()
+        self.chat_last: dict = {}
+        self.first_at = 0.0
+        self.last_at = 0.0
+
+    def _retry_after(self, chat_id: int, now: float) -> int:
+        while self.window and self.window[0] <= now - 1.0:
+            self.window.popleft()
+        if len(self.window) >= self.rate:
+            return 1
+        last = self.chat_last.get(chat_id)
+        if last is not None and now - last < self.chat_interval:
+            return 1
+        return 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        fields = dict(await request.post())
+        await asyncio.sleep(self.latency)
+        chat_id = int(fields["chat_id"])
+        now = time.monotonic()
+        retry_after = self._retry_after(chat_id, now)
+        if retry_after:
+            self.rejected += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {retry_after}",
+                "parameters": {"retry_after": retry_after},
+            }, status=429)
+        self.window.append(now)
+        self.chat_last[chat_id] = now
+        self.accepted += 1
+        self.first_at = self.first_at or now
+        self.last_at = now
+        return web.json_response({"ok": True, "result": {
+            "message_id": self.accepted, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "text": fields.get("text", ""),
+        }})
+
+
+async def start_fake(api: FakeBotAPI):
+    app = web.Application()
+    app.router.add_route("POST", "/bot{token}/{method}", api.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    port = free_port()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def run_rate(api: FakeBotAPI, url: str, rate: float, args) -> bool:
+    api.reset()
+    bot = Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(url)))
+    b = broadcast.Broadcaster(bot, rate=rate, burst=args.burst, per_chat_interval=args.chat_interval,
+                              workers=args.workers, max_attempts=args.max_attempts)
+    b.start()
+    total = args.subscribers * args.messages
+    t0 = time.monotonic()
+    for i in range(args.messages):
+        b.submit(range(1, args.subscribers + 1), f"bench {i}")
+    submit_ms = (time.monotonic() - t0) * 1000
+    deadline = t0 + args.timeout
+    while b.stats()["pending"] and time.monotonic() < deadline:
+        await asyncio.sleep(0.2)
+    elapsed = time.monotonic() - t0
+    st = b.stats()
+    await b.stop()
+    await bot.session.close()
+
+    sustained = api.accepted / (api.last_at - api.first_at) if api.last_at > api.first_at else 0.0
+    print(
+        f"rate={rate:<6g} sent={st['sent']}/{total} failed={st['failed']} in {elapsed:.1f}s "
+        f"| server accepted={api.accepted} 429={api.rejected} sustained={sustained:.1f} msg/s "
+        f"| retried={st['retried']} deferred_per_chat={st['deferred_per_chat']} submit={submit_ms:.1f}ms"
+    )
+    return st["sent"] == total
+
+
+async def run(args) -> bool:
+    api = FakeBotAPI(args.server_rate, args.server_chat_interval, args.latency_ms / 1000.0)
+    runner, url = await start_fake(api)
+    print(f"subscribers={args.subscribers} messages/chat={args.messages} server limit={args.server_rate:g}/s, "
+          f"1 per {args.server_chat_interval:g}s per chat, latency={args.latency_ms:g}ms")
+    try:
+        ok = True
+        for rate in args.rates.split(","):
+            ok = await run_rate(api, url, float(rate), args) and ok
+        return ok
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--subscribers", type=int, default=500)
+    ap.add_argument("--messages", type=int, default=2, help="сообщений в каждый чат (проверка лимита на чат)")
+    ap.add_argument("--rates", default="25,1000", help="BROADCAST_RATE для прогонов")
+    ap.add_argument("--burst", type=float, default=5.0, help="BROADCAST_BURST")
+    ap.add_argument("--chat-interval", type=float, default=1.0, help="BROADCAST_PER_CHAT_INTERVAL")
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--max-attempts", type=int, default=5)
+    ap.add_argument("--server-rate", type=float, default=30.0)
+    ap.add_argument("--server-chat-interval", type=float, default=1.0)
+    ap.add_argument("--latency-ms", type=float, default=30.0)
+    ap.add_argument("--timeout", type=float, default=300.0)
+    sys.exit(0 if asyncio.run(run(ap.parse_args())) else 1)
@@ -0,0 +1,239 @@
+"""
+Нагрузка на webhook бота: повтор апдейтов против заглушки Bot API.
+
+Поднимает в этом процессе заглушку Bot API (aiohttp, отвечает на любой метод
+с задержкой --api-delay-ms, как медленный api.telegram.org) и bot_webhook
+(uvicorn) отдельным процессом с BOT_API_URL на неё. Затем шлёт апдейты в
+/tg/webhook: чаты параллельно (--concurrency), внутри чата — по очереди, как
+Telegram; доля --dup-rate апдейтов отправляется повторно (ретрай Telegram),
+а на 503 (очередь бота полна) апдейт доставляется заново через Retry-After.
+
+Апдейты — из JSONL (--updates, по одному Update на строку) или синтетические
+"/start offer_<n>" по --chats чатам. Для синтетических проверяется порядок:
+ответы в каждом чате должны идти с неубывающим n.
+
+Меряет задержку ответа webhook (p50/p95/p99), время до отправки последнего
+ответа бота и число лишних ответов на дубли, для каждого --modes.
+
+  pip install httpx
+  python bench/bot_webhook_replay.py --chats 200 --per-chat 10 --api-delay-ms 100 --modes inline,queue
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+from collections import defaultdict
+
+import httpx
+from aiohttp import web
+
+from upload_latency import free_port, percentiles, wait_http
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT = os.path.join(ROOT, "bot")
+TOKEN = "123456:BENCH"
+SECRET = "bench-secret"
+
+
+class StubBotAPI:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.calls = 0
+        self.replies = defaultdict(list)  # chat_id -> [offer n | None]
+        self.last_at = 0.0
+        self.message_id = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        fields = dict(await request.post()) if request.body_exists else {}
+        if not fields and request.content_type == "application/json":
+            fields = await request.json()
+        await asyncio.sleep(self.delay)
+        self.calls += 1
+        self.last_at = time.perf_counter()
+        if method.lower() != "sendmessage":
+            return web.json_response({"ok": True, "result": True})
+        chat_id = int(fields["chat_id"])
+        n = None
+        markup = fields.get("reply_markup")
+        if markup and "?offer=" in markup:
+            n = int(markup.split("?offer=", 1)[1].split('"', 1)[0])
+        self.replies[chat_id].append(n)
+        self.message_id += 1
+        return web.json_response({"ok": True, "result": {
+            "message_id": self.message_id, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "text": fields.get("text", ""),
+        }})
+
+    def reset(self):
+        self.calls = 0
+        self.replies.clear()
+
+    def order_violations(self) -> int:
+        bad = 0
+        for seq in self.replies.values():
+            nums = [n for n in seq if n is not None]
+            bad += sum(1 for a, b in zip(nums, nums[1:]) if b < a)
+        return bad
+
+
+async def start_stub(stub: StubBotAPI) -> tuple[web.AppRunner, str]:
+    app = web.Application()
+    app.router.add_route("*", "/bot{token}/{method}", stub.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    port = free_port()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def start_bot(api_url: str, mode: str, workers: int) -> tuple[subprocess.Popen, str]:
+    port = free_port()
+    env = dict(
+        os.environ, BOT_TOKEN=TOKEN, WEBHOOK_SECRET=SECRET, BOT_API_URL=api_url,
+        WEBHOOK_MODE=mode, BOT_WORKERS=str(workers),
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "bot_webhook:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BOT, env=env,
+    )
+    base = f"http://127.0.0.1:{port}"
+    wait_http(base + "/health")
+    return proc, base
+
+
+def synthetic(chats: int, per_chat: int) -> list[dict]:
+    out, uid = [], 1000
+    for i in range(per_chat):
+        for c in range(chats):
+            uid += 1
+            chat_id = 10_000 + c
+            out.append({
+                "update_id": uid,
+                "message": {
+                    "message_id": uid, "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+                    "text": f"/start offer_{i}",
+                    "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+                },
+            })
+    return out
+
+
+def load_updates(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def chat_of(upd: dict):
+    for field, value in upd.items():
+        if isinstance(value, dict):
+            chat = value.get("chat") or (value.get("message") or {}).get("chat") or value.get("from")
+            if chat:
+                return chat["id"]
+    return upd.get("update_id")
+
+
+async def replay(base: str, updates: list[dict], concurrency: int, dup_rate: float, rng: random.Random) -> dict:
+    by_chat = defaultdict(list)
+    for upd in updates:
+        by_chat[chat_of(upd)].append(upd)
+    gate = asyncio.Semaphore(concurrency)
+    latencies, statuses = [], defaultdict(int)
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+
+    async def send(client: httpx.AsyncClient, upd: dict):
+        while True:
+            t0 = time.perf_counter()
+            r = await client.post("/tg/webhook", json=upd, headers=headers)
+            latencies.append(time.perf_counter() - t0)
+            statuses[r.status_code] += 1
+            if r.status_code < 500:
+                return
+            # как Telegram: не-2xx — доставить тот же апдейт ещё раз чуть позже
+            await asyncio.sleep(float(r.headers.get("retry-after", "1")))
+
+    async def chat_worker(client: httpx.AsyncClient, seq: list[dict]):
+        for upd in seq:
+            async with gate:
+                await send(client, upd)
+                if rng.random() < dup_rate:
+                    await send(client, upd)
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base, timeout=120.0, limits=limits) as client:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(chat_worker(client, seq) for seq in by_chat.values()))
+        sent_in = time.perf_counter() - t0
+    return {"t0": t0, "sent_in": sent_in, "latency": percentiles(latencies), "statuses": dict(statuses), "posts": len(latencies)}
+
+
+async def run_mode(stub: StubBotAPI, api_url: str, mode: str, updates: list[dict], args) -> bool:
+    proc, base = start_bot(api_url, mode, args.workers)
+    try:
+        stub.reset()
+        res = await replay(base, updates, args.concurrency, args.dup_rate, random.Random(args.seed))
+        # в режиме queue ответы бота уходят уже после 200 — ждём, пока поток вызовов затихнет
+        deadline = time.perf_counter() + args.drain_timeout
+        while time.perf_counter() < deadline:
+            calls = stub.calls
+            await asyncio.sleep(0.5)
+            if stub.calls == calls and stub.calls >= len(updates):
+                break
+        done_in = max(stub.last_at, res["t0"] + res["sent_in"]) - res["t0"]
+        metrics = httpx.get(base + "/stats").json()
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+    lat = res["latency"]
+    extra = stub.calls - len(updates)
+    violations = stub.order_violations()
+    print(
+        f"{mode:<7} webhook p50={lat['p50']:.1f}ms p95={lat['p95']:.1f}ms p99={lat['p99']:.1f}ms "
+        f"| posts={res['posts']} statuses={res['statuses']} acked in {res['sent_in']:.2f}s "
+        f"| bot replies={stub.calls} (extra {extra:+d}) done in {done_in:.2f}s "
+        f"= {len(updates) / done_in:.0f} upd/s | order violations={violations}"
+    )
+    if mode == "queue":
+        q = metrics["updates"]
+        print(f"        queue: duplicates={q['duplicates']} rejected_full={q['rejected_full']} "
+              f"max_depth={q['max_depth']} failed={q['failed']}")
+    for name, t in sorted(metrics.get("timings", {}).items()):
+        print(f"        {name:<22} n={t['count']:<6} avg={t['avg_ms']:.1f}ms max={t['max_ms']:.1f}ms")
+    return violations == 0 and (mode != "queue" or stub.calls == len(updates))
+
+
+async def run(args) -> bool:
+    updates = load_updates(args.updates) if args.updates else synthetic(args.chats, args.per_chat)
+    stub = StubBotAPI(args.api_delay_ms / 1000.0)
+    runner, api_url = await start_stub(stub)
+    print(f"updates={len(updates)} concurrency={args.concurrency} api_delay={args.api_delay_ms}ms "
+          f"dup_rate={args.dup_rate:g} workers={args.workers}")
+    try:
+        ok = True
+        for mode in args.modes.split(","):
+            ok = await run_mode(stub, api_url, mode.strip(), updates, args) and ok
+        return ok
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--updates", help="JSONL с записанными апдейтами")
+    ap.add_argument("--chats", type=int, default=200)
+    ap.add_argument("--per-chat", type=int, default=10)
+    ap.add_argument("--concurrency", type=int, default=40, help="одновременных POST (max_connections у Telegram — до 100)")
+    ap.add_argument("--api-delay-ms", type=float, default=100.0)
+    ap.add_argument("--dup-rate", type=float, default=0.05)
+    ap.add_argument("--workers", type=int, default=16)
+    ap.add_argument("--modes", default="inline,queue")
+    ap.add_argument("--drain-timeout", type=float, default=60.0)
+    ap.add_argument("--seed", type=int, default=1)
+    sys.exit(0 if asyncio.run(run(ap.parse_args())) else 1)
@@ -0,0 +1,87 @@
+"""
+CPU на сериализацию ответа с офферами: jsonenc std (jsonable_encoder + json.dumps,
+как было) против fast (orjson).
+
+Строки — настоящие asyncpg.Record с теми же типами, что у витрины (int, text,
+numeric(10,2), timestamptz), но собранные generate_series: запрос ничего не читает
+и не пишет, подходит любая база. Меряется process_time на «запрос»: dict из строк,
+image_srcset и кодирование в байты — всё, что backend делает после fetch.
+
+  DATABASE_URL=postgresql://... python bench/json_encode.py --rows 200,50 --repeat 500
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+import asyncpg
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import images  # noqa: E402
+import jsonenc  # noqa: E402
+
+ROWS_SQL = """
+    SELECT g AS id,
+           'Набор №' || g AS title,
+           CASE WHEN g % 3 = 0 THEN NULL ELSE 'Выпечка и салаты на вечер' END AS description,
+           (100 + g % 800) * 100 AS price_cents,
+           CASE WHEN g % 4 = 0 THEN (200 + g % 800) * 100 END AS original_price_cents,
+           1 + g % 10 AS stock,
+           (ARRAY['bakery', 'ready_food', 'drinks'])[1 + g % 3] AS category,
+           CASE WHEN g % 2 = 0
+                THEN 'https://cdn.example.com/offers/' || md5(g::text) || '/1280.jpg'
+                ELSE 'https://example.com/photo.jpg' END AS image_url,
+           NOW() + make_interval(mins => g) AS expires_at,
+           'active' AS status,
+           1 + g % 50 AS merchant_id,
+           'Пекарня ' || (1 + g % 50) AS merchant_name,
+           'ул. Пушкина, ' || g AS address
+    FROM generate_series(1, $1) AS g
+"""
+
+
+def offer_dict(r: asyncpg.Record) -> dict:
+    # как main._offer_dict
+    d = dict(r)
+    d["price"] = d["price_cents"] / 100
+    d["image_srcset"] = images.srcset_for(d.get("image_url"))
+    return d
+
+
+def measure(rows: list, dumps, repeat: int) -> tuple[float, int]:
+    body = b""
+    t0 = time.process_time()
+    for _ in range(repeat):
+        body = dumps([offer_dict(r) for r in rows])
+    return (time.process_time() - t0) / repeat, len(body)
+
+
+async def main(args) -> int:
+    conn = await asyncpg.connect(os.environ["DATABASE_URL"])
+    try:
+        for n in args.rows:
+            rows = await conn.fetch(ROWS_SQL, n)
+            std_body = jsonenc.dumps_std([offer_dict(r) for r in rows])
+            fast_body = jsonenc.dumps_fast([offer_dict(r) for r in rows])
+            same = "identical" if std_body == fast_body else "DIFFERENT"
+            std, size = measure(rows, jsonenc.dumps_std, args.repeat)
+            fast, _ = measure(rows, jsonenc.dumps_fast, args.repeat)
+            print(f"rows={n:<4} body={size / 1024:.1f}KB  std={std * 1000:.3f}ms  fast={fast * 1000:.3f}ms "
+                  f"CPU/request  x{std / fast:.1f}  ({same} bytes)")
+            if std_body != fast_body:
+                return 1
+    finally:
+        await conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=lambda s: [int(x) for x in s.split(",")], default=[200, 50])
+    ap.add_argument("--repeat", type=int, default=500)
+    args = ap.parse_args()
+    if not os.environ.get("DATABASE_URL"):
+        sys.exit("DATABASE_URL is required")
+    sys.exit(asyncio.run(main(args)))
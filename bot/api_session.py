@@ -0,0 +1,30 @@
+"""
+Одна настроенная aiohttp-сессия к Bot API на процесс.
+
+Все вызовы бота (ответы на апдейты, рассылка) идут через один пул соединений
+с keep-alive: TLS к api.telegram.org поднимается один раз, а не на каждый запрос.
+"""
+import os
+
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+
+# свой Bot API сервер (local bot-api или заглушка в bench/); пусто — api.telegram.org
+BOT_API_URL = os.getenv("BOT_API_URL", "").rstrip("/")
+BOT_HTTP_LIMIT = int(os.getenv("BOT_HTTP_LIMIT", "100"))          # соединений всего
+BOT_HTTP_KEEPALIVE = float(os.getenv("BOT_HTTP_KEEPALIVE", "60"))  # сек держать простаивающее соединение
+BOT_HTTP_TIMEOUT = float(os.getenv("BOT_HTTP_TIMEOUT", "30"))      # сек на запрос к Bot API
+
+
+def make_session() -> AiohttpSession:
+    api = TelegramAPIServer.from_base(BOT_API_URL) if BOT_API_URL else PRODUCTION
+    session = AiohttpSession(api=api, timeout=BOT_HTTP_TIMEOUT)
+    # aiogram 3.4.1 (requirements.txt) не принимает параметры коннектора в AiohttpSession,
+    # а по умолчанию держит только limit=100 — дополняем его аргументы до создания ClientSession
+    session._connector_init.update(
+        limit=BOT_HTTP_LIMIT,
+        limit_per_host=BOT_HTTP_LIMIT,
+        keepalive_timeout=BOT_HTTP_KEEPALIVE,
+        ttl_dns_cache=3600,
+    )
+    return session
@@ -1,16 +1,47 @@
 import os
-from fastapi import FastAPI, Request, HTTPException
-from aiogram import Bot, Dispatcher
+import html
+import secrets
+from functools import lru_cache
+from typing import Any, Dict
+from fastapi import FastAPI, Request, HTTPException, Response, Body
+from aiogram import Bot, Dispatcher, F
 from aiogram.enums.parse_mode import ParseMode
 from aiogram.client.default import DefaultBotProperties
-from aiogram.types import Update, InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
-from aiogram.filters import CommandStart
+from aiogram.types import (
+    Update, InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo,
+    ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove,
+)
+from aiogram.filters import CommandStart, Command
+
+import broadcast
+import instrumentation
+import timing
+import updates
+from api_session import make_session
+from subscriptions import SubscriptionStore
 
 BOT_TOKEN = os.getenv("BOT_TOKEN","")
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET","foodySecret123")
 WEBAPP_PUBLIC = os.getenv("WEBAPP_PUBLIC","https://example.com").rstrip("/")
 WEBAPP_BUYER_URL = os.getenv("WEBAPP_BUYER_URL", f"{WEBAPP_PUBLIC}/web/buyer/")
 WEBAPP_MERCHANT_URL = os.getenv("WEBAPP_MERCHANT_URL", f"{WEBAPP_PUBLIC}/web/merchant/")
+# queue — ответ Telegram сразу, обработка в пуле воркеров; inline — как раньше, внутри запроса
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "queue")
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "8"))
+BOT_QUEUE_SIZE = int(os.getenv("BOT_QUEUE_SIZE", "1000"))
+BOT_DEDUP_SIZE = int(os.getenv("BOT_DEDUP_SIZE", "10000"))
+BOT_ENQUEUE_TIMEOUT = float(os.getenv("BOT_ENQUEUE_TIMEOUT", "1.0"))
+# Рассылка: база с подписками, ключ для POST /broadcast/offer и лимиты Telegram
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+BROADCAST_KEY = os.getenv("BROADCAST_KEY", "")
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))  # сообщений/с на бота (лимит Telegram ~30)
+BROADCAST_BURST = float(os.getenv("BROADCAST_BURST", "5"))
+BROADCAST_PER_CHAT_INTERVAL = float(os.getenv("BROADCAST_PER_CHAT_INTERVAL", "1.0"))
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))
+BROADCAST_QUEUE_SIZE = int(os.getenv("BROADCAST_QUEUE_SIZE", "100000"))
+SUBSCRIBE_RADIUS_KM = float(os.getenv("SUBSCRIBE_RADIUS_KM", "3"))
+SUBSCRIBE_MAX_RADIUS_KM = float(os.getenv("SUBSCRIBE_MAX_RADIUS_KM", "10"))
+OFFER_KB_CACHE = int(os.getenv("OFFER_KB_CACHE", "1024"))  # клавиатур с deep-link на оффер в LRU
 
 def _https(u:str)->str:
     u = (u or "").strip()
@@ -21,17 +52,93 @@ def _https(u:str)->str:
 WEBAPP_BUYER_URL = _https(WEBAPP_BUYER_URL)
 WEBAPP_MERCHANT_URL = _https(WEBAPP_MERCHANT_URL)
 
-bot = Bot(BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+bot = Bot(BOT_TOKEN, session=make_session(), default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 dp = Dispatcher()
 app = FastAPI()
+app.add_middleware(instrumentation.MetricsMiddleware)
+_timings = timing.Timings()
+timing.install(dp, bot, _timings)
+
+async def _handle(data: dict):
+    await dp.feed_update(bot, Update.model_validate(data))
+
+_updates = updates.UpdateQueue(
+    _handle, workers=BOT_WORKERS, capacity=BOT_QUEUE_SIZE,
+    dedup_size=BOT_DEDUP_SIZE, enqueue_timeout=BOT_ENQUEUE_TIMEOUT, timings=_timings,
+)
+_subs = SubscriptionStore(DATABASE_URL, max_radius_km=SUBSCRIBE_MAX_RADIUS_KM) if DATABASE_URL else None
+
+async def _on_forbidden(chat_id: int):
+    # пользователь заблокировал бота — больше не пишем
+    try:
+        await _subs.unsubscribe(chat_id)
+    except Exception as e:
+        print("BROADCAST_UNSUBSCRIBE_ERROR:", chat_id, repr(e))
+
+_broadcaster = broadcast.Broadcaster(
+    bot, rate=BROADCAST_RATE, burst=BROADCAST_BURST, per_chat_interval=BROADCAST_PER_CHAT_INTERVAL,
+    workers=BROADCAST_WORKERS, capacity=BROADCAST_QUEUE_SIZE,
+    on_forbidden=_on_forbidden if _subs else None,
+)
+
+@app.on_event("startup")
+async def _startup():
+    if WEBHOOK_MODE == "queue":
+        _updates.start()
+    if _subs:
+        await _subs.open()
+    _broadcaster.start()
+
+@app.on_event("shutdown")
+async def _shutdown():
+    if WEBHOOK_MODE == "queue":
+        await _updates.stop()
+    await _broadcaster.stop()
+    if _subs:
+        await _subs.close()
+    await bot.session.close()
 
 @app.get("/health")
 async def health(): return {"ok": True}
 
-def main_kb():
+instrumentation.register_stats({
+    "updates": lambda: _updates.stats(),
+    "broadcast": lambda: _broadcaster.stats(),
+})
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus text format; то же в JSON — GET /stats.
+    """
+    body, content_type = instrumentation.render()
+    return Response(body, media_type=content_type)
+
+@app.get("/stats")
+async def stats():
+    return {
+        "mode": WEBHOOK_MODE,
+        "updates": _updates.stats(),
+        "broadcast": _broadcaster.stats(),
+        "timings": _timings.snapshot(),
+        "offer_kb_cache": offer_kb.cache_info()._asdict(),
+    }
+
+# Клавиатуры собираются один раз — aiogram только сериализует их при отправке
+MAIN_KB = InlineKeyboardMarkup(inline_keyboard=[[
+    InlineKeyboardButton(text="🛒 Витрина", web_app=WebAppInfo(url=WEBAPP_BUYER_URL)),
+    InlineKeyboardButton(text="👨‍🍳 ЛК партнёра", web_app=WebAppInfo(url=WEBAPP_MERCHANT_URL))
+]])
+SUBSCRIBE_KB = ReplyKeyboardMarkup(
+    keyboard=[[KeyboardButton(text="📍 Отправить геопозицию", request_location=True)]],
+    resize_keyboard=True, one_time_keyboard=True,
+)
+REMOVE_KB = ReplyKeyboardRemove()
+
+@lru_cache(maxsize=OFFER_KB_CACHE)
+def offer_kb(offer_id):
     return InlineKeyboardMarkup(inline_keyboard=[[
-        InlineKeyboardButton(text="🛒 Витрина", web_app=WebAppInfo(url=WEBAPP_BUYER_URL)),
-        InlineKeyboardButton(text="👨‍🍳 ЛК партнёра", web_app=WebAppInfo(url=WEBAPP_MERCHANT_URL))
+        InlineKeyboardButton(text="Открыть предложение", web_app=WebAppInfo(url=f"{WEBAPP_BUYER_URL}?offer={offer_id}"))
     ]])
 
 @dp.message(CommandStart())
@@ -41,17 +148,64 @@ async def on_start(m):
         payload = m.text.split(" ",1)[1].strip()
     if payload and payload.startswith("offer_"):
         offer_id = payload.split("offer_",1)[1]
-        kb = InlineKeyboardMarkup(inline_keyboard=[[
-            InlineKeyboardButton(text="Открыть предложение", web_app=WebAppInfo(url=f"{WEBAPP_BUYER_URL}?offer={offer_id}"))
-        ]])
-        await m.answer("Вот предложение 👇", reply_markup=kb); return
-    await m.answer("Привет! Я помогу спасти еду 💚\nВыбери раздел:", reply_markup=main_kb())
+        await m.answer("Вот предложение 👇", reply_markup=offer_kb(offer_id)); return
+    await m.answer("Привет! Я помогу спасти еду 💚\nВыбери раздел:", reply_markup=MAIN_KB)
+
+@dp.message(Command("subscribe"))
+async def on_subscribe(m):
+    if not _subs:
+        await m.answer("Подписка пока недоступна."); return
+    await m.answer("Пришли геопозицию — сообщу о новых предложениях рядом.", reply_markup=SUBSCRIBE_KB)
+
+@dp.message(F.location)
+async def on_location(m):
+    if not _subs:
+        return
+    await _subs.subscribe(m.chat.id, m.location.latitude, m.location.longitude, SUBSCRIBE_RADIUS_KM)
+    await m.answer(
+        f"Готово! Пришлю новые предложения в радиусе {SUBSCRIBE_RADIUS_KM:g} км.\n/stop — отписаться.",
+        reply_markup=REMOVE_KB,
+    )
+
+@dp.message(Command("stop"))
+async def on_stop(m):
+    if _subs and await _subs.unsubscribe(m.chat.id):
+        await m.answer("Подписка отключена. /subscribe — включить снова."); return
+    await m.answer("Подписки нет. /subscribe — подписаться.")
+
+@app.post("/broadcast/offer")
+async def broadcast_offer(request: Request, payload: Dict[str, Any] = Body(...)):
+    """
+    «Новое предложение рядом» всем подписчикам, в чей радиус попадает точка.
+    Тело: {offer_id, title, price?, lat, lng}. Ответ — сколько сообщений поставлено в очередь.
+    """
+    got = request.headers.get("x-foody-broadcast-key") or ""
+    if not BROADCAST_KEY or not secrets.compare_digest(got.encode(), BROADCAST_KEY.encode()):
+        raise HTTPException(401, "bad key")
+    if not _subs:
+        raise HTTPException(503, "subscriptions are not configured")
+    try:
+        offer_id = int(payload["offer_id"])
+        lat, lng = float(payload["lat"]), float(payload["lng"])
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(400, "offer_id, lat and lng are required")
+    text = f"🔥 Рядом новое предложение: <b>{html.escape(str(payload.get('title') or ''))}</b>"
+    if payload.get("price") is not None:
+        text += f" — {html.escape(str(payload['price']))} ₽"
+    queued = 0
+    async for chat_ids in _subs.nearby(lat, lng):
+        queued += _broadcaster.submit(chat_ids, text, reply_markup=offer_kb(str(offer_id)))
+    return {"queued": queued}
 
 @app.post("/tg/webhook")
 async def tg_webhook(request: Request):
     if request.headers.get("x-telegram-bot-api-secret-token") != WEBHOOK_SECRET:
         raise HTTPException(401, "bad secret")
     data = await request.json()
-    upd = Update.model_validate(data)
-    await dp.feed_update(bot, upd)
+    if WEBHOOK_MODE != "queue":
+        await _handle(data)
+        return "OK"
+    if await _updates.submit(data) == updates.FULL:
+        # не 200 — Telegram повторит доставку позже, повтор отсечётся по update_id
+        return Response("busy", status_code=503, headers={"Retry-After": "1"})
     return "OK"
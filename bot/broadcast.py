@@ -0,0 +1,219 @@
+"""
+Массовая рассылка в Telegram с учётом лимитов Bot API.
+
+Лимиты Telegram: ~30 сообщений/с на бота суммарно и ~1 сообщение/с в один чат.
+  * общий поток держит token bucket (rate, burst);
+  * в один чат — не чаще per_chat_interval: сообщение в «горячий» чат
+    откладывается, воркер тем временем берёт следующее;
+  * 429 приходит с retry_after — ставим на паузу весь bucket (флуд-контроль
+    у Telegram общий на бота) и повторяем сообщение после паузы;
+  * сетевые ошибки и 5xx — повтор с экспоненциальной задержкой, до max_attempts;
+  * 403 (бот заблокирован) — не повторяем, отдаём chat_id в on_forbidden.
+
+submit() только кладёт сообщения в очередь и сразу возвращается — рассылка идёт
+своими воркерами и не задерживает обработку апдейтов webhook.
+"""
+import time
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+# окно rate() в /stats (rate_10s)
+RATE_WINDOW = 10.0
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        # ждущие берут токены по очереди, без толкотни
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class _Message:
+    __slots__ = ("chat_id", "text", "kwargs", "attempt")
+
+    def __init__(self, chat_id: int, text: str, kwargs: Dict[str, Any]):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.attempt = 0
+
+
+class Broadcaster:
+    def __init__(self, bot: Bot, rate: float = 25.0, burst: float = 5.0, per_chat_interval: float = 1.0,
+                 workers: int = 8, capacity: int = 100_000, max_attempts: int = 5,
+                 on_forbidden: Optional[Callable[[int], Awaitable[None]]] = None):
+        self.bot = bot
+        self.per_chat_interval = per_chat_interval
+        self.workers = workers
+        self.capacity = capacity
+        self.max_attempts = max_attempts
+        self.on_forbidden = on_forbidden
+        self.bucket = TokenBucket(rate, burst)
+        self._queue: asyncio.Queue = asyncio.Queue()
+        # chat_id -> когда в этот чат снова можно писать
+        self._chat_ready_at: Dict[int, float] = {}
+        self._size = 0  # в очереди + отложенные + в отправке
+        self._delayed = 0
+        self._tasks: List[asyncio.Task] = []
+        # вызовы on_forbidden: ссылки держим до завершения, иначе задачу может собрать GC
+        self._forbidden_tasks: Set[asyncio.Task] = set()
+        # время отправок за последние RATE_WINDOW секунд (rate())
+        self._sent_at: deque = deque()
+        self.stats_counters = {
+            "queued": 0, "dropped": 0, "sent": 0, "failed": 0, "retried": 0,
+            "rate_limited": 0, "forbidden": 0, "deferred_per_chat": 0,
+        }
+
+    def start(self):
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        # отписки заблокировавших бота — дописываем, а не обрываем
+        await asyncio.gather(*self._forbidden_tasks, return_exceptions=True)
+
+    def _forbidden_done(self, task: asyncio.Task):
+        self._forbidden_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print("BROADCAST_FORBIDDEN_ERROR:", repr(task.exception()))
+
+    def submit(self, chat_ids: Iterable[int], text: str, **kwargs) -> int:
+        """
+        Ставит text в очередь для каждого chat_id (kwargs уходят в send_message).
+        Возвращает, сколько принято; сверх capacity сообщения отбрасываются.
+        """
+        accepted = 0
+        for chat_id in chat_ids:
+            if self._size >= self.capacity:
+                self.stats_counters["dropped"] += 1
+                continue
+            self._size += 1
+            accepted += 1
+            self._queue.put_nowait(_Message(chat_id, text, kwargs))
+        self.stats_counters["queued"] += accepted
+        return accepted
+
+    def _later(self, msg: _Message, delay: float):
+        self._delayed += 1
+
+        def requeue():
+            self._delayed -= 1
+            self._queue.put_nowait(msg)
+
+        asyncio.get_running_loop().call_later(delay, requeue)
+
+    def _retry(self, msg: _Message, delay: float) -> bool:
+        msg.attempt += 1
+        if msg.attempt >= self.max_attempts:
+            return False
+        self.stats_counters["retried"] += 1
+        self._later(msg, delay)
+        return True
+
+    def _mark_chat(self, chat_id: int, now: float):
+        self._chat_ready_at[chat_id] = now + self.per_chat_interval
+        if len(self._chat_ready_at) > 50_000:
+            self._chat_ready_at = {k: v for k, v in self._chat_ready_at.items() if v > now}
+
+    async def _worker(self):
+        c = self.stats_counters
+        while True:
+            msg = await self._queue.get()
+            wait = self._chat_ready_at.get(msg.chat_id, 0.0) - time.monotonic()
+            if wait > 0:
+                c["deferred_per_chat"] += 1
+                self._later(msg, wait)
+                continue
+            # занимаем чат до ожидания токена, иначе второе сообщение в тот же чат проскочит проверку
+            self._mark_chat(msg.chat_id, time.monotonic())
+            await self.bucket.acquire()
+            done = True
+            try:
+                await self.bot.send_message(msg.chat_id, msg.text, **msg.kwargs)
+                c["sent"] += 1
+                self._sent_at.append(time.monotonic())
+                self._trim_sent()
+            except TelegramRetryAfter as e:
+                c["rate_limited"] += 1
+                self.bucket.pause(e.retry_after)
+                done = not self._retry(msg, e.retry_after)
+                if done:
+                    c["failed"] += 1
+            except (TelegramNetworkError, TelegramServerError) as e:
+                done = not self._retry(msg, min(30.0, 2.0 ** msg.attempt))
+                if done:
+                    c["failed"] += 1
+                    print("BROADCAST_SEND_ERROR:", msg.chat_id, repr(e))
+            except TelegramForbiddenError:
+                c["forbidden"] += 1
+                if self.on_forbidden:
+                    task = asyncio.create_task(self.on_forbidden(msg.chat_id))
+                    self._forbidden_tasks.add(task)
+                    task.add_done_callback(self._forbidden_done)
+            except Exception as e:
+                c["failed"] += 1
+                print("BROADCAST_SEND_ERROR:", msg.chat_id, repr(e))
+            # интервал считаем и от ответа: Telegram видит запрос позже, чем мы его отправили
+            self._mark_chat(msg.chat_id, time.monotonic())
+            if done:
+                self._size -= 1
+
+    def _trim_sent(self):
+        # режем и на каждой отправке: без опроса /stats очередь росла бы без конца
+        edge = time.monotonic() - RATE_WINDOW
+        while self._sent_at and self._sent_at[0] < edge:
+            self._sent_at.popleft()
+
+    def rate(self) -> float:
+        """
+        Отправлено сообщений в секунду за последние RATE_WINDOW секунд.
+        """
+        self._trim_sent()
+        return len(self._sent_at) / RATE_WINDOW
+
+    def stats(self) -> Dict[str, Any]:
+        out = dict(self.stats_counters)
+        out.update({
+            "pending": self._size,
+            "queue": self._queue.qsize(),
+            "delayed": self._delayed,
+            "capacity": self.capacity,
+            "rate_10s": round(self.rate(), 2),
+            "bucket_rate": self.bucket.rate,
+        })
+        return out
@@ -0,0 +1,77 @@
+"""
+Метрики Prometheus бота (GET /metrics).
+
+  foody_bot_http_*        — ASGI-middleware: задержка и ответы по шаблону маршрута (/tg/webhook, ...);
+  foody_bot_stage_seconds — этапы апдейта из timing.py (queue:wait, update:*, handler:*, api:*);
+  foody_bot_<раздел>_*    — текущие счётчики очереди апдейтов и рассылки.
+"""
+import time
+from typing import Any, Callable, Dict
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HTTP_REQUESTS = Counter("foody_bot_http_requests_total", "HTTP responses", ["method", "route", "status"])
+HTTP_LATENCY = Histogram("foody_bot_http_request_duration_seconds", "HTTP request duration",
+                         ["method", "route"], buckets=LATENCY_BUCKETS)
+HTTP_IN_FLIGHT = Gauge("foody_bot_http_requests_in_flight", "HTTP requests being handled")
+STAGE = Histogram("foody_bot_stage_seconds", "Time spent per update stage", ["stage"], buckets=LATENCY_BUCKETS)
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        t0 = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope["method"]
+            HTTP_LATENCY.labels(method, route).observe(time.perf_counter() - t0)
+            HTTP_REQUESTS.labels(method, route, str(status)).inc()
+
+
+class _StatsCollector:
+    def __init__(self, sources: Dict[str, Callable[[], Dict[str, Any]]]):
+        self.sources = sources
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        for section, fn in self.sources.items():
+            try:
+                stats = fn()
+            except Exception as e:
+                print("METRICS_COLLECT_ERROR:", section, repr(e))
+                continue
+            for key, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                g = GaugeMetricFamily(f"foody_bot_{section}_{key}", f"{section} {key}")
+                g.add_metric([], value)
+                yield g
+
+
+def register_stats(sources: Dict[str, Callable[[], Dict[str, Any]]]):
+    REGISTRY.register(_StatsCollector(sources))
+
+
+def render() -> tuple:
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
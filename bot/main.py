@@ -1,32 +1,41 @@
 import os
 import asyncio
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Response
 from aiogram import Bot, Dispatcher, types
 from aiogram.types import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
 
+import instrumentation
+import timing
+from api_session import make_session
+
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "webhook")
 WEBAPP_PUBLIC = os.getenv("WEBAPP_PUBLIC", "https://foodyweb-production.up.railway.app")
 
-bot = Bot(token=BOT_TOKEN)
+bot = Bot(token=BOT_TOKEN, session=make_session())
 dp = Dispatcher()
 app = FastAPI()
+app.add_middleware(instrumentation.MetricsMiddleware)
+_timings = timing.Timings()
+timing.install(dp, bot, _timings)
+
+# статичная клавиатура — собираем один раз
+START_KB = InlineKeyboardMarkup(inline_keyboard=[[
+    InlineKeyboardButton(text="🛍 Витрина", url=f"{WEBAPP_PUBLIC}/web/buyer/"),
+    InlineKeyboardButton(text="🏪 Ресторан (ЛК)", url=f"{WEBAPP_PUBLIC}/web/merchant/")
+],[
+    InlineKeyboardButton(text="📋 Регистрация ресторана", url=f"{WEBAPP_PUBLIC}/web/merchant/register/")
+]])
 
 @dp.message(Command("start"))
 async def start_handler(message: types.Message):
-    kb = InlineKeyboardMarkup(inline_keyboard=[[
-        InlineKeyboardButton(text="🛍 Витрина", url=f"{WEBAPP_PUBLIC}/web/buyer/"),
-        InlineKeyboardButton(text="🏪 Ресторан (ЛК)", url=f"{WEBAPP_PUBLIC}/web/merchant/")
-    ],[
-        InlineKeyboardButton(text="📋 Регистрация ресторана", url=f"{WEBAPP_PUBLIC}/web/merchant/register/")
-    ]])
     await message.answer(
         "Привет! Это Foody.\n\n"
         "• Витрина — посмотреть предложения рядом.\n"
         "• Личный кабинет — управлять офферами.\n"
         "• Регистрация — создать ресторан и получить ключи.",
-        reply_markup=kb
+        reply_markup=START_KB
     )
 
 @app.post(f"/{WEBHOOK_SECRET}")
@@ -40,6 +49,19 @@ async def telegram_webhook(request: Request):
 async def health():
     return {"ok": True}
 
+@app.get("/metrics")
+async def metrics():
+    body, content_type = instrumentation.render()
+    return Response(body, media_type=content_type)
+
+@app.get("/stats")
+async def stats():
+    return {"timings": _timings.snapshot()}
+
+@app.on_event("shutdown")
+async def _shutdown():
+    await bot.session.close()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=int(os.getenv("PORT", 8000)))
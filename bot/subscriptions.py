@@ -0,0 +1,80 @@
+"""
+Подписки на «новое предложение рядом»: chat_id + точка + радиус.
+
+Таблица bot_subscriptions создаётся миграциями backend (backend/migrations.py),
+бот ходит в ту же базу по DATABASE_URL.
+"""
+import math
+from typing import AsyncIterator, List
+
+import asyncpg
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEG = 111.32
+
+_NEARBY_SQL = """
+    WITH p AS (SELECT $1::float8 AS lat, $2::float8 AS lng)
+    SELECT chat_id FROM bot_subscriptions, p
+    WHERE active
+      AND bot_subscriptions.lat BETWEEN p.lat - $3::float8 AND p.lat + $3::float8
+      AND bot_subscriptions.lng BETWEEN p.lng - $4::float8 AND p.lng + $4::float8
+      AND 2 * $5::float8 * asin(least(1, sqrt(
+            power(sin(radians(bot_subscriptions.lat - p.lat) / 2), 2)
+            + cos(radians(p.lat)) * cos(radians(bot_subscriptions.lat))
+              * power(sin(radians(bot_subscriptions.lng - p.lng) / 2), 2)
+          ))) <= radius_km
+"""
+
+
+class SubscriptionStore:
+    def __init__(self, dsn: str, max_radius_km: float = 10.0, pool_max: int = 5):
+        self.dsn = dsn
+        self.max_radius_km = max_radius_km
+        self.pool_max = pool_max
+        self._pool: asyncpg.pool.Pool | None = None
+
+    async def open(self):
+        self._pool = await asyncpg.create_pool(
+            self.dsn, min_size=1, max_size=self.pool_max,
+            server_settings={"application_name": "foody-bot"},
+        )
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+
+    async def subscribe(self, chat_id: int, lat: float, lng: float, radius_km: float):
+        radius_km = max(0.1, min(radius_km, self.max_radius_km))
+        await self._pool.execute(
+            """
+            INSERT INTO bot_subscriptions (chat_id, lat, lng, radius_km)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (chat_id) DO UPDATE
+              SET lat = EXCLUDED.lat, lng = EXCLUDED.lng, radius_km = EXCLUDED.radius_km,
+                  active = TRUE, updated_at = NOW()
+            """,
+            chat_id, lat, lng, radius_km,
+        )
+
+    async def unsubscribe(self, chat_id: int) -> bool:
+        status = await self._pool.execute(
+            "UPDATE bot_subscriptions SET active = FALSE, updated_at = NOW() WHERE chat_id = $1 AND active",
+            chat_id,
+        )
+        return status != "UPDATE 0"
+
+    async def nearby(self, lat: float, lng: float, batch: int = 1000) -> AsyncIterator[List[int]]:
+        """
+        chat_id подписчиков, в чей радиус попадает точка, пачками по batch —
+        тысячи подписчиков не собираются в один список.
+        """
+        dlat = self.max_radius_km / KM_PER_DEG
+        dlng = self.max_radius_km / (KM_PER_DEG * max(0.01, math.cos(math.radians(lat))))
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                cur = await conn.cursor(_NEARBY_SQL, lat, lng, dlat, dlng, EARTH_RADIUS_KM)
+                while True:
+                    rows = await cur.fetch(batch)
+                    if not rows:
+                        return
+                    yield [r["chat_id"] for r in rows]
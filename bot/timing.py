@@ -0,0 +1,86 @@
+"""
+Где бот тратит время на апдейт.
+
+  update:<тип>     — весь апдейт в диспетчере (outer middleware на dp.update);
+  handler:<имя>    — сработавший хендлер (inner middleware на dp.message / dp.callback_query);
+  api:<метод>      — вызов Bot API (request middleware на сессии бота).
+
+update минус handler — фильтры и роутинг, handler минус api — собственный код хендлера.
+Гистограммы — в Prometheus (foody_bot_stage_seconds{stage=...}), в snapshot() — count/avg/max.
+"""
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+from instrumentation import STAGE
+
+
+class Timings:
+    def __init__(self):
+        self._series: Dict[str, Dict[str, Any]] = {}
+
+    def observe(self, name: str, seconds: float):
+        STAGE.labels(name).observe(seconds)
+        s = self._series.get(name)
+        if s is None:
+            s = self._series[name] = {"count": 0, "sum": 0.0, "max": 0.0}
+        s["count"] += 1
+        s["sum"] += seconds
+        s["max"] = max(s["max"], seconds)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        out = {}
+        for name, s in self._series.items():
+            out[name] = {
+                "count": s["count"],
+                "avg_ms": round(s["sum"] / s["count"] * 1000, 3),
+                "max_ms": round(s["max"] * 1000, 3),
+            }
+        return out
+
+
+class UpdateTimingMiddleware(BaseMiddleware):
+    def __init__(self, timings: Timings):
+        self.timings = timings
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event: Any, data: Dict[str, Any]) -> Any:
+        t0 = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.timings.observe("update:" + (getattr(event, "event_type", None) or "unknown"), time.perf_counter() - t0)
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    def __init__(self, timings: Timings):
+        self.timings = timings
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event: Any, data: Dict[str, Any]) -> Any:
+        t0 = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            obj = data.get("handler")
+            name = getattr(getattr(obj, "callback", None), "__name__", "unknown")
+            self.timings.observe("handler:" + name, time.perf_counter() - t0)
+
+
+class ApiTimingMiddleware(BaseRequestMiddleware):
+    def __init__(self, timings: Timings):
+        self.timings = timings
+
+    async def __call__(self, make_request, bot, method):
+        t0 = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            self.timings.observe("api:" + method.__api_method__, time.perf_counter() - t0)
+
+
+def install(dp, bot, timings: Timings):
+    dp.update.outer_middleware(UpdateTimingMiddleware(timings))
+    dp.message.middleware(HandlerTimingMiddleware(timings))
+    dp.callback_query.middleware(HandlerTimingMiddleware(timings))
+    bot.session.middleware(ApiTimingMiddleware(timings))
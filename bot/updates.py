@@ -0,0 +1,175 @@
+"""
+Очередь апдейтов Telegram для webhook.
+
+Webhook только кладёт апдейт в очередь и сразу отвечает 200 — медленный хендлер
+или Bot API больше не держат ответ, и Telegram не шлёт повторы. Апдейты разбирает
+пул из N воркеров:
+  * порядок внутри одного чата сохраняется: у чата не бывает двух апдейтов в работе;
+  * разные чаты обрабатываются параллельно;
+  * повтор с тем же update_id (ретрай Telegram) отбрасывается;
+  * очередь ограничена: если места нет дольше enqueue_timeout, submit() возвращает
+    FULL, webhook отвечает 503 и Telegram доставит апдейт позже.
+"""
+import time
+import asyncio
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+ACCEPTED = "accepted"
+DUPLICATE = "duplicate"
+FULL = "full"
+
+
+def chat_key(data: Dict[str, Any]) -> Hashable:
+    """
+    Ключ упорядочивания: id чата (или пользователя для inline/callback без сообщения).
+    Апдейты без чата упорядочивать не нужно — ключом служит сам update_id.
+    """
+    for field, value in data.items():
+        if field == "update_id" or not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat and "id" in chat:
+            return chat["id"]
+        user = value.get("from") or value.get("user")
+        if user and "id" in user:
+            return user["id"]
+    return ("update", data.get("update_id"))
+
+
+class UpdateQueue:
+    def __init__(self, handler: Callable[[Dict[str, Any]], Awaitable[None]], workers: int = 8,
+                 capacity: int = 1000, dedup_size: int = 10000, enqueue_timeout: float = 1.0,
+                 timings: Optional[Any] = None):
+        self.handler = handler
+        # timing.Timings: сколько апдейт ждал воркера ("queue:wait")
+        self.timings = timings
+        self.workers = workers
+        self.capacity = capacity
+        self.dedup_size = dedup_size
+        self.enqueue_timeout = enqueue_timeout
+        self._slots = asyncio.Semaphore(capacity)
+        # ключ чата -> (время постановки, апдейт) по порядку; первый — в работе или ждёт воркера
+        self._pending: Dict[Hashable, Deque[Tuple[float, Dict[str, Any]]]] = {}
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._seen: "OrderedDict[int, None]" = OrderedDict()
+        self._tasks: List[asyncio.Task] = []
+        self._depth = 0
+        self._busy = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.stats_counters = {
+            "received": 0, "accepted": 0, "duplicates": 0, "rejected_full": 0,
+            "processed": 0, "failed": 0, "max_depth": 0,
+            "handle_seconds_total": 0.0, "handle_seconds_max": 0.0,
+            "enqueue_wait_seconds_max": 0.0,
+        }
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    def start(self):
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self, drain_timeout: float = 5.0):
+        """
+        Даёт воркерам дообработать очередь (не дольше drain_timeout) и гасит их.
+        """
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            print("BOT_QUEUE_DRAIN_TIMEOUT: dropped", self._depth)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def _remember(self, update_id: Optional[int]) -> bool:
+        if update_id is None:
+            return True
+        if update_id in self._seen:
+            return False
+        self._seen[update_id] = None
+        if len(self._seen) > self.dedup_size:
+            self._seen.popitem(last=False)
+        return True
+
+    async def submit(self, data: Dict[str, Any]) -> str:
+        c = self.stats_counters
+        c["received"] += 1
+        update_id = data.get("update_id")
+        if update_id is not None and update_id in self._seen:
+            c["duplicates"] += 1
+            return DUPLICATE
+
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            c["rejected_full"] += 1
+            return FULL
+        c["enqueue_wait_seconds_max"] = max(c["enqueue_wait_seconds_max"], time.perf_counter() - t0)
+        # пока ждали место, тот же апдейт мог прийти повторно и уже встать в очередь
+        if not self._remember(update_id):
+            self._slots.release()
+            c["duplicates"] += 1
+            return DUPLICATE
+
+        key = chat_key(data)
+        self._depth += 1
+        self._idle.clear()
+        c["accepted"] += 1
+        c["max_depth"] = max(c["max_depth"], self._depth)
+        chat = self._pending.get(key)
+        item = (time.perf_counter(), data)
+        if chat is None:
+            self._pending[key] = deque([item])
+            self._ready.put_nowait(key)
+        else:
+            chat.append(item)
+        return ACCEPTED
+
+    async def _worker(self):
+        c = self.stats_counters
+        while True:
+            key = await self._ready.get()
+            chat = self._pending[key]
+            enqueued_at, data = chat[0]
+            self._busy += 1
+            t0 = time.perf_counter()
+            if self.timings is not None:
+                self.timings.observe("queue:wait", t0 - enqueued_at)
+            try:
+                await self.handler(data)
+                c["processed"] += 1
+            except Exception as e:
+                c["failed"] += 1
+                print("BOT_UPDATE_ERROR:", data.get("update_id"), repr(e))
+            finally:
+                elapsed = time.perf_counter() - t0
+                c["handle_seconds_total"] += elapsed
+                c["handle_seconds_max"] = max(c["handle_seconds_max"], elapsed)
+                self._busy -= 1
+                chat.popleft()
+                if chat:
+                    # следующий апдейт чата — в конец общей очереди, чтобы болтливый чат не занимал воркер
+                    self._ready.put_nowait(key)
+                else:
+                    del self._pending[key]
+                self._depth -= 1
+                self._slots.release()
+                if self._depth == 0:
+                    self._idle.set()
+
+    def stats(self) -> Dict[str, Any]:
+        out = dict(self.stats_counters)
+        out.update({
+            "depth": self._depth,
+            "capacity": self.capacity,
+            "chats_pending": len(self._pending),
+            "workers": self.workers,
+            "workers_busy": self._busy,
+        })
+        return out
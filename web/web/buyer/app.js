@@ -4,6 +4,10 @@
   const API = (window.__FOODY__&&window.__FOODY__.FOODY_API)||"https://foodyback-production.up.railway.app";
 
   let offers=[];
+  // /public/offers отдаёт stock и price_cents; старый API — qty_left и только price_cents
+  const cents = (o)=> o.price_cents ?? Math.round((o.price||0)*100);
+  const left = (o)=> o.stock ?? o.qty_left;
+  const byExpiry = (a,b)=> new Date(a.expires_at||0) - new Date(b.expires_at||0);
   const grid = $('#grid'), q = $('#q');
 
   function render(){
@@ -12,13 +16,13 @@
     const list = offers.filter(o => !qs || (o.title||'').toLowerCase().includes(qs));
     if (!list.length){ grid.innerHTML = '<div class="card"><div class="p">Нет офферов</div></div>'; return; }
     list.forEach(o=>{
-      const price = (o.price_cents||0)/100, old = (o.original_price_cents||0)/100;
+      const price = cents(o)/100, old = (o.original_price_cents||0)/100;
       const disc = old>0? Math.round((1-price/old)*100):0;
       const el = document.createElement('div'); el.className='card';
       el.innerHTML = '<img src="'+(o.image_url||'')+'" alt="">' +
         '<div class="p"><div class="price">'+price.toFixed(0)+' ₽'+(old?'<span class="badge">-'+disc+'%</span>':'')+'</div>' +
         '<div>'+(o.title||'—')+'</div>' +
-        '<div class="meta"><span>Осталось: '+(o.qty_left??'—')+'</span></div></div>';
+        '<div class="meta"><span>Осталось: '+(left(o)??'—')+'</span></div></div>';
       el.onclick = ()=>open(o); grid.appendChild(el);
     });
   }
@@ -26,9 +30,9 @@
   function open(o){
     $('#sTitle').textContent = o.title||'—';
     $('#sImg').src = o.image_url||'';
-    $('#sPrice').textContent = ((o.price_cents||0)/100).toFixed(0)+' ₽';
+    $('#sPrice').textContent = (cents(o)/100).toFixed(0)+' ₽';
     const old=(o.original_price_cents||0)/100; $('#sOld').textContent = old? (old.toFixed(0)+' ₽') : '—';
-    $('#sQty').textContent = (o.qty_left??'—') + ' / ' + (o.qty_total??'—');
+    $('#sQty').textContent = (left(o)??'—') + ' / ' + (o.qty_total??'—');
     $('#sExp').textContent = o.expires_at? new Date(o.expires_at).toLocaleString('ru-RU') : '—';
     $('#sDesc').textContent = o.description||'';
     $('#sheet').classList.remove('hidden');
@@ -47,6 +51,33 @@
   const toastBox = document.getElementById('toast');
   const toast = (m)=>{ const el=document.createElement('div'); el.className='toast'; el.textContent=m; toastBox.appendChild(el); setTimeout(()=>el.remove(),3200); };
 
-  async function load(){ offers = await fetch(API+'/api/v1/offers').then(r=>r.json()).catch(()=>[]); render(); }
-  load();
+  async function load(){
+    const data = await fetch(API+'/public/offers').then(r=>r.ok? r.json() : []).catch(()=>[]);
+    offers = Array.isArray(data)? data : []; render();
+  }
+  // reload приходит всем клиентам разом (крупный импорт, переподключение) — разносим запросы во времени
+  let reloadTimer = null;
+  const reloadSoon = ()=>{ if (!reloadTimer) reloadTimer = setTimeout(()=>{ reloadTimer=null; load(); }, Math.random()*3000); };
+
+  // Живые обновления: дельты остатков/новых офферов вместо перезагрузки всего списка
+  function live(){
+    if (!window.EventSource) return;
+    const es = new EventSource(API+'/public/offers/live');
+    es.addEventListener('offer', (e)=>{
+      let ev; try{ ev = JSON.parse(e.data); }catch(_){ return; }
+      if (ev.type==='stock'){
+        const o = offers.find(x=>(x.id||x.offer_id)===ev.id); if (!o) return;
+        o.qty_left = ev.stock; o.stock = ev.stock;
+        if (!ev.stock) offers = offers.filter(x=>x!==o);
+        render();
+      } else if (ev.type==='expired'){ offers = offers.filter(x=>(x.id||x.offer_id)!==ev.id); render(); }
+      else if (ev.type==='created' && ev.offer){
+        // новый оффер целиком в событии — список не перечитываем
+        if (!left(ev.offer) || offers.some(x=>(x.id||x.offer_id)===ev.offer.id)) return;
+        offers.push(ev.offer); offers.sort(byExpiry); render();
+      }
+      else reloadSoon();
+    });
+  }
+  load(); live();
 })();
\ No newline at end of file